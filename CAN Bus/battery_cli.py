@@ -0,0 +1,203 @@
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# Incremental parser for the XR Battery's Serial/CLI output, as sent over the CAN Bus.
+#
+# CLI output arrives as raw ASCII bytes in frames on channel 0x11 (`arbitration_id & 0x00000FF0 == 0x00000110`).
+# Bytes are accumulated as they arrive, and only complete lines are decoded. When a command has been sent with
+# `expect()`, its output lines are turned into a typed result, ex: the per-cell millivolts of GETAFECELLS.
+#
+# The exact output format of each command isn't documented, so recognition is deliberately lenient:
+#  - GETAFECELLS is complete once `cell_count` cell voltages have been read (13 for a 13S XR pack). Any line with a
+#    cell number and a voltage in the Li-Ion range counts, ex: "Cell 3: 3712mV" or "C03 3712".
+#  - Other commands (PFAILRESET, REBOOT, ...) are complete on their first line of output that isn't the echoed command.
+#  - Any command is also complete when a CLI prompt ("> ") line is seen.
+# If a response never completes, the caller can `finish()` it after its own timeout and use what was parsed.
+
+import re
+import typing
+
+CLI_CHANNEL_MASK = 0x00000FF0
+CLI_CHANNEL_ID = 0x00000110
+
+# 13S2P, see Hardware/XR Battery.md
+XR_CELL_COUNT = 13
+
+# Anything outside this isn't a plausible Li-Ion cell reading in mV
+CELL_MV_MIN = 500
+CELL_MV_MAX = 5000
+
+CELL_LINE_PATTERN = re.compile(r"\b(?:cell|c)\s*#?\s*(\d{1,2})\D+?(\d+(?:\.\d+)?)\s*(m?v)?", re.IGNORECASE)
+PROMPT_PATTERN = re.compile(r"^\s*\S*>\s*$")
+
+# Don't let a runaway response (or garbage on the CLI channel) grow without bound
+MAX_LINE_LENGTH = 256
+MAX_RESPONSE_LINES = 256
+
+
+def is_cli_frame(arbitration_id: int) -> bool:
+    return arbitration_id & CLI_CHANNEL_MASK == CLI_CHANNEL_ID
+
+
+class AfeCellsResult(typing.NamedTuple):
+    cells_mv: list  # Index 0 is cell 1
+    lines: list
+
+    @property
+    def min_mv(self) -> int:
+        return min(self.cells_mv)
+
+    @property
+    def max_mv(self) -> int:
+        return max(self.cells_mv)
+
+    @property
+    def delta_mv(self) -> int:
+        return self.max_mv - self.min_mv
+
+    @property
+    def total_mv(self) -> int:
+        return sum(self.cells_mv)
+
+
+class CommandResult(typing.NamedTuple):
+    command: str
+    lines: list
+
+
+def parse_cell_line(line: str):
+    """
+    Returns (cell number, millivolts) for a line that looks like a cell voltage, otherwise None.
+    """
+    match = CELL_LINE_PATTERN.search(line)
+    if match is None:
+        return None
+
+    cell = int(match.group(1))
+    value = float(match.group(2))
+
+    # "3.712V" style readings
+    if (match.group(3) is not None and match.group(3).lower() == "v") or value < 10:
+        value = value * 1000
+
+    if not CELL_MV_MIN <= value <= CELL_MV_MAX:
+        return None
+
+    return cell, int(round(value))
+
+
+class CliResponseParser:
+
+    def __init__(self, cell_count: int = XR_CELL_COUNT):
+        self.cell_count = cell_count
+
+        self.buffer = bytearray()
+
+        self.command = None
+        self.lines = []
+        self.cells = {}
+        self.result = None
+
+    def expect(self, command: str):
+        """
+        Starts collecting the response to `command`. Any unfinished response is discarded.
+        """
+        self.command = command.strip().upper()
+        self.lines = []
+        self.cells = {}
+        self.result = None
+
+    def feed(self, data) -> list:
+        """
+        Adds CLI output bytes, and returns the complete lines they finished.
+        """
+        self.buffer.extend(data)
+
+        lines = []
+        while True:
+            end = self.buffer.find(b"\n")
+            if end < 0:
+                break
+
+            raw_line = self.buffer[:end]
+            del self.buffer[:end + 1]
+            lines.append(raw_line.decode("ascii", errors="replace").strip("\r\x00"))
+
+        # Output that never ends a line (ex: the prompt) is handled as a line once it gets too long, or is a prompt
+        if len(self.buffer) > MAX_LINE_LENGTH or self.buffer.rstrip().endswith(b">"):
+            lines.append(self.buffer.decode("ascii", errors="replace").strip("\r\x00"))
+            self.buffer.clear()
+
+        for line in lines:
+            self._on_line(line)
+
+        return lines
+
+    def _on_line(self, line: str):
+        if self.command is None or self.result is not None:
+            return
+
+        stripped = line.strip()
+        if not stripped or stripped.upper() == self.command:
+            return
+
+        if PROMPT_PATTERN.match(line):
+            self.finish()
+            return
+
+        if len(self.lines) < MAX_RESPONSE_LINES:
+            self.lines.append(stripped)
+
+        if self.command == "GETAFECELLS":
+            cell = parse_cell_line(stripped)
+            if cell is not None:
+                self.cells[cell[0]] = cell[1]
+                if len(self.cells) >= self.cell_count:
+                    self.finish()
+        else:
+            self.finish()
+
+    def finish(self):
+        """
+        Completes the current response with whatever has been parsed so far.
+        """
+        if self.command is None or self.result is not None:
+            return self.result
+
+        if self.command == "GETAFECELLS":
+            # Only report a cell result if at least one cell was read
+            if self.cells:
+                self.result = AfeCellsResult([self.cells[cell] for cell in sorted(self.cells)], self.lines)
+            else:
+                self.result = CommandResult(self.command, self.lines)
+        else:
+            self.result = CommandResult(self.command, self.lines)
+
+        return self.result
+
+    @property
+    def complete(self) -> bool:
+        return self.result is not None
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
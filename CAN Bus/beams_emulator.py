@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import time
+import can
+
+from can_filters import open_bus, parse_bus
+from sr_battery_emulator import AsyncSRBattery, SRBattery
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can
+
+# Boosted Beams accessory emulator, and a runner for a whole test rig in one process.
+#
+# A Python take on `Accessory/beams_emulator.ino` -- see `Accessory/README.md` for the protocol. Each emulated light
+# registers with the ESC (`[FE 00 00 00 00 <light> 37 13]` to `0x10339200`, where light 00 is the headlights and 01
+# the taillights), then follows the ESC's light commands: `0x22` on (with brightness), `0x23` off, `0x62` / `0x42`
+# blinking on / off.
+#
+# The ESC cuts accessory power if nothing registers in time -- `Accessory/README.md` gives both 5 and 10 seconds, so
+# the emulator works to the shorter. Registration is sent as soon as the ESC's half-second heartbeat (`0x1039320N`)
+# shows it's listening, or after `--register-after` seconds without one. Without a heartbeat there's no telling whether
+# the ESC heard it, so it's repeated every second until one shows up (then sent once more) or the window closes. The
+# taillights register a little after the headlights, so the ESC always numbers them second.
+#
+# The accessory protocol has no acknowledgement frame, so a command is "acknowledged" by applying it -- the time from
+# the notifier thread handing the frame to the event loop to the light's state changing is recorded per command type
+# and reported at the end. (Interface receive timestamps aren't used, as not every interface stamps frames with the
+# host's clock.)
+#
+# With `--sr-bus`, an SR battery (`sr_battery_emulator.AsyncSRBattery`) runs on the BMS bus in the same event loop,
+# so one host stands in for both the pack and the accessories:
+#
+#  python3 beams_emulator.py -a socketcan:can1 --sr-bus socketcan:can0
+
+REGISTRATION_ID = 0x10339200
+HEARTBEAT_MASK = 0xFFFFFFF0
+HEARTBEAT_ID = 0x10393200
+
+# The ESC cuts the accessory rail if nothing has registered by then
+REGISTRATION_WINDOW = 5.0
+REGISTRATION_RETRY = 1.0
+
+LIGHT_POSITIONS = {"front": 0x00, "back": 0x01}
+
+# Taillights register after the headlights, so they're always the ESC's second light
+BACK_REGISTRATION_DELAY = 0.1
+
+COMMAND_ON = 0x22
+COMMAND_OFF = 0x23
+COMMAND_BLINK_ON = 0x62
+COMMAND_BLINK_OFF = 0x42
+
+COMMAND_NAMES = {
+    COMMAND_ON: "on",
+    COMMAND_OFF: "off",
+    COMMAND_BLINK_ON: "blink on",
+    COMMAND_BLINK_OFF: "blink off",
+}
+
+
+class BeamLight:
+    """
+    The state of one emulated light.
+    """
+
+    def __init__(self, position: str = "front", serial: int = 0x1337):
+        if position not in LIGHT_POSITIONS:
+            raise ValueError(f"position must be one of {tuple(LIGHT_POSITIONS)}")
+
+        self.position = position
+        self.serial = serial
+
+        self.on = False
+        self.brightness = 0
+        self.blinking = False
+
+        # The index the ESC addresses this light by -- the order it registered in
+        self.index = None
+        self.registered_at = None
+
+    def registration_message(self) -> can.Message:
+        return can.Message(arbitration_id=REGISTRATION_ID,
+                           data=[0xFE, 0x00, 0x00, 0x00, 0x00, LIGHT_POSITIONS[self.position],
+                                 self.serial & 0xFF, (self.serial >> 8) & 0xFF],
+                           is_extended_id=True)
+
+    def apply(self, command: int, value: int) -> bool:
+        """
+        Applies a light command. Returns False if the command isn't one the lights know.
+        """
+        if command == COMMAND_ON:
+            self.on = True
+            self.brightness = value
+        elif command == COMMAND_OFF:
+            self.on = False
+            self.brightness = 0
+        elif command == COMMAND_BLINK_ON:
+            self.blinking = True
+        elif command == COMMAND_BLINK_OFF:
+            self.blinking = False
+        else:
+            return False
+        return True
+
+    def describe(self) -> str:
+        if not self.on:
+            return "off"
+        return f"on, brightness {self.brightness}{', blinking' if self.blinking else ''}"
+
+
+class CommandLatency:
+    __slots__ = ("count", "total", "maximum")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, latency: float):
+        self.count = self.count + 1
+        self.total = self.total + latency
+        self.maximum = max(self.maximum, latency)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class AsyncBeams:
+    """
+    Emulated Beams on the accessory bus, run as a task on an asyncio event loop.
+    """
+
+    def __init__(self, bus, lights, name: str = "Beams", register_after: float = 2.0, verbose: bool = True):
+        self.bus = bus
+        self.lights = list(lights)
+        self.name = name
+        self.register_after = register_after
+        self.verbose = verbose
+
+        self.started = None
+        self.heartbeat_seen = None
+        self.esc_listening = asyncio.Event()
+
+        self.latencies = {command: CommandLatency() for command in COMMAND_NAMES}
+        self.unknown_commands = 0
+
+    def log(self, text: str):
+        if self.verbose:
+            print(f"[{self.name}] {text}")
+
+    def on_frame(self, msg: can.Message, dispatched: float = None):
+        """
+        Handles a frame on the event loop. `dispatched` is when it was handed to the loop (`time.monotonic()`), to
+        time the command from -- without it, the command's latency isn't recorded.
+        """
+        # Light commands are 8 bytes, with 0x04 in the second byte, and can arrive on any ID in the range
+        command_frame = len(msg.data) == 8 and msg.data[1] == 0x04
+
+        if msg.arbitration_id & HEARTBEAT_MASK == HEARTBEAT_ID and self.heartbeat_seen is None:
+            self.heartbeat_seen = time.monotonic()
+            self.esc_listening.set()
+
+        # Commands share the heartbeat's IDs, so a heartbeat's counter frame is told apart by its shape, and stops here
+        if not command_frame:
+            return
+
+        light = next((light for light in self.lights if light.index == msg.data[0]), None)
+        if light is None:
+            return
+
+        command = msg.data[2]
+        if not light.apply(command, msg.data[3]):
+            self.unknown_commands = self.unknown_commands + 1
+            self.log(f"{light.position}: unknown command 0x{command:02X}")
+            return
+
+        if dispatched is None:
+            self.log(f"{light.position}: {light.describe()}")
+            return
+
+        latency = time.monotonic() - dispatched
+        self.latencies[command].add(latency)
+        self.log(f"{light.position}: {light.describe()} ({latency * 1000:.2f}ms)")
+
+    async def send_registrations(self) -> bool:
+        """
+        Registers every light. Returns False if a registration couldn't be sent.
+        """
+        # Headlights first, so the ESC numbers them 0x00 and the taillights 0x01
+        lights = sorted(self.lights, key=lambda light: LIGHT_POSITIONS[light.position])
+        for index, light in enumerate(lights):
+            if index > 0:
+                await asyncio.sleep(BACK_REGISTRATION_DELAY)
+
+            try:
+                self.bus.send(light.registration_message())
+            except can.CanError as error:
+                self.log(f"{light.position}: registration failed ({error})")
+                return False
+
+            light.index = index
+            light.registered_at = time.monotonic() - self.started
+
+            late = " -- outside the ESC's window!" if light.registered_at > REGISTRATION_WINDOW else ""
+            self.log(f"{light.position}: registered as light 0x{index:02X} after {light.registered_at:.3f}s{late}")
+        return True
+
+    async def register(self):
+        try:
+            await asyncio.wait_for(self.esc_listening.wait(), self.register_after)
+        except asyncio.TimeoutError:
+            self.log(f"No ESC heartbeat after {self.register_after}s, registering anyway")
+
+        while True:
+            listening = self.esc_listening.is_set()
+            if await self.send_registrations() and listening:
+                return
+
+            remaining = REGISTRATION_WINDOW - (time.monotonic() - self.started)
+            if remaining <= 0:
+                reason = "with registration failing" if listening else "without an ESC heartbeat"
+                self.log(f"Registration window closed {reason}")
+                return
+
+            if listening:
+                # The send failed, so try again shortly
+                await asyncio.sleep(min(REGISTRATION_RETRY, remaining))
+                continue
+
+            try:
+                await asyncio.wait_for(self.esc_listening.wait(), min(REGISTRATION_RETRY, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.started = time.monotonic()
+
+        def dispatch(msg: can.Message):
+            # Runs on the notifier's thread -- stamped here, so the latency includes waiting for the event loop
+            loop.call_soon_threadsafe(self.on_frame, msg, time.monotonic())
+
+        notifier = can.Notifier(self.bus, [dispatch], timeout=0.1)
+
+        try:
+            await self.register()
+            # Commands are handled as they arrive, on the event loop
+            await asyncio.Event().wait()
+        finally:
+            notifier.stop()
+
+    def print_summary(self):
+        for light in self.lights:
+            registered = "not registered" if light.registered_at is None else \
+                f"registered after {light.registered_at:.3f}s"
+            print(f"{light.position:<5}  {registered}, {light.describe()}")
+
+        print("Command     Count   Mean       Max")
+        for command, latency in self.latencies.items():
+            if latency.count:
+                print(f"{COMMAND_NAMES[command]:<10}  {latency.count:<6}  {latency.mean * 1000:7.3f}ms  "
+                      f"{latency.maximum * 1000:7.3f}ms")
+
+
+async def run_rig(accessory_bus, lights, sr_bus=None, register_after: float = 2.0):
+    """
+    Runs the Beams on `accessory_bus`, and an SR battery on `sr_bus` if one is given, in one event loop. Returns when
+    the battery powers off (or runs forever without one).
+    """
+    beams = AsyncBeams(accessory_bus, lights, register_after=register_after)
+    tasks = [asyncio.ensure_future(beams.run())]
+
+    battery = None
+    if sr_bus is not None:
+        battery = AsyncSRBattery(sr_bus, SRBattery(), "SR")
+        tasks.append(asyncio.ensure_future(battery.run()))
+
+    try:
+        if battery is not None:
+            await tasks[1]
+            print(f"[SR] Powered off ({battery.powerOffReason}) after {battery.pings} ESC pings")
+        else:
+            await tasks[0]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        print()
+        beams.print_summary()
+
+    return beams, battery
+
+
+if __name__ == "__main__":
+    print("Boosted Beams Emulator, v1")
+    print("https://github.com/rscullin/beambreak")
+    print()
+
+    parser = argparse.ArgumentParser(
+        prog='beams_emulator.py',
+        description='Emulates Boosted Beams on the accessory bus, optionally alongside an SR battery on the BMS bus.')
+
+    parser.add_argument('-i',
+                        '--interface',
+                        help='Name of the `python-can` interface to use. Defaults to `slcan`',
+                        default="slcan")
+    parser.add_argument('-a',
+                        '--accessory-bus',
+                        help='Accessory bus, as `interface:channel` (or just `channel` to use `--interface`).',
+                        required=True)
+    parser.add_argument('-s',
+                        '--sr-bus',
+                        help='Also emulate an SR battery on this BMS bus, as `interface:channel` (or just `channel`).')
+    parser.add_argument('-l',
+                        '--light',
+                        help='Light to emulate, `front` or `back`. Can be given twice. Defaults to `front`.',
+                        choices=list(LIGHT_POSITIONS),
+                        action='append')
+    parser.add_argument('--register-after',
+                        help='Register this many seconds after starting if no ESC heartbeat has been seen. Defaults '
+                             'to 2.',
+                        type=float,
+                        default=2.0)
+
+    args = parser.parse_args()
+
+    positions = args.light or ["front"]
+    beam_lights = [BeamLight(position, 0x1337 + index) for index, position in enumerate(dict.fromkeys(positions))]
+
+    accessory = open_bus(*parse_bus(args.accessory_bus, args.interface))
+    bms = open_bus(*parse_bus(args.sr_bus, args.interface)) if args.sr_bus else None
+
+    print("CAN Bus initialized!")
+
+    try:
+        asyncio.run(run_rig(accessory, beam_lights, bms, args.register_after))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        accessory.shutdown()
+        if bms is not None:
+            bms.shutdown()
+        print('Done.')
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
\ No newline at end of file
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import signal
+import sys
+import tempfile
+import threading
+import time
+import can
+
+from boosted_binlog import HEADER, RECORD
+from log_replay import LogReplayer
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can print_color
+
+# Reproducible benchmarks for the tools in this directory, over python-can's `virtual` bus (no hardware needed).
+#
+#  - logger: the highest frame rate `boosted_logger.log()` captures without losing frames -- frames are sent at
+#    each rate for a few seconds, and a rate passes if every frame is on disk within a second of the last send
+#  - normalize: CPU time per frame of the ID mask on its own, and of `LogSink` writing both logs (or a .bblog)
+#  - emulator: per-ID period jitter of `sr_battery_emulator.tx()`, measured from a second bus as the ESC would see it
+#  - cli: `send_cli_command()` framing throughput, in commands and frames per second
+#  - xr: time-to-completion of the `xr_battery_util` RLOD reset flow, against `FakeXrBattery` (a scripted battery)
+#
+# Results are printed and written as JSON (`-o`). `--baseline` compares against an earlier JSON file, so regressions
+# between versions stand out. Timings depend on the host -- compare runs from the same machine.
+#
+# The tools under test print as they run; their output is swallowed during each benchmark.
+
+BENCHMARKS = ("logger", "normalize", "emulator", "cli", "xr")
+
+CHANNEL = "boosted_benchmark"
+
+
+def synthetic_frames(count: int, rate: float, start: float = 0.0):
+    """
+    `count` Boosted-style frames `1 / rate` seconds apart, cycling through a few senders and messages.
+    """
+    ids = (0x10374200, 0x10154450, 0x10234170, 0x0B57ED14, 0x10044110)
+    return [can.Message(timestamp=start + index / rate, arbitration_id=ids[index % len(ids)],
+                        data=bytes([index & 0xFF] * 8), is_extended_id=True)
+            for index in range(count)]
+
+
+def interrupt_after(delay: float):
+    """
+    Sends SIGINT to this process after `delay` seconds -- how the logger and emulator, which run until Ctrl-C, are
+    stopped.
+    """
+    timer = threading.Timer(delay, os.kill, (os.getpid(), signal.SIGINT))
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def logger_arguments(directory: str, log_format: str = "binary", buffered: bool = False) -> argparse.Namespace:
+    """
+    The arguments `boosted_logger.py` would parse, with every option at its default.
+    """
+    return argparse.Namespace(directory=directory, interface="virtual", channel=CHANNEL, format=log_format, group=None,
+                              id=None, stats=False, stats_interval=10.0, rolling_check=False, compress="none",
+                              rotate_size=None, rotate_interval=None, index=False, telemetry=False,
+                              telemetry_port=None, buffered=buffered, buffer_size=65536, batch_size=512)
+
+
+def count_logged_frames(directory: str) -> int:
+    frames = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(".bblog"):
+            frames = frames + (os.path.getsize(path) - HEADER.size) // RECORD.size
+        elif name.endswith("_all.log"):
+            with open(path, "rb") as log_file:
+                frames = frames + sum(1 for _ in log_file)
+    return frames
+
+
+def bench_logger(rates=(1000, 2000, 4000, 8000, 16000, 32000), seconds: float = 2.0, log_format: str = "binary",
+                 buffered: bool = False) -> dict:
+    from boosted_logger import log
+
+    results = []
+
+    for rate in rates:
+        frames = synthetic_frames(int(rate * seconds), rate)
+
+        with tempfile.TemporaryDirectory() as directory:
+            sender = can.interface.Bus(interface="virtual", channel=CHANNEL)
+            replayer = LogReplayer(sender, 1.0)
+
+            def send():
+                # Give the logger time to open its bus
+                time.sleep(0.5)
+                replayer.run(frames)
+                interrupt_after(1.0)
+
+            thread = threading.Thread(target=send, daemon=True)
+            thread.start()
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                log(logger_arguments(directory, log_format, buffered))
+
+            thread.join()
+            sender.shutdown()
+
+            written = count_logged_frames(directory)
+
+        results.append({
+            "rate": rate,
+            "sent": len(frames),
+            "achieved_send_rate": replayer.stats.frames_per_second,
+            "written": written,
+            "lost": len(frames) - written,
+        })
+
+    lossless = [result["rate"] for result in results if result["lost"] == 0]
+    return {"format": log_format, "buffered": buffered, "max_lossless_rate": max(lossless) if lossless else 0,
+            "rates": results}
+
+
+def bench_normalize(count: int = 200000) -> dict:
+    from boosted_logger import LogSink
+
+    frames = synthetic_frames(count, 1000.0, 1700000000.0)
+    ids = [msg.arbitration_id for msg in frames]
+
+    started = time.process_time()
+    for arbitration_id in ids:
+        arbitration_id & 0xFF0FFFF0
+    mask_time = time.process_time() - started
+
+    result = {"frames": count, "mask_ns_per_frame": mask_time / count * 1e9}
+
+    for log_format in ("log", "binary"):
+        with tempfile.TemporaryDirectory() as directory:
+            sink = LogSink(directory, "0", log_format)
+            started = time.process_time()
+            for index in range(0, count, 512):
+                sink.on_frames(frames[index:index + 512])
+            sink.stop()
+            elapsed = time.process_time() - started
+
+        result[f"sink_{log_format}_ns_per_frame"] = elapsed / count * 1e9
+
+        # LogSink normalizes the IDs in place for the `_MOD` log
+        for msg, arbitration_id in zip(frames, ids):
+            msg.arbitration_id = arbitration_id
+
+    return result
+
+
+def bench_emulator(seconds: float = 10.0) -> dict:
+    from sr_battery_emulator import PeriodicMessagePeriods, tx
+
+    esc = can.interface.Bus(interface="virtual", channel=CHANNEL)
+    arrivals = {arbitration_id: [] for arbitration_id in PeriodicMessagePeriods}
+
+    def listen():
+        # Wake the emulator up the way the ESC would, then record when every periodic frame arrives
+        time.sleep(0.5)
+        esc.send(can.Message(arbitration_id=0x10346090, data=[0x01], is_extended_id=True))
+
+        ends = time.time() + seconds + 0.5
+        while time.time() < ends:
+            msg = esc.recv(0.1)
+            if msg is not None and msg.arbitration_id in arrivals:
+                arrivals[msg.arbitration_id].append(msg.timestamp)
+
+        interrupt_after(0.0)
+
+    thread = threading.Thread(target=listen, daemon=True)
+    thread.start()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        tx("virtual", CHANNEL)
+
+    thread.join()
+    esc.shutdown()
+
+    result = {}
+    for arbitration_id, times in arrivals.items():
+        period = PeriodicMessagePeriods[arbitration_id]
+        errors = [(later - earlier) - period for earlier, later in zip(times, times[1:])]
+        if not errors:
+            continue
+
+        mean = sum(errors) / len(errors)
+        result[f"0x{arbitration_id:08X}"] = {
+            "period": period,
+            "frames": len(times),
+            "mean_interval_error": mean,
+            "max_interval_error": max(errors, key=abs),
+            "jitter": (sum((error - mean) ** 2 for error in errors) / len(errors)) ** 0.5,
+            # How far the last frame is from the ideal `first + n * period` -- drift accumulates here
+            "drift": times[-1] - (times[0] + (len(times) - 1) * period),
+        }
+    return result
+
+
+def bench_cli(count: int = 20000) -> dict:
+    from xr_battery_util import send_cli_command
+
+    result = {}
+
+    with can.interface.Bus(interface="virtual", channel=CHANNEL) as bus:
+        for name, command in (("short", "REBOOT"), ("long", "GETAFECELLS")):
+            frames = (len(command) + 2 + 7) // 8
+
+            started = time.perf_counter()
+            for _ in range(count):
+                send_cli_command(bus, command)
+            elapsed = time.perf_counter() - started
+
+            result[name] = {"command": command, "frames_per_command": frames,
+                            "commands_per_second": count / elapsed, "frames_per_second": count * frames / elapsed}
+
+    return result
+
+
+class FakeXrBattery:
+    """
+    A scripted XR battery: sends zeroed cell summaries for `boot_time`, then valid ones every `summary_period`, answers
+    GETAFECELLS / PFAILRESET / REBOOT on the CLI channel, and goes quiet for `reboot_time` after REBOOT before booting
+    again. With `reboots=False`, it answers REBOOT but keeps running.
+
+    Like a real pack, summaries and CLI replies are only routed to the bus after a routing enable (0x10346090), and a
+    reboot drops routing. Until then it only sends `STATUS_ID`, standing in for the pack's unrouted traffic.
+    """
+
+    SUMMARY_ID = 0x10034450
+    CLI_REPLY_ID = 0x10342110
+    STATUS_ID = 0x10034400
+    ROUTING_ENABLE_ID = 0x10046090
+
+    def __init__(self, bus: can.BusABC, boot_time: float = 0.5, summary_period: float = 0.05,
+                 reboot_time: float = 1.0, cells_mv=None, reboots: bool = True):
+        self.bus = bus
+        self.boot_time = boot_time
+        self.summary_period = summary_period
+        self.reboot_time = reboot_time
+        self.reboots = reboots
+        self.cells_mv = cells_mv or [3712 + cell for cell in range(13)]
+
+        self.command = bytearray()
+        self.started = 0.0
+        self.quiet_until = 0.0
+        self.routed = False
+        self.rolling = 0
+        self.stop_event = threading.Event()
+
+    def send(self, arbitration_id: int, data):
+        self.bus.send(can.Message(arbitration_id=arbitration_id | self.rolling, data=data, is_extended_id=True))
+        self.rolling = (self.rolling + 1) & 0xF
+
+    def reply(self, text: str):
+        if not self.routed:
+            return
+
+        payload = text.encode()
+        for index in range(0, len(payload), 8):
+            self.send(self.CLI_REPLY_ID, payload[index:index + 8])
+
+    def on_command(self, command: str):
+        if command == "GETAFECELLS":
+            self.reply(command + "\r\n" + "".join(f"Cell {cell + 1}: {mv}mV\r\n" for cell, mv in
+                                                  enumerate(self.cells_mv)) + "> ")
+        elif command == "PFAILRESET":
+            self.reply(command + "\r\nOK\r\n> ")
+        elif command == "REBOOT":
+            self.reply(command + "\r\nRebooting\r\n")
+            if self.reboots:
+                self.quiet_until = time.monotonic() + self.reboot_time
+                self.started = self.quiet_until
+                self.routed = False
+
+    def run(self):
+        self.started = time.monotonic()
+        next_summary = self.started
+
+        while not self.stop_event.is_set():
+            msg = self.bus.recv(max(next_summary - time.monotonic(), 0))
+
+            if msg is not None and msg.arbitration_id & 0xFF0FFFF0 == self.ROUTING_ENABLE_ID:
+                # Nothing's listening while it's rebooting
+                if time.monotonic() >= self.quiet_until:
+                    self.routed = True
+            elif msg is not None and msg.arbitration_id & 0xFF0FFFF0 == 0x10046110:
+                self.command.extend(msg.data)
+                if self.command.endswith(b"\r\n"):
+                    self.on_command(self.command.decode().strip())
+                    self.command.clear()
+
+            now = time.monotonic()
+            if now >= next_summary:
+                next_summary = next_summary + self.summary_period
+                if now < self.quiet_until:
+                    continue
+
+                if not self.routed:
+                    self.send(self.STATUS_ID, bytes(8))
+                elif now - self.started < self.boot_time:
+                    self.send(self.SUMMARY_ID, bytes(8))
+                else:
+                    total = sum(self.cells_mv)
+                    self.send(self.SUMMARY_ID, min(self.cells_mv).to_bytes(2, "little") +
+                              max(self.cells_mv).to_bytes(2, "little") + (total & 0xFFFF).to_bytes(2, "little") +
+                              bytes(2))
+
+
+def run_fake_xr(reboot_timeout: float = 30.0, **battery_options) -> dict:
+    from xr_battery_util import service_bus
+
+    battery_bus = can.interface.Bus(interface="virtual", channel=CHANNEL)
+    battery = FakeXrBattery(battery_bus, **battery_options)
+    thread = threading.Thread(target=battery.run, daemon=True)
+    thread.start()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(service_bus("virtual", CHANNEL, False, reboot_timeout=reboot_timeout))
+
+    battery.stop_event.set()
+    thread.join()
+    battery_bus.shutdown()
+
+    return {"status": result["status"], "total_time": result["total_time"],
+            "phase_latencies": result["phase_latencies"]}
+
+
+def bench_xr(runs: int = 3) -> dict:
+    results = [run_fake_xr() for _ in range(runs)]
+
+    # A pack that never reboots, with summaries slower than the minimum reboot silence, mustn't be reported as reset
+    never_reboots = run_fake_xr(reboot_timeout=3.0, summary_period=0.6, reboot_time=0.0, reboots=False)
+    if never_reboots["status"] != "reset, reboot not seen":
+        print(f"  WARNING: a pack that never rebooted finished as `{never_reboots['status']}`")
+
+    times = [result["total_time"] for result in results]
+    return {
+        "battery": {"boot_time": 0.5, "summary_period": 0.05, "reboot_time": 1.0},
+        "mean_total_time": sum(times) / len(times),
+        "max_total_time": max(times),
+        "runs": results,
+        "never_reboots": never_reboots,
+    }
+
+
+def compare(results, baseline, path: str = ""):
+    """
+    Yields (path, baseline value, new value) for every number in both results.
+    """
+    if isinstance(results, dict) and isinstance(baseline, dict):
+        for key in results:
+            if key in baseline:
+                yield from compare(results[key], baseline[key], f"{path}.{key}" if path else key)
+    elif isinstance(results, list) and isinstance(baseline, list):
+        for index, (new, old) in enumerate(zip(results, baseline)):
+            yield from compare(new, old, f"{path}[{index}]")
+    elif isinstance(results, (int, float)) and isinstance(baseline, (int, float)) and \
+            not isinstance(results, bool):
+        yield path, baseline, results
+
+
+def run(benchmarks) -> dict:
+    results = {
+        "created": time.time(),
+        "python": platform.python_version(),
+        "python_can": can.__version__,
+        "platform": platform.platform(),
+    }
+
+    for name in benchmarks:
+        print(f"Running `{name}`...", flush=True)
+        started = time.perf_counter()
+
+        if name == "logger":
+            results[name] = {"unbuffered": bench_logger(), "buffered": bench_logger(buffered=True)}
+        elif name == "normalize":
+            results[name] = bench_normalize()
+        elif name == "emulator":
+            results[name] = bench_emulator()
+        elif name == "cli":
+            results[name] = bench_cli()
+        elif name == "xr":
+            results[name] = bench_xr()
+
+        print(f"  took {time.perf_counter() - started:.1f}s")
+
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='benchmark.py',
+        description='Benchmarks the logger, emulator and XR utility over a python-can `virtual` bus, and saves the '
+                    'results as JSON.')
+
+    parser.add_argument('benchmarks',
+                        help=f'Benchmarks to run, any of: {", ".join(BENCHMARKS)}. Defaults to all of them.',
+                        nargs='*')
+    parser.add_argument('-o',
+                        '--output',
+                        help='Write the results to this JSON file')
+    parser.add_argument('-b',
+                        '--baseline',
+                        help='Compare against the results in this JSON file, from an earlier run')
+
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+    benchmark_results = run(args.benchmarks or BENCHMARKS)
+
+    print()
+    print(json.dumps(benchmark_results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(benchmark_results, output, indent=2)
+        print(f"Results saved as [{args.output}]")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline_results = json.load(baseline_file)
+
+        print()
+        print("Changes from the baseline:")
+        for key, old, new in compare(benchmark_results, baseline_results):
+            if key in ("created",) or old == new:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "new"
+            print(f"  {key:<60} {old:>14.6g} -> {new:<14.6g} {change}")
+
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
\ No newline at end of file
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+import argparse
+import mmap
+import os
+import struct
+import sys
+import can
+
+from boosted_ids import ID_NORMALIZE_MASK
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can numpy
+
+# Compact binary capture format for Boosted Board CAN Bus logs (.bblog).
+#
+# A can-utils .log line is ~50 bytes of text per frame, and `boosted_logger.py` writes two of them (raw and masked).
+# A .bblog file is a small fixed header followed by fixed-size 24 byte records:
+#
+#  Header (32 bytes, little endian)
+#   8s  Magic, "BBCANLOG"
+#   H   Format version (1)
+#   H   Record size in bytes (24)
+#   d   Capture start time (epoch seconds)
+#   12x Reserved
+#
+#  Record (24 bytes, little endian)
+#   d   Timestamp (epoch seconds)
+#   I   Arbitration ID (29-bit, unmasked)
+#   B   DLC
+#   B   Flags -- see FLAG_*
+#   2x  Padding, keeps the data 8-byte aligned
+#   8s  Data, zero padded past the DLC
+#
+# Only the raw IDs are stored -- the "normalized" 0xFF0FFFF0 view is derived when reading.
+#
+# Reading memory-maps the file, and the columns are exposed as NumPy arrays that point directly into the map, so
+# opening a multi-hour ride capture doesn't read or parse anything up front. NumPy is only needed for reading;
+# writing (and so logging on a small host) only needs python-can.
+
+BBLOG_MAGIC = b"BBCANLOG"
+BBLOG_VERSION = 1
+
+HEADER = struct.Struct("<8sHHd12x")
+RECORD = struct.Struct("<dIBB2x8s")
+
+FLAG_EXTENDED_ID = 0x01
+FLAG_REMOTE_FRAME = 0x02
+FLAG_ERROR_FRAME = 0x04
+FLAG_RX = 0x08
+
+if np is not None:
+    RECORD_DTYPE = np.dtype([
+        ("timestamp", "<f8"),
+        ("arbitration_id", "<u4"),
+        ("dlc", "u1"),
+        ("flags", "u1"),
+        ("padding", "V2"),
+        ("data", "u1", (8,)),
+    ])
+    assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+def pack_message(msg: can.Message) -> bytes:
+    """
+    A frame as a single 24 byte record.
+    """
+    flags = FLAG_RX if msg.is_rx else 0
+    if msg.is_extended_id:
+        flags = flags | FLAG_EXTENDED_ID
+    if msg.is_remote_frame:
+        flags = flags | FLAG_REMOTE_FRAME
+    if msg.is_error_frame:
+        flags = flags | FLAG_ERROR_FRAME
+
+    return RECORD.pack(msg.timestamp, msg.arbitration_id, msg.dlc, flags, bytes(msg.data))
+
+
+def unpack_message(record, offset: int = 0) -> can.Message:
+    """
+    The frame in the 24 byte record at `offset` of a bytes-like object.
+    """
+    timestamp, arbitration_id, dlc, flags, data = RECORD.unpack_from(record, offset)
+    return can.Message(timestamp=timestamp,
+                       arbitration_id=arbitration_id,
+                       is_extended_id=bool(flags & FLAG_EXTENDED_ID),
+                       is_remote_frame=bool(flags & FLAG_REMOTE_FRAME),
+                       is_error_frame=bool(flags & FLAG_ERROR_FRAME),
+                       is_rx=bool(flags & FLAG_RX),
+                       dlc=dlc,
+                       data=None if flags & FLAG_REMOTE_FRAME else data[:dlc])
+
+
+class BinaryLogWriter(can.Listener):
+    """
+    Writes received frames to a .bblog file. Can be used anywhere a python-can Listener can.
+    """
+
+    def __init__(self, file, start_time: float = 0.0):
+        # A path, or a binary file-like object (ex: a compressed stream)
+        self.file = open(file, "wb") if isinstance(file, (str, os.PathLike)) else file
+        self.file.write(HEADER.pack(BBLOG_MAGIC, BBLOG_VERSION, RECORD.size, start_time))
+
+    def on_message_received(self, msg: can.Message) -> None:
+        self.file.write(pack_message(msg))
+
+    def stop(self) -> None:
+        self.file.close()
+
+
+class BinaryLogReader:
+    """
+    Zero-copy, memory-mapped reader for .bblog files.
+
+    The `timestamps`, `arbitration_ids`, `dlcs`, `flags` and `data` columns are NumPy views into the mapped file.
+    A partially written trailing record (ex: from a crash mid-capture) is ignored.
+
+    Column views (including the ones `dbc_decoder.load_columns()` returns) keep the map alive. `close()` closes the
+    file, but while any view is still held the map is only released once the last one is dropped -- `.copy()` a
+    column to keep it independently of the file.
+    """
+
+    def __init__(self, file):
+        if np is None:
+            raise ImportError("Reading .bblog files requires NumPy -- pip3 install numpy")
+
+        self.file = open(file, "rb")
+
+        # An empty file can't be mapped at all, so check before mmap() raises something less helpful
+        if os.fstat(self.file.fileno()).st_size < HEADER.size:
+            self.file.close()
+            raise ValueError(f"{file} is empty or truncated -- too short for a .bblog header")
+
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, record_size, self.start_time = HEADER.unpack_from(self.mmap, 0)
+        if magic != BBLOG_MAGIC:
+            raise ValueError(f"{file} is not a .bblog file")
+        if version != BBLOG_VERSION or record_size != RECORD.size:
+            raise ValueError(f"Unsupported .bblog version {version} (record size {record_size})")
+
+        count = (len(self.mmap) - HEADER.size) // RECORD.size
+        self.records = np.frombuffer(self.mmap, dtype=RECORD_DTYPE, count=count, offset=HEADER.size)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        return self.records["timestamp"]
+
+    @property
+    def arbitration_ids(self):
+        return self.records["arbitration_id"]
+
+    @property
+    def dlcs(self):
+        return self.records["dlc"]
+
+    @property
+    def flags(self):
+        return self.records["flags"]
+
+    @property
+    def data(self):
+        return self.records["data"]
+
+    @property
+    def normalized_ids(self):
+        """
+        Arbitration IDs with the Long Command and Rolling Code bits set to 0 (the `_MOD` log view).
+        Unlike the other columns this is computed, so it's a new array rather than a view.
+        """
+        return self.arbitration_ids & ID_NORMALIZE_MASK
+
+    def __iter__(self):
+        for record in self.records:
+            flags = int(record["flags"])
+            dlc = int(record["dlc"])
+            yield can.Message(timestamp=float(record["timestamp"]),
+                              arbitration_id=int(record["arbitration_id"]),
+                              is_extended_id=bool(flags & FLAG_EXTENDED_ID),
+                              is_remote_frame=bool(flags & FLAG_REMOTE_FRAME),
+                              is_error_frame=bool(flags & FLAG_ERROR_FRAME),
+                              is_rx=bool(flags & FLAG_RX),
+                              dlc=dlc,
+                              data=None if flags & FLAG_REMOTE_FRAME else record["data"][:dlc].tobytes())
+
+    def close(self):
+        # Drop our views first, or the mmap can't be closed
+        self.records = None
+        try:
+            self.mmap.close()
+        except BufferError:
+            # A caller still holds a column view -- the map is released when the last one is dropped
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def log_to_binary(log_file, bblog_file) -> int:
+    """
+    Converts a can-utils .log file into a .bblog file. Returns the number of frames converted.
+    """
+    writer = None
+    frames = 0
+
+    for msg in can.CanutilsLogReader(log_file):
+        if writer is None:
+            writer = BinaryLogWriter(bblog_file, msg.timestamp)
+        writer.on_message_received(msg)
+        frames = frames + 1
+
+    if writer is None:
+        writer = BinaryLogWriter(bblog_file)
+    writer.stop()
+
+    return frames
+
+
+def write_columns(bblog_file, timestamps, arbitration_ids, dlcs, data, start_time: float = None):
+    """
+    Writes columns of frames (ex: from `log_reader.read_log()`) to a .bblog file in one go.
+    IDs above 0x7FF are written as extended IDs, and every frame is marked as received.
+    """
+    if np is None:
+        raise ImportError("Writing columns requires NumPy -- pip3 install numpy")
+
+    records = np.zeros(len(timestamps), dtype=RECORD_DTYPE)
+    records["timestamp"] = timestamps
+    records["arbitration_id"] = arbitration_ids
+    records["dlc"] = dlcs
+    records["flags"] = np.where(np.asarray(arbitration_ids) > 0x7FF, FLAG_EXTENDED_ID | FLAG_RX, FLAG_RX)
+    records["data"] = data
+
+    if start_time is None:
+        start_time = float(timestamps[0]) if len(timestamps) else 0.0
+
+    with open(bblog_file, "wb") as output:
+        output.write(HEADER.pack(BBLOG_MAGIC, BBLOG_VERSION, RECORD.size, start_time))
+        records.tofile(output)
+
+
+def binary_to_log(bblog_file, log_file, normalize: bool = False) -> int:
+    """
+    Converts a .bblog file into a can-utils .log file, optionally normalizing IDs like a `_MOD` log.
+    Returns the number of frames converted.
+    """
+    writer = can.CanutilsLogWriter(log_file)
+    frames = 0
+
+    with BinaryLogReader(bblog_file) as reader:
+        for msg in reader:
+            if normalize:
+                msg.arbitration_id = msg.arbitration_id & ID_NORMALIZE_MASK
+            writer.on_message_received(msg)
+            frames = frames + 1
+
+    writer.stop()
+
+    return frames
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='boosted_binlog.py',
+        description='Converts Boosted Board CAN Bus captures between can-utils `.log` and binary `.bblog` files.')
+
+    parser.add_argument('direction',
+                        help='`to-bin` converts a .log to .bblog, `to-log` converts a .bblog to .log',
+                        choices=['to-bin', 'to-log'])
+    parser.add_argument('source',
+                        help='File to convert')
+    parser.add_argument('destination',
+                        help='File to write')
+    parser.add_argument('-n',
+                        '--normalize',
+                        help='When converting to .log, set the Long Command and Rolling Code bits to 0, like a '
+                             '`_MOD` log.',
+                        required=False,
+                        default=False,
+                        action='store_true')
+
+    args = parser.parse_args()
+
+    if args.direction == 'to-bin':
+        converted = log_to_binary(args.source, args.destination)
+    else:
+        converted = binary_to_log(args.source, args.destination, args.normalize)
+
+    print(f"Converted {converted} frames.")
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
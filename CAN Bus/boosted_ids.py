@@ -0,0 +1,106 @@
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# Helpers for the Boosted Board (V2+) CAN ID layout, shared by the scripts in this directory.
+#
+#  0xFF0FFFF0 - Mask used for filtering
+#  0x10374200
+#           ^ Global rolling code, 0-F, every message sent by the device increments this
+#         ^^ Channel
+#        ^ Dest
+#       ^ Src
+#      ^ "Long Command" ID -- Starts at 3, decrements for messages that span multiple packets
+#
+# The SR Battery <-> ESC IDs (0x0B57EDxx) don't follow this layout -- masking them merges unrelated messages, so
+# anything keyed on "the same message" should use `message_key()`, which leaves them alone.
+
+# Set the Long Command bits and the Rolling Code bits to 0
+ID_NORMALIZE_MASK = 0xFF0FFFF0
+
+LONG_COMMAND_MASK = 0x00F00000
+LONG_COMMAND_SHIFT = 20
+
+# Long Command value of a message that fits in a single frame
+LONG_COMMAND_SINGLE = 3
+
+ROLLING_CODE_MASK = 0x0000000F
+
+SR_ID_MASK = 0xFFFFFF00
+SR_ID_BASE = 0x0B57ED00
+
+# Periods (seconds) of the repeating SR Battery <-> ESC messages, from the table in `SR Battery CAN Bus.md`
+SR_MESSAGE_PERIODS = {
+    0x0B57ED02: 0.25,
+    0x0B57ED10: 0.25,
+    0x0B57ED11: 2.0,
+    0x0B57ED12: 0.25,
+    0x0B57ED13: 0.25,
+    0x0B57ED14: 0.25,
+    0x0B57ED15: 0.1,
+    0x0B57ED1F: 0.1,
+    0x0B57EDC2: 1.0,
+}
+
+# Repeating SR messages the ESC works without (not "Essential" in the table), which `sr_battery_emulator.py` doesn't
+# send -- their absence isn't a fault
+SR_OPTIONAL_MESSAGES = frozenset((0x0B57ED11, 0x0B57ED12, 0x0B57ED13, 0x0B57EDC2))
+
+
+def normalize_id(arbitration_id: int) -> int:
+    return arbitration_id & ID_NORMALIZE_MASK
+
+
+def is_sr_id(arbitration_id: int) -> bool:
+    return arbitration_id & SR_ID_MASK == SR_ID_BASE
+
+
+def message_key(arbitration_id: int) -> int:
+    """
+    The normalized ID for Boosted IDs, and the unmodified ID for SR Battery IDs.
+    """
+    if arbitration_id & SR_ID_MASK == SR_ID_BASE:
+        return arbitration_id
+    return arbitration_id & ID_NORMALIZE_MASK
+
+
+def long_command(arbitration_id: int) -> int:
+    return (arbitration_id & LONG_COMMAND_MASK) >> LONG_COMMAND_SHIFT
+
+
+def rolling_code(arbitration_id: int) -> int:
+    return arbitration_id & ROLLING_CODE_MASK
+
+
+def src(arbitration_id: int) -> int:
+    return (arbitration_id >> 16) & 0xF
+
+
+def dest(arbitration_id: int) -> int:
+    return (arbitration_id >> 12) & 0xF
+
+
+def channel(arbitration_id: int) -> int:
+    return (arbitration_id >> 4) & 0xFF
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
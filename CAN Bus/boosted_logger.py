@@ -1,9 +1,23 @@
 #!/usr/bin/env python3
 import datetime
 import argparse
+import os
 import sys
+import threading
 import can
 
+from boosted_binlog import BinaryLogWriter
+from can_filters import exact, open_filtered_bus, parse_group
+from can_stats import TrafficProfiler
+from log_index import LogIndexWriter, index_path
+from log_segments import COMPRESSION_SUFFIXES, SegmentFile, SegmentManifest
+from rolling_code import RollingCodeMonitor
+
+try:
+    from telemetry import TelemetryPipeline
+except ImportError:
+    TelemetryPipeline = None
+
 # Released under the MIT License. Copyright (c) 2023 Robert Scullin.
 # https://beambreak.org / https://github.com/rscullin/beambreak
 
@@ -36,18 +50,322 @@ import can
 # for more information for your particular adapter.
 #
 # If you're using a `slcan`-based device, the "channel" is the path to the serial port.
+#
+# `-i broker -c <socket path>` logs from a `can_broker.py` instead, so logging can run continuously while other tools
+# share the same adapter.
+#
+# With `--buffered`, the receive loop only pushes frames into a bounded ring buffer, and a background thread writes
+# them to disk. A slow SD card or disk stall then can't back up into the adapter (slcan adapters overrun and drop
+# frames if they aren't read quickly enough). The ring buffer's high-water mark and overrun count are printed when
+# logging stops -- 0 overruns means every frame the adapter delivered made it to disk. If the writer fails (ex: the disk
+# fills up), its error stops the capture rather than frames silently going nowhere.
+#
+# `--group` and `--id` limit the capture to selected src/dest/channel groups or IDs. The filters are applied by the
+# interface where it supports it (ex: in the kernel, with SocketCAN), so unwanted frames never reach Python.
+#
+# `--stats` adds a live per-ID profile of the bus (see `can_stats.py`) -- rates, inter-arrival times, an estimated
+# bus load, and which IDs deviate from their documented periods.
+#
+# `--rolling-check` uses the rolling code as a sequence number, and reports frames per sender that never made it into
+# the capture (see `rolling_code.py`, which can also check existing `_all` logs) -- separating adapter or host
+# overruns from what the board actually did. It needs the whole bus, so it can't be combined with `--group` / `--id`.
+#
+# `--rotate-size` and `--rotate-interval` split a long capture into numbered segments, and `--compress` compresses
+# them (gzip, xz, or zstd) as they're written, on the buffered writer thread. Each finished segment's time range and
+# frame count go into a `_manifest.json`, so `log_segments.py` can pull out a time window without decompressing
+# every segment, and a crash only loses the end of the current segment.
+#
+# `--index` writes a sidecar `.idx` for each `_all` log as it's written, mapping time blocks and normalized IDs to file
+# offsets, so `log_index.py` can pull ex: every SoC frame in a window without scanning the whole log. Existing logs can
+# be indexed with `log_index.py build`.
+#
+# `--telemetry` decodes the XR and SR cell voltages and SR State of Charge as they arrive (see `telemetry.py`), keeps
+# their recent history in fixed-size rings, and can serve them to a local viewer with `--telemetry-port`.
+#
+# With `--format binary`, a single compact `.bblog` file is written instead of the two text logs. See
+# `boosted_binlog.py` for the format, a zero-copy reader, and converters to and from can-utils .log files.
+
+
+class FrameRingBuffer:
+    """
+    Bounded, preallocated single-producer / single-consumer ring of received CAN frames.
+
+    The capture loop only ever calls `push()`, which never blocks -- if the writer falls behind and the ring is full,
+    the frame is dropped and counted as an overrun instead of backing up into the CAN adapter.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.count = 0
+
+        # Stats, so a capture can prove nothing was lost
+        self.high_water_mark = 0
+        self.overruns = 0
+
+        self.cond = threading.Condition()
+
+    def push(self, msg: can.Message) -> bool:
+        with self.cond:
+            if self.count == self.capacity:
+                self.overruns = self.overruns + 1
+                return False
+
+            self.slots[self.head] = msg
+            self.head = (self.head + 1) % self.capacity
+            self.count = self.count + 1
+
+            if self.count > self.high_water_mark:
+                self.high_water_mark = self.count
+
+            self.cond.notify()
+            return True
+
+    def drain(self, batch: list, max_frames: int, timeout: float) -> int:
+        """
+        Moves up to `max_frames` frames into `batch`, waiting up to `timeout` seconds for at least one.
+        """
+        with self.cond:
+            if self.count == 0:
+                self.cond.wait(timeout)
+
+            n = min(self.count, max_frames)
+            for _ in range(n):
+                batch.append(self.slots[self.tail])
+                self.slots[self.tail] = None
+                self.tail = (self.tail + 1) % self.capacity
+            self.count = self.count - n
+
+        return n
+
+
+class LogSink:
+    """
+    Writes frames to both the unmodified (`_all`) and normalized (`_MOD`) log files, or to a single binary `.bblog`
+    file (which stores raw IDs only -- the normalized view is derived when reading).
+
+    With compression or rotation (by compressed size in bytes, or by seconds of capture), the files are written as
+    numbered segments, and each segment is listed in a manifest as it opens and closes (see `log_segments.py`).
+    """
+
+    def __init__(self, directory: str, start_epoch: str, log_format: str = "log", compression: str = "none",
+                 max_bytes: int = None, max_seconds: float = None, indexed: bool = False):
+        self.directory = directory
+        self.start_epoch = start_epoch
+        self.log_format = log_format
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.indexed = indexed
+
+        self.frames_written = 0
+
+        self.manifest = None
+        if compression != "none" or max_bytes or max_seconds:
+            self.manifest = SegmentManifest(f"{directory}/boosted_log_{start_epoch}_manifest.json", float(start_epoch),
+                                            log_format, compression)
+
+        self.segment_index = 0
+        self.open_segment()
+
+    def open_segment(self):
+        self.files = []
+        self.segment_frames = 0
+        self.segment_first = None
+        self.segment_last = None
+        self.index = None
+
+        if self.manifest is None:
+            if self.log_format == "binary":
+                self.logger_all = BinaryLogWriter(f"{self.directory}/boosted_log_{self.start_epoch}.bblog",
+                                                  float(self.start_epoch))
+                self.logger_mod = None
+            else:
+                self.logger_all = can.CanutilsLogWriter(f"{self.directory}/boosted_log_{self.start_epoch}_all.log")
+                self.logger_mod = can.CanutilsLogWriter(f"{self.directory}/boosted_log_{self.start_epoch}_MOD.log")
+                self.open_index(f"{self.directory}/boosted_log_{self.start_epoch}_all.log")
+            return
+
+        prefix = f"{self.directory}/boosted_log_{self.start_epoch}_{self.segment_index:04d}"
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+
+        if self.log_format == "binary":
+            self.files = [SegmentFile(f"{prefix}.bblog{suffix}", self.compression, text=False)]
+            self.logger_all = BinaryLogWriter(self.files[0].stream, float(self.start_epoch))
+            self.logger_mod = None
+        else:
+            self.files = [SegmentFile(f"{prefix}_all.log{suffix}", self.compression),
+                          SegmentFile(f"{prefix}_MOD.log{suffix}", self.compression)]
+            self.logger_all = can.CanutilsLogWriter(self.files[0].stream)
+            self.logger_mod = can.CanutilsLogWriter(self.files[1].stream)
+            if self.compression == "none":
+                self.open_index(self.files[0].path)
+
+        # Listed as soon as it opens, so the manifest covers it even if the capture never gets to close it
+        self.manifest.add(self.segment_index, [file.path for file in self.files])
+        self.manifest.save()
+
+    def open_index(self, log_file: str):
+        # Block offsets are only meaningful in an uncompressed text log
+        if self.indexed:
+            self.index = LogIndexWriter()
+            self.index_log = log_file
+
+    def close_segment(self):
+        if self.index is not None:
+            self.index.close_block(self.logger_all.file.tell())
+
+        self.logger_all.stop()
+        if self.logger_mod is not None:
+            self.logger_mod.stop()
+
+        for file in self.files:
+            file.close()
+
+        if self.index is not None:
+            self.index.save(index_path(self.index_log), os.path.getsize(self.index_log))
+
+        if self.manifest is not None:
+            self.manifest.add(self.segment_index, [file.path for file in self.files], self.segment_first,
+                              self.segment_last, self.segment_frames)
+            self.manifest.save()
+
+    def should_rotate(self, timestamp: float) -> bool:
+        if self.segment_frames == 0:
+            return False
+        if self.max_bytes and sum(file.size for file in self.files) >= self.max_bytes:
+            return True
+        if self.max_seconds and timestamp - self.segment_first >= self.max_seconds:
+            return True
+        return False
+
+    def on_frames(self, msgs):
+        for msg in msgs:
+            if self.manifest is not None and self.should_rotate(msg.timestamp):
+                self.close_segment()
+                self.segment_index = self.segment_index + 1
+                self.open_segment()
+
+            if self.segment_first is None:
+                self.segment_first = msg.timestamp
+            self.segment_last = msg.timestamp
+            self.segment_frames = self.segment_frames + 1
+
+            self.logger_all.on_message_received(msg)
+
+            if self.index is not None:
+                self.index.on_message_received(msg, self.logger_all.file)
+
+            if self.logger_mod is not None:
+                # Set the Long Command bits and the Rolling Code bits to 0 to make DBC Analysis saner
+                msg.arbitration_id = msg.arbitration_id & 0xFF0FFFF0
+                self.logger_mod.on_message_received(msg)
+
+        self.frames_written = self.frames_written + len(msgs)
+
+    def stop(self):
+        self.close_segment()
+
+
+def background_writer(ring: FrameRingBuffer, sink: LogSink, stop_event: threading.Event, batch_size: int):
+    """
+    Drains the ring buffer in batches until `stop_event` is set and the ring is empty.
+    """
+    batch = []
+
+    while True:
+        ring.drain(batch, batch_size, 0.1)
+
+        if batch:
+            sink.on_frames(batch)
+            batch.clear()
+        elif stop_event.is_set():
+            return
+
+
+class BackgroundWriter(threading.Thread):
+    """
+    Runs `background_writer()` on a daemon thread, and keeps the exception that stopped it (ex: a full disk) so the
+    capture loop can re-raise it, instead of logging silently stopping while frames are still counted.
+    """
+
+    def __init__(self, ring: FrameRingBuffer, sink: LogSink, stop_event: threading.Event, batch_size: int):
+        super().__init__(name="boosted_logger_writer", daemon=True)
+        self.ring = ring
+        self.sink = sink
+        self.stop_event = stop_event
+        self.batch_size = batch_size
+        self.error = None
+
+    def run(self):
+        try:
+            background_writer(self.ring, self.sink, self.stop_event, self.batch_size)
+        except Exception as error:
+            self.error = error
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
 
 
 def log(arguments):
-    with can.interface.Bus(bustype=arguments.interface, channel=arguments.channel, bitrate=250000) as bus:
+    filter_set = [parse_group(value) for value in arguments.group or []]
+    filter_set.extend(exact(int(value, 16)) for value in arguments.id or [])
+
+    bus, software_filter = open_filtered_bus(arguments.interface, arguments.channel, filter_set)
+
+    with bus:
 
         print(f"CAN Adapter Initialized! {arguments.interface} at {arguments.channel}")
 
+        if filter_set:
+            print(f"Only capturing {len(filter_set)} ID group(s), filtered "
+                  f"{'in software' if software_filter is not None else 'by the interface'}")
+
         dt = datetime.datetime.now()
-        logger_all = can.CanutilsLogWriter(f"{arguments.directory}/boosted_log_{dt.strftime('%s')}_all.log")
-        logger_mod = can.CanutilsLogWriter(f"{arguments.directory}/boosted_log_{dt.strftime('%s')}_MOD.log")
+        max_bytes = int(arguments.rotate_size * 1024 * 1024) if arguments.rotate_size else None
+        sink = LogSink(arguments.directory, dt.strftime('%s'), arguments.format, arguments.compress, max_bytes,
+                       arguments.rotate_interval, arguments.index)
+
+        if sink.manifest is not None:
+            print(f"Logs opened as segments of [boosted_log_{dt.strftime('%s')}_***], listed in "
+                  f"[boosted_log_{dt.strftime('%s')}_manifest.json] -- Logging started!")
+        elif arguments.format == "binary":
+            print(f"Log opened as [boosted_log_{dt.strftime('%s')}.bblog] -- Logging started!")
+        else:
+            print(f"Logs opened as [boosted_log_{dt.strftime('%s')}_***_.log] -- Logging started!")
+
+        # In buffered mode the receive loop only pushes frames into the ring, and a writer thread does all disk I/O
+        ring = None
+        writer = None
+        stop_event = threading.Event()
+
+        # Compressing (and rotating) on the receive loop would stall it, so it always happens on the writer thread
+        if arguments.buffered or sink.manifest is not None:
+            ring = FrameRingBuffer(arguments.buffer_size)
+            writer = BackgroundWriter(ring, sink, stop_event, arguments.batch_size)
+            writer.start()
+            print(f"Buffered capture enabled ({arguments.buffer_size} frame ring buffer)")
+
+        # Per-ID rates / bus load, printed every `--stats-interval` seconds and saved as JSON at the end
+        profiler = TrafficProfiler() if arguments.stats else None
+        next_summary = None
+
+        # Frames missing from the capture, from gaps in each sender's rolling code
+        rolling_codes = RollingCodeMonitor() if arguments.rolling_check else None
 
-        print(f"Logs opened as [boosted_log_{dt.strftime('%s')}_***_.log] -- Logging started!")
+        # Cell voltages and SoC, decoded on the pipeline's own thread
+        telemetry = None
+        if arguments.telemetry:
+            telemetry = TelemetryPipeline()
+            if arguments.telemetry_port:
+                telemetry.serve(arguments.telemetry_port)
+                print(f"Serving telemetry on http://127.0.0.1:{arguments.telemetry_port}/current")
 
         can_frames_seen = 0
 
@@ -56,7 +374,14 @@ def log(arguments):
         try:
             while True:
                 msg = bus.recv(1)
-                if msg is not None:
+
+                if msg is None:
+                    if writer is not None:
+                        writer.check()
+                else:
+
+                    if software_filter is not None and not software_filter.matches(msg.arbitration_id):
+                        continue
 
                     can_frames_seen = can_frames_seen + 1
 
@@ -64,19 +389,62 @@ def log(arguments):
                     if can_frames_seen % 250 == 0:
                         print('.', end="", flush=True)
 
-                    logger_all.on_message_received(msg)
+                        if writer is not None:
+                            writer.check()
+
+                    # Before the frame is handed to the writer, which normalizes its ID
+                    if rolling_codes is not None:
+                        rolling_codes.on_message_received(msg)
+
+                    if telemetry is not None:
+                        telemetry.on_message_received(msg)
+
+                    if profiler is not None:
+                        profiler.on_message_received(msg)
+
+                        if next_summary is None:
+                            next_summary = msg.timestamp + arguments.stats_interval
+                        elif msg.timestamp >= next_summary:
+                            next_summary = msg.timestamp + arguments.stats_interval
+                            print()
+                            profiler.print_summary()
 
-                    # Set the Long Command bits and the Rolling Code bits to 0 to make DBC Analysis saner
-                    msg.arbitration_id = msg.arbitration_id & 0xFF0FFFF0
-                    logger_mod.on_message_received(msg)
+                    if ring is not None:
+                        ring.push(msg)
+                    else:
+                        sink.on_frames((msg,))
 
         except KeyboardInterrupt:
-            logger_all.stop()
-            logger_mod.stop()
+            if writer is not None:
+                stop_event.set()
+                writer.join()
+                writer.check()
+
+            sink.stop()
 
             print()
             print()
-            print(f"Logging stopped, received {can_frames_seen} frames.")
+            print(f"Logging stopped, received {can_frames_seen} frames, wrote {sink.frames_written} frames.")
+
+            if profiler is not None:
+                profiler.print_summary()
+                profiler.dump_json(f"{arguments.directory}/boosted_log_{dt.strftime('%s')}_stats.json")
+                print(f"Statistics saved as [boosted_log_{dt.strftime('%s')}_stats.json]")
+
+            if rolling_codes is not None:
+                print()
+                rolling_codes.print_summary()
+
+            if telemetry is not None:
+                telemetry.stop()
+                print()
+                telemetry.print_summary()
+                telemetry.export_json(f"{arguments.directory}/boosted_log_{dt.strftime('%s')}_telemetry.json")
+                print(f"Telemetry saved as [boosted_log_{dt.strftime('%s')}_telemetry.json]")
+
+            if ring is not None:
+                print(f"Ring buffer high-water mark: {ring.high_water_mark}/{ring.capacity} frames, "
+                      f"overruns: {ring.overruns}")
 
             pass  # exit normally
 
@@ -107,9 +475,108 @@ if __name__ == "__main__":
                         help='"Channel" of the `python-can` interface to use. If you are using `slcan`, this is the '
                              'path to the serial adapter.',
                         required=True)
+    parser.add_argument('-f',
+                        '--format',
+                        help='`log` writes `_all` and `_MOD` can-utils log files, `binary` writes a single compact '
+                             '`.bblog` file (see boosted_binlog.py). Defaults to `log`.',
+                        choices=['log', 'binary'],
+                        default='log')
+    parser.add_argument('-g',
+                        '--group',
+                        help='Only capture messages from this `SRC:DEST:CHANNEL` group (hex, `*` for any), ex: '
+                             '`*:*:11` for the battery CLI. Can be given more than once.',
+                        required=False,
+                        action='append')
+    parser.add_argument('--id',
+                        help='Only capture this normalized ID (hex), ex: `10034450`. SR Battery IDs (`0B57EDxx`) '
+                             'match exactly. Can be given more than once, and combined with `--group`.',
+                        required=False,
+                        action='append')
+    parser.add_argument('-s',
+                        '--stats',
+                        help='Keep per-ID rates, inter-arrival times and a bus load estimate, print a summary table '
+                             'periodically, and save them as JSON when logging stops.',
+                        required=False,
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--stats-interval',
+                        help='Seconds between statistics summaries. Defaults to 10.',
+                        type=float,
+                        default=10.0)
+    parser.add_argument('-r',
+                        '--rolling-check',
+                        help='Track each sender\'s rolling code, and report frames missing from the capture (and '
+                             'when) when logging stops. Can\'t be combined with `--group` or `--id`.',
+                        required=False,
+                        default=False,
+                        action='store_true')
+    parser.add_argument('-z',
+                        '--compress',
+                        help='Compress the logs as they\'re written. Implies `--buffered`, and writes segments with a '
+                             'manifest (see log_segments.py). Defaults to `none`.',
+                        choices=list(COMPRESSION_SUFFIXES),
+                        default='none')
+    parser.add_argument('--rotate-size',
+                        help='Start a new log segment once the current one reaches (about) this many megabytes on '
+                             'disk. Implies `--buffered`.',
+                        type=float,
+                        default=None)
+    parser.add_argument('--rotate-interval',
+                        help='Start a new log segment every this many seconds of capture. Implies `--buffered`.',
+                        type=float,
+                        default=None)
+    parser.add_argument('-t',
+                        '--telemetry',
+                        help='Decode cell voltages and State of Charge as they arrive, keep their history in fixed '
+                             'memory, and save it as JSON when logging stops (see telemetry.py).',
+                        required=False,
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--telemetry-port',
+                        help='With `--telemetry`, also serve it as JSON on this localhost port (ex: 8050).',
+                        type=int,
+                        default=None)
+    parser.add_argument('-x',
+                        '--index',
+                        help='Write a `.idx` sidecar index next to each `_all` log, for fast queries by ID and time '
+                             '(see log_index.py). Only for uncompressed `log` format captures.',
+                        required=False,
+                        default=False,
+                        action='store_true')
+    parser.add_argument('-b',
+                        '--buffered',
+                        help='Decouple capture from disk I/O -- received frames go into a ring buffer, and a '
+                             'background thread writes them to disk in batches.',
+                        required=False,
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--buffer-size',
+                        help='Number of frames the ring buffer holds in buffered mode. Defaults to 65536 '
+                             '(~30 seconds of a fully loaded 250kbit/s bus).',
+                        type=int,
+                        default=65536)
+    parser.add_argument('--batch-size',
+                        help='Maximum number of frames written per batch in buffered mode. Defaults to 512.',
+                        type=int,
+                        default=512)
 
     args = parser.parse_args()
 
+    if args.buffer_size < 1:
+        parser.error("--buffer-size must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    if args.index and (args.format != "log" or args.compress != "none"):
+        parser.error("--index needs an uncompressed `log` format capture")
+
+    if args.telemetry and TelemetryPipeline is None:
+        parser.error("--telemetry requires NumPy -- pip3 install numpy")
+
+    # Frames the filters drop would be counted as missing
+    if args.rolling_check and (args.group or args.id):
+        parser.error("--rolling-check can't be combined with --group or --id")
+
     try:
         log(args)
     except KeyboardInterrupt:
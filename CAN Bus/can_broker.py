@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import select
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+import can
+
+from boosted_binlog import RECORD, pack_message, unpack_message
+from can_filters import CompiledFilter, open_filtered_bus
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can
+
+# Long-running CAN bus broker, so several tools can share one adapter.
+#
+# Only one process can own a slcan serial adapter, and every tool pays the slcan init (and, for the battery tools, the
+# boot wait) each time it starts. The broker opens the adapter once and serves it over a Unix socket:
+#
+#  python3 can_broker.py -c /dev/ttyACM0
+#  python3 boosted_logger.py -i broker -c /tmp/boosted_can.sock
+#  python3 xr_battery_util.py -i broker -c /tmp/boosted_can.sock
+#
+# Clients come and go without touching the adapter, so ex: the logger can capture continuously while the RLOD utility
+# or the emulator attaches, runs, and detaches.
+#
+# Every frame is sent to each client as a 24 byte .bblog record (see `boosted_binlog.py`) -- no text parsing, and a
+# single send per client per frame. Clients send 1 byte commands:
+#
+#   T + record                      Transmit a frame
+#   F + H count + count * (I, I)    Only deliver frames matching these (id, mask) pairs. A count of 0 delivers all.
+#
+# Filters are checked in the broker (as a `can_filters.CompiledFilter`), so a client only wakes up for its own frames.
+# Frames a client transmits are also delivered to the other clients, marked as not received -- like SocketCAN's local
+# loopback -- so a logger sees what the emulator sends.
+#
+# A client that stops reading can't stall the adapter or the other clients: each has a bounded output buffer, and
+# frames that don't fit are dropped and counted for that client.
+#
+# `BrokerBus` is the client side, a python-can bus. `can_filters.open_bus()` opens it for the `broker` interface, so
+# every tool takes `-i broker -c <socket path>` with no other changes.
+
+DEFAULT_SOCKET = "/tmp/boosted_can.sock"
+
+CMD_TRANSMIT = b"T"
+CMD_FILTER = b"F"
+
+FILTER_COUNT = struct.Struct("<H")
+FILTER_PAIR = struct.Struct("<II")
+
+
+class BrokerBus(can.BusABC):
+    """
+    A python-can bus backed by a broker's Unix socket, ex: `BrokerBus("/tmp/boosted_can.sock")`.
+
+    `can_filters` are applied in the broker rather than in this process.
+    """
+
+    def __init__(self, channel: str = DEFAULT_SOCKET, can_filters=None, **kwargs):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(channel)
+        except OSError as error:
+            self.socket.close()
+            raise can.CanInitializationError(f"Couldn't connect to the broker at {channel}: {error}") from error
+
+        self.buffer = bytearray()
+        self.send_lock = threading.Lock()
+        self.channel_info = f"Broker at {channel}"
+
+        super().__init__(channel, can_filters=can_filters, **kwargs)
+
+    def _apply_filters(self, filters) -> None:
+        pairs = [(f["can_id"], f["can_mask"]) for f in filters or []]
+
+        command = bytearray(CMD_FILTER)
+        command += FILTER_COUNT.pack(len(pairs))
+        for can_id, mask in pairs:
+            command += FILTER_PAIR.pack(can_id, mask)
+
+        with self.send_lock:
+            self.socket.sendall(command)
+
+    def _recv_internal(self, timeout):
+        # The socket itself stays blocking, for `send()` on other threads -- receive waits with select() instead of a
+        # socket timeout, which would apply to both
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while len(self.buffer) < RECORD.size:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, True
+
+            readable = select.select([self.socket], [], [], remaining)[0]
+            if not readable:
+                return None, True
+
+            chunk = self.socket.recv(65536)
+            if not chunk:
+                raise can.CanOperationError("The broker closed the connection")
+            self.buffer += chunk
+
+        msg = unpack_message(self.buffer)
+        del self.buffer[:RECORD.size]
+
+        return msg, True
+
+    def send(self, msg: can.Message, timeout=None) -> None:
+        with self.send_lock:
+            self.socket.sendall(CMD_TRANSMIT + pack_message(msg))
+
+    def shutdown(self) -> None:
+        super().shutdown()
+        self.socket.close()
+
+
+class BrokerClient:
+    """
+    The broker's view of one connected client.
+    """
+
+    def __init__(self, sock: socket.socket, name: str, max_buffered: int):
+        self.socket = sock
+        self.name = name
+        self.max_buffered = max_buffered
+
+        self.input = bytearray()
+        self.output = bytearray()
+        self.filter = None
+
+        self.frames_sent = 0
+        self.frames_transmitted = 0
+        self.frames_dropped = 0
+
+    def wants(self, arbitration_id: int) -> bool:
+        return self.filter is None or self.filter.matches(arbitration_id)
+
+    def queue(self, record: bytes) -> bool:
+        """
+        Adds a record to the output buffer. Returns False (and counts a drop) if the buffer is full.
+        """
+        if len(self.output) + len(record) > self.max_buffered:
+            self.frames_dropped = self.frames_dropped + 1
+            return False
+
+        self.output += record
+        self.frames_sent = self.frames_sent + 1
+        return True
+
+    def flush(self) -> bool:
+        """
+        Sends as much of the output buffer as the socket takes without blocking. Returns True if it's now empty.
+        """
+        if self.output:
+            try:
+                sent = self.socket.send(self.output)
+            except BlockingIOError:
+                return False
+            except OSError:
+                # The client's gone -- its socket reads as closed, and it's disconnected from there
+                self.output.clear()
+                return True
+            del self.output[:sent]
+
+        return not self.output
+
+    def commands(self):
+        """
+        Yields (command, payload) for every complete command in the input buffer.
+        """
+        while self.input:
+            command = bytes(self.input[:1])
+
+            if command == CMD_TRANSMIT:
+                size = 1 + RECORD.size
+                if len(self.input) < size:
+                    return
+                payload = bytes(self.input[1:size])
+
+            elif command == CMD_FILTER:
+                if len(self.input) < 1 + FILTER_COUNT.size:
+                    return
+                count, = FILTER_COUNT.unpack_from(self.input, 1)
+                size = 1 + FILTER_COUNT.size + count * FILTER_PAIR.size
+                if len(self.input) < size:
+                    return
+                payload = [FILTER_PAIR.unpack_from(self.input, 1 + FILTER_COUNT.size + i * FILTER_PAIR.size)
+                           for i in range(count)]
+
+            else:
+                raise ValueError(f"Unknown command {command!r}")
+
+            del self.input[:size]
+            yield command, payload
+
+
+class CanBroker:
+    """
+    Owns one bus, and shares it with clients on a Unix socket.
+
+    A receive thread fans adapter frames out to clients, and the main thread accepts clients, handles their commands,
+    and finishes sends that didn't fit in a socket buffer.
+    """
+
+    def __init__(self, bus: can.BusABC, path: str = DEFAULT_SOCKET, max_buffered_frames: int = 4096):
+        self.bus = bus
+        self.path = path
+        self.max_buffered = max_buffered_frames * RECORD.size
+
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.running = threading.Event()
+        self.next_client = 1
+
+        self.frames_received = 0
+        self.frames_transmitted = 0
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen()
+        self.listener.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+        # Lets the receive thread wake the selector when a client's socket buffer fills up
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+
+    def fan_out(self, msg: can.Message, source: BrokerClient = None):
+        """
+        Queues a frame for every client that wants it, other than the one that sent it.
+        """
+        record = pack_message(msg)
+        stalled = False
+
+        with self.lock:
+            for client in self.clients.values():
+                if client is source or not client.wants(msg.arbitration_id):
+                    continue
+
+                # Anything already waiting has to go first, or frames would be reordered
+                was_empty = not client.output
+                client.queue(record)
+                if was_empty and not client.flush():
+                    stalled = True
+
+        if stalled:
+            try:
+                self.wake_writer.send(b"\0")
+            except BlockingIOError:
+                pass
+
+    def receive_loop(self):
+        while self.running.is_set():
+            msg = self.bus.recv(0.1)
+            if msg is None:
+                continue
+
+            self.frames_received = self.frames_received + 1
+            self.fan_out(msg)
+
+    def accept(self):
+        sock, _ = self.listener.accept()
+        sock.setblocking(False)
+
+        with self.lock:
+            client = BrokerClient(sock, f"client {self.next_client}", self.max_buffered)
+            self.next_client = self.next_client + 1
+            self.clients[sock] = client
+
+        self.selector.register(sock, selectors.EVENT_READ)
+        print(f"[{client.name}] Connected")
+
+    def disconnect(self, client: BrokerClient, reason: str = ""):
+        with self.lock:
+            self.clients.pop(client.socket, None)
+
+        self.selector.unregister(client.socket)
+        client.socket.close()
+
+        print(f"[{client.name}] Disconnected{f' ({reason})' if reason else ''} -- sent {client.frames_sent} frames, "
+              f"dropped {client.frames_dropped}, transmitted {client.frames_transmitted}")
+
+    def handle_input(self, client: BrokerClient):
+        try:
+            data = client.socket.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError as error:
+            self.disconnect(client, str(error))
+            return
+
+        if not data:
+            self.disconnect(client)
+            return
+
+        client.input += data
+
+        try:
+            for command, payload in client.commands():
+                if command == CMD_TRANSMIT:
+                    msg = unpack_message(payload)
+                    msg.is_rx = False
+                    self.bus.send(msg)
+                    msg.timestamp = time.time()
+
+                    client.frames_transmitted = client.frames_transmitted + 1
+                    self.frames_transmitted = self.frames_transmitted + 1
+                    self.fan_out(msg, client)
+                else:
+                    with self.lock:
+                        client.filter = CompiledFilter(payload) if payload else None
+        except (ValueError, can.CanError) as error:
+            self.disconnect(client, str(error))
+
+    def update_writers(self):
+        """
+        Watches for writability on exactly the clients with unsent output.
+        """
+        with self.lock:
+            clients = list(self.clients.values())
+
+        for client in clients:
+            with self.lock:
+                pending = not client.flush()
+
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if pending else selectors.EVENT_READ
+            if self.selector.get_key(client.socket).events != events:
+                self.selector.modify(client.socket, events)
+
+    def serve(self):
+        self.running.set()
+        receiver = threading.Thread(target=self.receive_loop, name="can_broker_receiver", daemon=True)
+        receiver.start()
+
+        try:
+            while True:
+                for key, events in self.selector.select(1):
+                    if key.fileobj is self.listener:
+                        self.accept()
+                    elif key.fileobj is self.wake_reader:
+                        try:
+                            while self.wake_reader.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    else:
+                        client = self.clients.get(key.fileobj)
+                        if client is not None and events & selectors.EVENT_READ:
+                            self.handle_input(client)
+
+                self.update_writers()
+        finally:
+            self.running.clear()
+            receiver.join()
+
+            with self.lock:
+                clients = list(self.clients.values())
+            for client in clients:
+                self.disconnect(client, "broker stopped")
+
+            self.selector.close()
+            self.listener.close()
+            self.wake_reader.close()
+            self.wake_writer.close()
+            os.unlink(self.path)
+
+
+if __name__ == "__main__":
+
+    print("Boosted Board CAN Bus Broker v1")
+    print("https://beambreak.org / https://github.com/rscullin/beambreak")
+    print("")
+
+    parser = argparse.ArgumentParser(
+        prog='can_broker.py',
+        description='Owns a CAN adapter and shares it with other tools over a Unix socket. Connect to it with '
+                    '`-i broker -c <socket path>`.')
+
+    parser.add_argument('-i',
+                        '--interface',
+                        help='Name of the `python-can` interface to use. Defaults to `slcan`',
+                        default="slcan")
+    parser.add_argument('-c',
+                        '--channel',
+                        help='"Channel" of the `python-can` interface to use. If you are using `slcan`, this is the '
+                             'path to the serial adapter.',
+                        required=True)
+    parser.add_argument('-s',
+                        '--socket',
+                        help=f'Path of the Unix socket to serve on. Defaults to `{DEFAULT_SOCKET}`.',
+                        default=DEFAULT_SOCKET)
+    parser.add_argument('--client-buffer',
+                        help='Frames buffered per client before its frames are dropped. Defaults to 4096.',
+                        type=int,
+                        default=4096)
+
+    args = parser.parse_args()
+
+    bus, _ = open_filtered_bus(args.interface, args.channel, [])
+
+    with bus:
+        print(f"CAN Adapter Initialized! {args.interface} at {args.channel}")
+
+        broker = CanBroker(bus, args.socket, args.client_buffer)
+        print(f"Serving on {args.socket}")
+
+        try:
+            broker.serve()
+        except KeyboardInterrupt:
+            print()
+            print(f"Broker stopped, received {broker.frames_received} frames, transmitted "
+                  f"{broker.frames_transmitted} frames.")
+
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
\ No newline at end of file
@@ -0,0 +1,175 @@
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# Declarative CAN ID filter sets for the Boosted Board ID layout (see boosted_ids.py).
+#
+# A filter set is a list of (id, mask) pairs -- a frame matches if `arbitration_id & mask == id` for any pair.
+# They're built from the parts of the ID that matter, ex: "src 4, any dest, channel 0x11", or an exact normalized ID.
+# The Long Command and Rolling Code bits are never part of the mask, so every fragment / rolling ID of a message
+# matches. SR Battery IDs (0x0B57EDxx) don't have those bits, so an exact SR ID is matched on all 29 bits -- the same
+# split as `boosted_ids.message_key()`.
+#
+# Where the python-can backend can filter in the driver or kernel (ex: SocketCAN), the set is handed to it as
+# `can_filters`, and unwanted frames never reach Python. Where it can't (ex: slcan), python-can would fall back to
+# checking every filter in Python for every frame; instead, `open_filtered_bus()` returns a precompiled filter that
+# does one set lookup per distinct mask.
+#
+# The `broker` interface (see `can_broker.py`) filters in the broker process, so it counts as filtering in the driver.
+
+import can
+
+from boosted_ids import ID_NORMALIZE_MASK, is_sr_id
+
+SRC_MASK = 0x000F0000
+DEST_MASK = 0x0000F000
+CHANNEL_MASK = 0x00000FF0
+
+EXTENDED_ID_MASK = 0x1FFFFFFF
+
+
+def exact(normalized_id: int):
+    """
+    Matches one message, whatever its Long Command and Rolling Code bits are. SR Battery IDs only match themselves.
+    """
+    if is_sr_id(normalized_id):
+        return normalized_id, EXTENDED_ID_MASK
+    return normalized_id & ID_NORMALIZE_MASK, ID_NORMALIZE_MASK
+
+
+def group(src: int = None, dest: int = None, channel: int = None):
+    """
+    Matches every message with the given src / dest / channel. `None` matches anything.
+    """
+    can_id = 0
+    mask = 0
+
+    if src is not None:
+        can_id = can_id | (src << 16)
+        mask = mask | SRC_MASK
+    if dest is not None:
+        can_id = can_id | (dest << 12)
+        mask = mask | DEST_MASK
+    if channel is not None:
+        can_id = can_id | (channel << 4)
+        mask = mask | CHANNEL_MASK
+
+    return can_id, mask
+
+
+def parse_group(value: str):
+    """
+    Parses `SRC:DEST:CHANNEL` in hex, with `*` as a wildcard -- ex: `4:6:11`, or `*:*:11` for the CLI channel.
+    """
+    parts = value.split(":")
+    if len(parts) != 3:
+        raise ValueError(f"Expected SRC:DEST:CHANNEL, got `{value}`")
+
+    src, dest, channel = [None if part in ("*", "") else int(part, 16) for part in parts]
+    return group(src, dest, channel)
+
+
+def to_can_filters(filter_set):
+    """
+    python-can `can_filters` for a filter set.
+    """
+    return [{"can_id": can_id, "can_mask": mask, "extended": True} for can_id, mask in filter_set]
+
+
+class CompiledFilter:
+    """
+    Software fallback for backends that can't filter in the driver. Pairs are grouped by mask, so a frame costs one
+    AND and one set lookup per distinct mask, rather than one comparison per pair.
+    """
+
+    def __init__(self, filter_set):
+        ids_by_mask = {}
+        for can_id, mask in filter_set:
+            ids_by_mask.setdefault(mask, set()).add(can_id & mask)
+
+        self.masks = tuple((mask, frozenset(ids)) for mask, ids in ids_by_mask.items())
+
+    def matches(self, arbitration_id: int) -> bool:
+        for mask, ids in self.masks:
+            if arbitration_id & mask in ids:
+                return True
+        return False
+
+
+def backend_filters(bus: can.BusABC) -> bool:
+    """
+    True if the backend applies `can_filters` itself (in the driver, kernel, or adapter) instead of in python-can.
+    """
+    return type(bus)._apply_filters is not can.BusABC._apply_filters
+
+
+def open_bus(interface: str, channel: str, **kwargs) -> can.BusABC:
+    """
+    Opens a bus at the Boosted bitrate. The `broker` interface connects to a `can_broker.py` socket instead of an
+    adapter.
+    """
+    if interface == "broker":
+        from can_broker import BrokerBus
+        return BrokerBus(channel, **kwargs)
+
+    return can.interface.Bus(bustype=interface, channel=channel, bitrate=250000, **kwargs)
+
+
+def apply_filters(bus: can.BusABC, filter_set):
+    """
+    Limits an open bus to frames matching `filter_set` (all frames if it's empty).
+
+    Returns None if the backend does the filtering; otherwise a `CompiledFilter` the caller needs to check each received
+    frame against.
+    """
+    if not filter_set:
+        return None
+
+    if backend_filters(bus):
+        bus.set_filters(to_can_filters(filter_set))
+        return None
+
+    return CompiledFilter(filter_set)
+
+
+def parse_bus(value: str, default_interface: str):
+    """
+    `interface:channel`, or just `channel` to use the default interface -- the `-b` / bus arguments of the scripts.
+    Returns (interface, channel), for `open_bus()`.
+    """
+    if ":" in value:
+        interface, channel = value.split(":", 1)
+        return interface, channel
+    return default_interface, value
+
+
+def open_filtered_bus(interface: str, channel: str, filter_set, **kwargs):
+    """
+    Opens a bus that only delivers frames matching `filter_set` (all frames if it's empty).
+
+    Returns (bus, software_filter) -- see `apply_filters()`.
+    """
+    bus = open_bus(interface, channel, **kwargs)
+    return bus, apply_filters(bus, filter_set)
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
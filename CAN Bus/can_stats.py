@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+import argparse
+import bisect
+import json
+import sys
+import can
+
+from boosted_ids import SR_MESSAGE_PERIODS, SR_OPTIONAL_MESSAGES, is_sr_id, message_key
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can
+
+# Online per-ID traffic profiler for Boosted Board CAN Buses.
+#
+# Frames are keyed on the normalized ID (0xFF0FFFF0 -- SR Battery 0x0B57EDxx IDs are left as-is, as masking them
+# would merge different messages). For every ID it keeps a count, the first/last timestamps, min/max/mean
+# inter-arrival time and a fixed-bucket inter-arrival histogram, so memory only grows with the number of distinct
+# IDs (capped at `max_ids`), never with the number of frames.
+#
+# Bus utilisation is estimated from the bits each frame takes on the wire: a 29-bit ID data frame is 67 bits of
+# overhead (SOF, arbitration, control, CRC, ACK, EOF and the inter-frame space) plus 8 bits per data byte, plus bit
+# stuffing -- which depends on the data, so the worst case (one stuff bit per 4 stuffable bits) is used.
+#
+# IDs with a documented rate in `SR Battery CAN Bus.md` are flagged when their mean period is off by more than
+# `PERIOD_TOLERANCE`. On an SR bus, documented repeating messages that never showed up are listed as missing --
+# except the optional ones (`boosted_ids.SR_OPTIONAL_MESSAGES`), which an emulated battery doesn't send.
+#
+# It's a python-can Listener, so it can be added to a Notifier, or fed from a log file:
+#
+#  profiler = TrafficProfiler()
+#  for msg in can.CanutilsLogReader("boosted_log_1234_all.log"):
+#      profiler.on_message_received(msg)
+#  profiler.print_summary()
+
+BITRATE = 250000
+
+# SOF + 11 bit ID + SRR + IDE + 18 bit ID + RTR + r1 + r0 + DLC + CRC + CRC delimiter + ACK + ACK delimiter + EOF + IFS
+EXTENDED_FRAME_OVERHEAD_BITS = 1 + 11 + 1 + 1 + 18 + 1 + 2 + 4 + 15 + 1 + 2 + 7 + 3
+STANDARD_FRAME_OVERHEAD_BITS = 1 + 11 + 1 + 1 + 1 + 4 + 15 + 1 + 2 + 7 + 3
+
+# Bits covered by stuffing (SOF through CRC), excluding the data
+EXTENDED_STUFFED_BITS = 1 + 11 + 1 + 1 + 18 + 1 + 2 + 4 + 15
+STANDARD_STUFFED_BITS = 1 + 11 + 1 + 1 + 1 + 4 + 15
+
+# Upper edges (seconds) of the inter-arrival histogram buckets. The last bucket is everything slower.
+HISTOGRAM_EDGES = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+DOCUMENTED_PERIODS = SR_MESSAGE_PERIODS
+
+PERIOD_TOLERANCE = 0.2
+
+
+def frame_bits(dlc: int, is_extended_id: bool = True) -> int:
+    """
+    Worst-case bits on the wire for a data frame, including bit stuffing and the inter-frame space.
+    """
+    if is_extended_id:
+        return EXTENDED_FRAME_OVERHEAD_BITS + 8 * dlc + (EXTENDED_STUFFED_BITS + 8 * dlc - 1) // 4
+    return STANDARD_FRAME_OVERHEAD_BITS + 8 * dlc + (STANDARD_STUFFED_BITS + 8 * dlc - 1) // 4
+
+
+class IdStats:
+    __slots__ = ("count", "first_timestamp", "last_timestamp", "interval_min", "interval_max", "interval_total",
+                 "histogram", "bits")
+
+    def __init__(self, timestamp: float):
+        self.count = 0
+        self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+        self.interval_min = None
+        self.interval_max = 0.0
+        self.interval_total = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_EDGES) + 1)
+        self.bits = 0
+
+    @property
+    def mean_interval(self):
+        if self.count < 2:
+            return None
+        return self.interval_total / (self.count - 1)
+
+    @property
+    def rate(self) -> float:
+        duration = self.last_timestamp - self.first_timestamp
+        if duration <= 0:
+            return 0.0
+        return (self.count - 1) / duration
+
+
+class TrafficProfiler(can.Listener):
+
+    def __init__(self, bitrate: int = BITRATE, max_ids: int = 4096):
+        self.bitrate = bitrate
+        self.max_ids = max_ids
+
+        self.ids = {}
+        self.other_frames = 0
+
+        self.frames = 0
+        self.bits = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+        # Bits since the last `window_utilisation()` call, for the "right now" bus load
+        self.window_bits = 0
+        self.window_start = None
+        self.peak_utilisation = 0.0
+
+    def on_message_received(self, msg: can.Message) -> None:
+        timestamp = msg.timestamp
+        bits = frame_bits(msg.dlc, msg.is_extended_id)
+
+        self.frames = self.frames + 1
+        self.bits = self.bits + bits
+        self.window_bits = self.window_bits + bits
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+            self.window_start = timestamp
+        self.last_timestamp = timestamp
+
+        key = message_key(msg.arbitration_id)
+        stats = self.ids.get(key)
+
+        if stats is None:
+            if len(self.ids) >= self.max_ids:
+                self.other_frames = self.other_frames + 1
+                return
+            stats = IdStats(timestamp)
+            self.ids[key] = stats
+        else:
+            interval = timestamp - stats.last_timestamp
+            stats.interval_total = stats.interval_total + interval
+            if stats.interval_min is None or interval < stats.interval_min:
+                stats.interval_min = interval
+            if interval > stats.interval_max:
+                stats.interval_max = interval
+            bucket = bisect.bisect_left(HISTOGRAM_EDGES, interval)
+            stats.histogram[bucket] = stats.histogram[bucket] + 1
+            stats.last_timestamp = timestamp
+
+        stats.count = stats.count + 1
+        stats.bits = stats.bits + bits
+
+    def utilisation(self) -> float:
+        """
+        Average bus utilisation (0-1) over the whole capture.
+        """
+        if self.first_timestamp is None or self.last_timestamp <= self.first_timestamp:
+            return 0.0
+        return self.bits / ((self.last_timestamp - self.first_timestamp) * self.bitrate)
+
+    def window_utilisation(self) -> float:
+        """
+        Bus utilisation (0-1) since the last call, which starts a new window.
+        """
+        if self.window_start is None or self.last_timestamp <= self.window_start:
+            return 0.0
+
+        utilisation = self.window_bits / ((self.last_timestamp - self.window_start) * self.bitrate)
+        self.peak_utilisation = max(self.peak_utilisation, utilisation)
+
+        self.window_bits = 0
+        self.window_start = self.last_timestamp
+        return utilisation
+
+    def period_deviation(self, key: int, stats: IdStats):
+        """
+        Relative difference between the measured and documented period, or None if there's no documented period.
+        """
+        documented = DOCUMENTED_PERIODS.get(key)
+        if documented is None or stats.mean_interval is None:
+            return None
+        return (stats.mean_interval - documented) / documented
+
+    def missing_ids(self) -> list:
+        """
+        Documented, non-optional repeating SR messages that haven't been seen -- only once there's SR traffic at all.
+        """
+        if not any(is_sr_id(key) for key in self.ids):
+            return []
+        return [key for key in sorted(DOCUMENTED_PERIODS) if key not in self.ids and key not in SR_OPTIONAL_MESSAGES]
+
+    def print_summary(self):
+        print(f"{self.frames} frames, {len(self.ids)} IDs, bus load {self.window_utilisation() * 100:.1f}% "
+              f"(average {self.utilisation() * 100:.1f}%, peak {self.peak_utilisation * 100:.1f}%)")
+        print("ID          Count     Rate/s   Mean int  Min int   Max int   Expected")
+
+        for key in sorted(self.ids):
+            stats = self.ids[key]
+            mean = stats.mean_interval
+            documented = DOCUMENTED_PERIODS.get(key)
+
+            expected = ""
+            if documented is not None:
+                expected = f"{documented}s"
+                deviation = self.period_deviation(key, stats)
+                if deviation is not None and abs(deviation) > PERIOD_TOLERANCE:
+                    expected = expected + f" ({deviation * 100:+.0f}%) !"
+
+            print(f"0x{key:08X}  {stats.count:<8}  {stats.rate:7.2f}  "
+                  f"{format_interval(mean)}  {format_interval(stats.interval_min)}  "
+                  f"{format_interval(stats.interval_max if stats.count > 1 else None)}  {expected}")
+
+        if self.other_frames:
+            print(f"(+{self.other_frames} frames from IDs past the {self.max_ids} ID limit)")
+
+        missing = self.missing_ids()
+        if missing:
+            print(f"Missing documented messages: {', '.join(f'0x{key:08X}' for key in missing)} !")
+
+    def to_dict(self) -> dict:
+        ids = {}
+        for key, stats in sorted(self.ids.items()):
+            ids[f"0x{key:08X}"] = {
+                "count": stats.count,
+                "rate": stats.rate,
+                "first_timestamp": stats.first_timestamp,
+                "last_timestamp": stats.last_timestamp,
+                "interval_mean": stats.mean_interval,
+                "interval_min": stats.interval_min,
+                "interval_max": stats.interval_max if stats.count > 1 else None,
+                "interval_histogram": dict(zip([f"<={edge}" for edge in HISTOGRAM_EDGES] + ["slower"],
+                                               stats.histogram)),
+                "bus_share": stats.bits / self.bits if self.bits else 0.0,
+                "documented_period": DOCUMENTED_PERIODS.get(key),
+                "period_deviation": self.period_deviation(key, stats),
+            }
+
+        return {
+            "frames": self.frames,
+            "first_timestamp": self.first_timestamp,
+            "last_timestamp": self.last_timestamp,
+            "bitrate": self.bitrate,
+            "utilisation": self.utilisation(),
+            "peak_utilisation": self.peak_utilisation,
+            "other_frames": self.other_frames,
+            "missing_ids": [f"0x{key:08X}" for key in self.missing_ids()],
+            "ids": ids,
+        }
+
+    def dump_json(self, path):
+        with open(path, "w") as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+
+
+def format_interval(interval) -> str:
+    if interval is None:
+        return "-".ljust(8)
+    return f"{interval * 1000:6.1f}ms"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='can_stats.py',
+        description='Per-ID rates, inter-arrival times and bus load for a can-utils `.log` capture.')
+
+    parser.add_argument('log',
+                        help='can-utils `.log` file to read')
+    parser.add_argument('-j',
+                        '--json',
+                        help='Also write the statistics to this JSON file',
+                        required=False)
+
+    args = parser.parse_args()
+
+    traffic = TrafficProfiler()
+    for message in can.CanutilsLogReader(args.log):
+        traffic.on_message_received(message)
+
+    traffic.print_summary()
+
+    if args.json:
+        traffic.dump_json(args.json)
+
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+import argparse
+import re
+import sys
+import numpy as np
+
+from boosted_binlog import BinaryLogReader
+from log_reader import read_log
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install numpy
+
+# Vectorized DBC signal decoder.
+#
+# Each DBC message is compiled into an extraction plan -- per signal, a shift and a mask into the 8 data bytes
+# (viewed as a single 64-bit integer), plus scaling. The plan is then applied to whole columns of frames at once,
+# so decoding every cell voltage sample in a million-frame capture is a handful of NumPy operations per message,
+# not a Python loop per frame.
+#
+# Example:
+#
+#  db = load_dbc("SR_Battery.dbc")
+#  series = db.decode(timestamps, arbitration_ids, data)
+#  series["SR_Battery_Info_10"]["PackVoltage"]  # -> float64 array, in volts
+#  series["SR_Battery_Info_10"]["timestamp"]    # -> matching timestamps
+#
+# `timestamps`, `arbitration_ids` and `data` are the columns from `boosted_binlog.BinaryLogReader` (data is an Nx8
+# uint8 array). `load_columns()` gets the same columns from a .bblog or can-utils .log file.
+#
+# Only the subset of DBC used by this repo is supported -- BO_ and SG_ lines, Intel (@1) and Motorola (@0) byte
+# order, signed and unsigned signals. Multiplexed signals and floating point signal types aren't.
+
+# DBC files set bit 31 on extended (29-bit) IDs
+DBC_EXTENDED_ID_FLAG = 0x80000000
+
+BO_PATTERN = re.compile(r"^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)\s+(\w+)")
+SG_PATTERN = re.compile(r"^SG_\s+(\w+)\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*"
+                        r"\(([^,]+),([^)]+)\)\s*\[([^|]*)\|([^\]]*)\]\s*\"([^\"]*)\"")
+
+
+class DbcSignal:
+    """
+    A single signal, compiled down to `(raw >> shift) & mask` on the frame's data read as a 64-bit integer
+    (little endian for Intel signals, big endian for Motorola).
+    """
+
+    def __init__(self, name: str, start_bit: int, length: int, little_endian: bool, signed: bool,
+                 factor: float, offset: float, unit: str = ""):
+        self.name = name
+        self.start_bit = start_bit
+        self.length = length
+        self.little_endian = little_endian
+        self.signed = signed
+        self.factor = factor
+        self.offset = offset
+        self.unit = unit
+
+        if little_endian:
+            self.shift = start_bit
+        else:
+            # Motorola signals give the MSB's position in the DBC "sawtooth" bit numbering
+            msb = (start_bit // 8) * 8 + (7 - start_bit % 8)
+            self.shift = 63 - (msb + length - 1)
+
+        self.mask = (1 << length) - 1
+        self.is_scaled = factor != 1 or offset != 0
+
+    def extract(self, raw_le, raw_be):
+        raw = raw_le if self.little_endian else raw_be
+        values = (raw >> np.uint64(self.shift)) & np.uint64(self.mask)
+
+        if self.signed:
+            values = values.astype(np.int64)
+            # A full 64-bit signal is already sign extended by the cast (and 1 << 64 doesn't fit an int64)
+            if self.length < 64:
+                values = np.where(values & (1 << (self.length - 1)), values - (1 << self.length), values)
+
+        if self.is_scaled:
+            return values * self.factor + self.offset
+
+        return values
+
+
+class DbcMessage:
+    def __init__(self, frame_id: int, name: str, dlc: int, sender: str):
+        self.frame_id = frame_id
+        self.name = name
+        self.dlc = dlc
+        self.sender = sender
+        self.signals = []
+
+    def decode(self, timestamps, raw_le):
+        """
+        Decodes every signal from the given rows (all of which must be this message) in one pass.
+        `raw_le` is each frame's 8 data bytes read as a little endian 64-bit integer.
+        """
+        # Only pay for the byte swap if a Motorola signal needs it
+        raw_be = None
+        if any(not signal.little_endian for signal in self.signals):
+            raw_be = raw_le.byteswap()
+
+        series = {"timestamp": timestamps}
+        for signal in self.signals:
+            series[signal.name] = signal.extract(raw_le, raw_be)
+
+        return series
+
+
+class DbcDatabase:
+    def __init__(self):
+        self.messages = {}
+
+    def message_by_name(self, name: str) -> DbcMessage:
+        for message in self.messages.values():
+            if message.name == name:
+                return message
+        raise KeyError(name)
+
+    def decode(self, timestamps, arbitration_ids, data, id_mask: int = 0x1FFFFFFF):
+        """
+        Decodes all messages with signals from columns of frames.
+
+        `id_mask` is applied to the arbitration IDs before matching. The SR IDs (0x0B57EDxx) don't use the
+        Long Command / Rolling Code scheme, so the default doesn't mask anything; use 0xFF0FFFF0 for messages
+        defined with normalized IDs.
+
+        Returns {message name: {"timestamp": array, signal name: array, ...}}, only for messages that were seen.
+        """
+        data = np.asarray(data, dtype=np.uint8)
+        if data.shape[1] < 8:
+            data = np.pad(data, ((0, 0), (0, 8 - data.shape[1])))
+
+        ids = np.asarray(arbitration_ids, dtype=np.uint32) & np.uint32(id_mask)
+        raw_le = np.ascontiguousarray(data[:, :8]).view("<u8")[:, 0]
+
+        decoded = {}
+        for frame_id, message in self.messages.items():
+            if not message.signals:
+                continue
+
+            rows = np.flatnonzero(ids == frame_id)
+            if len(rows) == 0:
+                continue
+
+            decoded[message.name] = message.decode(timestamps[rows], raw_le[rows])
+
+        return decoded
+
+
+def parse_dbc(text: str) -> DbcDatabase:
+    db = DbcDatabase()
+    message = None
+
+    for line in text.splitlines():
+        line = line.strip()
+
+        match = BO_PATTERN.match(line)
+        if match:
+            frame_id = int(match.group(1)) & ~DBC_EXTENDED_ID_FLAG
+            message = DbcMessage(frame_id, match.group(2), int(match.group(3)), match.group(4))
+            db.messages[frame_id] = message
+            continue
+
+        match = SG_PATTERN.match(line)
+        if match and message is not None:
+            message.signals.append(DbcSignal(name=match.group(1),
+                                             start_bit=int(match.group(2)),
+                                             length=int(match.group(3)),
+                                             little_endian=match.group(4) == "1",
+                                             signed=match.group(5) == "-",
+                                             factor=float(match.group(6)),
+                                             offset=float(match.group(7)),
+                                             unit=match.group(10)))
+            continue
+
+        # Signals only follow their BO_ line
+        if not line:
+            message = None
+
+    return db
+
+
+def load_dbc(path) -> DbcDatabase:
+    with open(path, "r") as dbc_file:
+        return parse_dbc(dbc_file.read())
+
+
+def load_columns(path):
+    """
+    Returns (timestamps, arbitration_ids, data) columns for a .bblog or can-utils .log capture.
+    """
+    if str(path).endswith(".bblog"):
+        reader = BinaryLogReader(path)
+        return reader.timestamps, reader.arbitration_ids, reader.data
+
+    columns = read_log(path)
+    return columns.timestamps, columns.arbitration_ids, columns.data
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='dbc_decoder.py',
+        description='Decodes the signals in a DBC file from a Boosted Board CAN capture (.log or .bblog).')
+
+    parser.add_argument('dbc',
+                        help='DBC file, ex: SR_Battery.dbc')
+    parser.add_argument('capture',
+                        help='Capture to decode')
+    parser.add_argument('-m',
+                        '--message',
+                        help='Only show this message, ex: SR_Battery_Info_10',
+                        required=False)
+    parser.add_argument('--csv',
+                        help='Write the decoded series of `--message` to this CSV file',
+                        required=False)
+
+    args = parser.parse_args()
+
+    database = load_dbc(args.dbc)
+    decoded_series = database.decode(*load_columns(args.capture))
+
+    for message_name, columns in decoded_series.items():
+        if args.message and message_name != args.message:
+            continue
+
+        print(f"== {message_name} ({len(columns['timestamp'])} frames) ==")
+        for signal_name, values in columns.items():
+            if signal_name == "timestamp":
+                continue
+            print(f"- {signal_name}: min {values.min()}, max {values.max()}, last {values[-1]}")
+        print()
+
+    if args.csv:
+        if not args.message or args.message not in decoded_series:
+            print("`--csv` needs a `--message` that's present in the capture.")
+            sys.exit(1)
+
+        columns = decoded_series[args.message]
+        np.savetxt(args.csv, np.column_stack(list(columns.values())), delimiter=",",
+                   header=",".join(columns.keys()), comments="")
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
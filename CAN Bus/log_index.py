@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import os
+import struct
+import sys
+import time
+import can
+
+from boosted_ids import ID_NORMALIZE_MASK, SR_ID_BASE, SR_ID_MASK, message_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can numpy
+
+# Sidecar block index for can-utils .log captures, so "every 0x0B57ED14 frame between t1 and t2" reads a handful of
+# blocks instead of the whole file.
+#
+# A log is cut into blocks of whole lines (~1MB, or 8192 frames when built while logging). The index, saved next to
+# the log as `<log>.idx`, records each block's byte range, lowest and highest timestamp, frame count, and how many
+# frames of each message it holds. Messages are keyed like `boosted_ids.message_key()` -- the normalized ID, except
+# for the SR Battery IDs.
+#
+# Index file (little endian):
+#
+#  Header (32 bytes)
+#   8s  Magic, "BBLOGIDX"
+#   H   Format version (1)
+#   2x  Reserved
+#   I   Block count
+#   I   Entry count
+#   Q   Size of the log when it was indexed -- a log that's since changed size needs re-indexing
+#   4x  Reserved
+#
+#  Block (40 bytes, one per block, in file order)
+#   Q   Byte offset of the block's first line
+#   Q   Byte offset just past its last line
+#   d   Lowest timestamp
+#   d   Highest timestamp
+#   I   Frame count
+#   I   Index of the block's first entry -- its entries run up to the next block's first entry
+#
+#  Entry (8 bytes)
+#   I   Message key
+#   I   Frames of that message in the block
+#
+# `boosted_logger.py --index` writes the index as it logs; `log_index.py build` indexes existing logs (in parallel).
+# Writing only needs python-can; querying needs NumPy.
+
+INDEX_MAGIC = b"BBLOGIDX"
+INDEX_VERSION = 1
+
+HEADER = struct.Struct("<8sH2xIIQ4x")
+BLOCK = struct.Struct("<QQddII")
+ENTRY = struct.Struct("<II")
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_BLOCK_FRAMES = 8192
+
+if np is not None:
+    BLOCK_DTYPE = np.dtype([
+        ("offset", "<u8"),
+        ("end", "<u8"),
+        ("min_timestamp", "<f8"),
+        ("max_timestamp", "<f8"),
+        ("frames", "<u4"),
+        ("first_entry", "<u4"),
+    ])
+    ENTRY_DTYPE = np.dtype([
+        ("key", "<u4"),
+        ("count", "<u4"),
+    ])
+    assert BLOCK_DTYPE.itemsize == BLOCK.size
+    assert ENTRY_DTYPE.itemsize == ENTRY.size
+
+
+def index_path(log_file) -> str:
+    return f"{log_file}.idx"
+
+
+class LogIndexWriter:
+    """
+    Collects block summaries and saves them as an index.
+
+    Blocks can be added whole (`add_block()`), or built a frame at a time as a log is written: call
+    `on_message_received()` after writing each frame, with the log's file object, and a block is closed (with one
+    `tell()`) every `block_frames` frames.
+    """
+
+    def __init__(self, block_frames: int = DEFAULT_BLOCK_FRAMES):
+        self.block_frames = block_frames
+        self.blocks = []
+        self.entries = []
+
+        self.block_offset = 0
+        self.reset_block()
+
+    def reset_block(self):
+        self.frames = 0
+        self.min_timestamp = None
+        self.max_timestamp = None
+        self.counts = {}
+
+    def add_block(self, offset: int, end: int, min_timestamp: float, max_timestamp: float, frames: int, counts):
+        self.blocks.append((offset, end, min_timestamp, max_timestamp, frames, len(self.entries)))
+        self.entries.extend(sorted(counts.items()))
+
+    def on_message_received(self, msg: can.Message, log_file=None) -> None:
+        timestamp = msg.timestamp
+        if self.min_timestamp is None or timestamp < self.min_timestamp:
+            self.min_timestamp = timestamp
+        if self.max_timestamp is None or timestamp > self.max_timestamp:
+            self.max_timestamp = timestamp
+
+        key = message_key(msg.arbitration_id)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.frames = self.frames + 1
+
+        if log_file is not None and self.frames >= self.block_frames:
+            self.close_block(log_file.tell())
+
+    def close_block(self, end: int):
+        if self.frames:
+            self.add_block(self.block_offset, end, self.min_timestamp, self.max_timestamp, self.frames, self.counts)
+        self.block_offset = end
+        self.reset_block()
+
+    def save(self, path, source_size: int):
+        with open(path, "wb") as output:
+            output.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self.blocks), len(self.entries), source_size))
+            for block in self.blocks:
+                output.write(BLOCK.pack(*block))
+            for entry in self.entries:
+                output.write(ENTRY.pack(*entry))
+
+
+def message_keys(arbitration_ids):
+    """
+    `boosted_ids.message_key()` for a column of IDs.
+    """
+    ids = np.asarray(arbitration_ids, dtype=np.uint32)
+    return np.where((ids & np.uint32(SR_ID_MASK)) == SR_ID_BASE, ids, ids & np.uint32(ID_NORMALIZE_MASK))
+
+
+def summarize_range(path, start: int, end: int):
+    """
+    (start, end, min, max, frames, counts) for one block of a .log file.
+    """
+    from log_reader import parse_range
+
+    columns = parse_range(path, start, end)
+    if not len(columns.timestamps):
+        return start, end, 0.0, 0.0, 0, {}
+
+    keys, counts = np.unique(message_keys(columns.arbitration_ids), return_counts=True)
+    return (start, end, float(columns.timestamps.min()), float(columns.timestamps.max()), len(columns.timestamps),
+            dict(zip(keys.tolist(), counts.tolist())))
+
+
+def build_index(log_file, block_size: int = DEFAULT_BLOCK_SIZE, workers: int = None) -> str:
+    """
+    Indexes an existing .log file, summarizing blocks in parallel across `workers` processes. Returns the index path.
+    """
+    from log_reader import chunk_ranges
+
+    if np is None:
+        raise ImportError("Building an index requires NumPy -- pip3 install numpy")
+
+    size = os.path.getsize(log_file)
+    ranges = chunk_ranges(log_file, size // block_size + 1)
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(ranges) <= 1:
+        summaries = [summarize_range(log_file, start, end) for start, end in ranges]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            summaries = list(pool.map(summarize_range, [log_file] * len(ranges), [start for start, _ in ranges],
+                                      [end for _, end in ranges], chunksize=16))
+
+    writer = LogIndexWriter()
+    for start, end, min_timestamp, max_timestamp, frames, counts in summaries:
+        if frames:
+            writer.add_block(start, end, min_timestamp, max_timestamp, frames, counts)
+
+    path = index_path(log_file)
+    writer.save(path, size)
+    return path
+
+
+class LogIndex:
+    """
+    A loaded index, and queries that only read the blocks that can match.
+    """
+
+    def __init__(self, log_file, path=None):
+        if np is None:
+            raise ImportError("Querying an index requires NumPy -- pip3 install numpy")
+
+        self.log_file = log_file
+        self.path = path or index_path(log_file)
+
+        with open(self.path, "rb") as index_file:
+            contents = index_file.read()
+
+        if len(contents) < HEADER.size:
+            raise ValueError(f"{self.path} is too short to be a log index")
+
+        magic, version, block_count, entry_count, source_size = HEADER.unpack_from(contents, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{self.path} is not a log index")
+        if version != INDEX_VERSION:
+            raise ValueError(f"Unsupported log index version {version}")
+        if os.path.getsize(log_file) != source_size:
+            raise ValueError(f"{log_file} has changed since it was indexed -- rebuild the index")
+
+        self.blocks = np.frombuffer(contents, dtype=BLOCK_DTYPE, count=block_count, offset=HEADER.size)
+        self.entries = np.frombuffer(contents, dtype=ENTRY_DTYPE, count=entry_count,
+                                     offset=HEADER.size + block_count * BLOCK.size)
+
+        # The block each entry belongs to
+        entry_ends = np.append(self.blocks["first_entry"][1:], entry_count).astype(np.int64)
+        self.entry_blocks = np.repeat(np.arange(block_count), entry_ends - self.blocks["first_entry"])
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def matching_blocks(self, ids=None, start: float = None, end: float = None):
+        """
+        Indices of the blocks that may hold frames of `ids` (any message if None) between `start` and `end`.
+        """
+        selected = np.ones(len(self.blocks), dtype=bool)
+
+        if start is not None:
+            selected &= self.blocks["max_timestamp"] >= start
+        if end is not None:
+            selected &= self.blocks["min_timestamp"] <= end
+
+        if ids is not None:
+            keys = message_keys(list(ids))
+            has_key = np.zeros(len(self.blocks), dtype=bool)
+            has_key[self.entry_blocks[np.isin(self.entries["key"], keys)]] = True
+            selected &= has_key
+
+        return np.flatnonzero(selected)
+
+    def id_counts(self, start: float = None, end: float = None) -> dict:
+        """
+        Frames per message key, from the index alone. Blocks that straddle `start` or `end` count in full, so this is an
+        upper bound for a window.
+        """
+        blocks = self.matching_blocks(None, start, end)
+        entries = self.entries[np.isin(self.entry_blocks, blocks)]
+
+        keys, inverse = np.unique(entries["key"], return_inverse=True)
+        counts = np.bincount(inverse, weights=entries["count"], minlength=len(keys))
+        return dict(zip(keys.tolist(), counts.astype(np.int64).tolist()))
+
+    def byte_ranges(self, blocks):
+        """
+        Byte ranges covering `blocks`, with adjacent blocks merged into one read.
+        """
+        ranges = []
+        for offset, end in zip(self.blocks["offset"][blocks].tolist(), self.blocks["end"][blocks].tolist()):
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1][1] = end
+            else:
+                ranges.append([offset, end])
+        return ranges
+
+    def query(self, ids=None, start: float = None, end: float = None, normalize: bool = False):
+        """
+        Frames of `ids` (any message if None) between `start` and `end`, as `log_reader.LogColumns`. Only the blocks
+        that can match are read.
+        """
+        from log_reader import concatenate, parse_range
+
+        parts = []
+        keys = None if ids is None else message_keys(list(ids))
+
+        for offset, block_end in self.byte_ranges(self.matching_blocks(ids, start, end)):
+            columns = parse_range(self.log_file, offset, block_end)
+
+            keep = np.ones(len(columns.timestamps), dtype=bool)
+            if keys is not None:
+                keep &= np.isin(message_keys(columns.arbitration_ids), keys)
+            if start is not None:
+                keep &= columns.timestamps >= start
+            if end is not None:
+                keep &= columns.timestamps <= end
+
+            parts.append(type(columns)(*[column[keep] for column in columns]))
+
+        result = concatenate(parts)
+        if normalize:
+            result = result._replace(arbitration_ids=result.arbitration_ids & np.uint32(ID_NORMALIZE_MASK))
+        return result
+
+
+def query_log(log_file, ids=None, start: float = None, end: float = None, normalize: bool = False):
+    """
+    Queries a .log file through its index, building the index first if there isn't one.
+    """
+    if not os.path.exists(index_path(log_file)):
+        build_index(log_file)
+    return LogIndex(log_file).query(ids, start, end, normalize)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='log_index.py',
+        description='Builds sidecar `.idx` indexes for can-utils `.log` captures, and queries captures by ID and time '
+                    'through them.')
+
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Index one or more .log files')
+    build_parser.add_argument('logs',
+                              help='can-utils `.log` files to index',
+                              nargs='+')
+    build_parser.add_argument('-j',
+                              '--workers',
+                              help='Number of worker processes. Defaults to the number of cores.',
+                              type=int)
+    build_parser.add_argument('--block-size',
+                              help='Approximate block size in bytes. Defaults to 1MB.',
+                              type=int,
+                              default=DEFAULT_BLOCK_SIZE)
+
+    query_parser = subparsers.add_parser('query', help='Find frames by ID and time')
+    query_parser.add_argument('logs',
+                              help='Indexed can-utils `.log` files to search',
+                              nargs='+')
+    query_parser.add_argument('--id',
+                              help='Only frames of this ID (hex), ex: `0B57ED14`. Can be given more than once.',
+                              action='append')
+    query_parser.add_argument('-s',
+                              '--start',
+                              help='Start of the window, in epoch seconds',
+                              type=float)
+    query_parser.add_argument('-e',
+                              '--end',
+                              help='End of the window, in epoch seconds',
+                              type=float)
+    query_parser.add_argument('-n',
+                              '--normalize',
+                              help='Set the Long Command and Rolling Code bits to 0 in the results',
+                              default=False,
+                              action='store_true')
+    query_parser.add_argument('-o',
+                              '--output',
+                              help='Write the matching frames to this .log file')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        for log in args.logs:
+            started = time.perf_counter()
+            built = build_index(log, args.block_size, args.workers)
+            print(f"Indexed {log} in {time.perf_counter() - started:.2f}s -> {built}")
+        sys.exit()
+
+    query_ids = [int(value, 16) for value in args.id] if args.id else None
+    writer = can.CanutilsLogWriter(args.output) if args.output else None
+    total = 0
+
+    for log in args.logs:
+        started = time.perf_counter()
+        index = LogIndex(log)
+        blocks = index.matching_blocks(query_ids, args.start, args.end)
+        found = index.query(query_ids, args.start, args.end, args.normalize)
+        elapsed = time.perf_counter() - started
+
+        print(f"{log}: {len(found.timestamps)} frames from {len(blocks)} of {len(index)} blocks in {elapsed:.3f}s")
+        total = total + len(found.timestamps)
+
+        if writer is not None:
+            for timestamp, arbitration_id, dlc, data in zip(found.timestamps.tolist(), found.arbitration_ids.tolist(),
+                                                            found.dlcs.tolist(), found.data):
+                writer.on_message_received(can.Message(timestamp=timestamp, arbitration_id=arbitration_id,
+                                                       is_extended_id=True, dlc=dlc, data=data[:dlc].tobytes()))
+
+    if writer is not None:
+        writer.stop()
+
+    print(f"Found {total} frames.")
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
\ No newline at end of file
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+import argparse
+import concurrent.futures
+import os
+import re
+import sys
+import time
+import typing
+import numpy as np
+
+from boosted_ids import ID_NORMALIZE_MASK
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install numpy
+
+# Fast columnar reader for can-utils .log captures (ex: `boosted_log_*_all.log` from `boosted_logger.py`).
+#
+# Instead of building a python-can Message per line, a chunk of the file is parsed in one pass into columns:
+# timestamps, arbitration IDs, DLCs and an Nx8 data array (zero padded past the DLC).
+#
+# `read_log()` splits the file into byte ranges at line boundaries, parses them in a process pool, and joins the
+# columns back together in file order -- so it scales with the number of cores. `iter_log()` parses sequentially,
+# one bounded chunk at a time, for files that don't fit in memory.
+#
+# With `normalize=True`, the Long Command and Rolling Code bits are masked away while parsing (0xFF0FFFF0), the same
+# as a `_MOD` log.
+
+# "(1591000000.000000) can0 10374200#0102030405060708 R" -- the interface name and the R/T suffix are ignored
+LINE_PATTERN = re.compile(rb"^\((\d+(?:\.\d*)?)\)\s+\S+\s+([0-9A-Fa-f]+)#([0-9A-Fa-f]*)", re.MULTILINE)
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class LogColumns(typing.NamedTuple):
+    timestamps: np.ndarray  # float64
+    arbitration_ids: np.ndarray  # uint32
+    dlcs: np.ndarray  # uint8
+    data: np.ndarray  # Nx8 uint8
+
+
+def _columns(timestamps, ids, payloads, normalize: bool) -> LogColumns:
+    count = len(ids)
+
+    timestamp_column = np.fromiter(map(float, timestamps), dtype=np.float64, count=count)
+
+    id_column = np.fromiter(map(int, ids, [16] * count), dtype=np.uint32, count=count)
+    # Strip the error frame / extended flags, as python-can's reader does
+    id_column = id_column & np.uint32(0x1FFFFFFF)
+    if normalize:
+        id_column = id_column & np.uint32(ID_NORMALIZE_MASK)
+
+    dlc_column = np.fromiter(map(len, payloads), dtype=np.uint8, count=count) >> 1
+
+    # One hex decode for the whole chunk, with every payload padded to 8 bytes
+    padded = b"".join([payload[:16].ljust(16, b"0") for payload in payloads])
+    data_column = np.frombuffer(bytes.fromhex(padded.decode("ascii")), dtype=np.uint8).reshape(-1, 8)
+
+    return LogColumns(timestamp_column, id_column, dlc_column, data_column)
+
+
+def parse_lines(text: bytes, normalize: bool = False) -> LogColumns:
+    """
+    Parses a block of complete .log lines into columns.
+    """
+    # Fast path -- every line written by python-can / `boosted_logger.py` is exactly four fields:
+    # "(timestamp) interface ID#DATA R", so the fields can be picked out of one split of the whole block
+    tokens = text.split()
+    if tokens and len(tokens) % 4 == 0:
+        timestamps = tokens[0::4]
+        fields = b"#".join(tokens[2::4]).split(b"#")
+
+        if len(fields) == len(tokens) >> 1 and b"".join(timestamps).count(b"(") == len(timestamps):
+            try:
+                return _columns(b" ".join(timestamps).translate(None, b"()").split(), fields[0::2], fields[1::2],
+                                normalize)
+            except ValueError:
+                # Remote frames, CAN FD, or anything else unusual
+                pass
+
+    frames = LINE_PATTERN.findall(text)
+
+    if not frames:
+        return LogColumns(np.empty(0, dtype=np.float64), np.empty(0, dtype=np.uint32),
+                          np.empty(0, dtype=np.uint8), np.empty((0, 8), dtype=np.uint8))
+
+    timestamps, ids, payloads = zip(*frames)
+    return _columns(timestamps, ids, payloads, normalize)
+
+
+def concatenate(parts) -> LogColumns:
+    parts = list(parts)
+    if not parts:
+        return parse_lines(b"")
+
+    return LogColumns(*[np.concatenate([getattr(part, field) for part in parts]) for field in LogColumns._fields])
+
+
+def chunk_ranges(path, chunks: int):
+    """
+    Splits a file into about `chunks` (start, end) byte ranges, each starting and ending on a line boundary.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    boundaries = [0]
+    with open(path, "rb") as log_file:
+        for index in range(1, chunks):
+            log_file.seek(max(size * index // chunks, boundaries[-1]))
+            log_file.readline()
+            position = log_file.tell()
+            if position >= size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def parse_range(path, start: int, end: int, normalize: bool = False) -> LogColumns:
+    with open(path, "rb") as log_file:
+        log_file.seek(start)
+        return parse_lines(log_file.read(end - start), normalize)
+
+
+def read_log(path, workers: int = None, normalize: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE) -> LogColumns:
+    """
+    Reads a whole .log file into columns, parsing chunks in parallel across `workers` processes (default: all cores).
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = max(workers, os.path.getsize(path) // chunk_size + 1)
+    ranges = chunk_ranges(path, chunks)
+
+    if workers == 1 or len(ranges) <= 1:
+        return concatenate(parse_range(path, start, end, normalize) for start, end in ranges)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        # map() returns results in submission order, so frames stay in file order
+        return concatenate(pool.map(parse_range, [path] * len(ranges), [start for start, _ in ranges],
+                                    [end for _, end in ranges], [normalize] * len(ranges)))
+
+
+def iter_log(path, normalize: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Generator over the columns of a .log file, one chunk (about `chunk_size` bytes) at a time. Memory use is bounded
+    by the chunk size, whatever the size of the file.
+    """
+    with open(path, "rb") as log_file:
+        leftover = b""
+
+        while True:
+            block = log_file.read(chunk_size)
+            if not block:
+                break
+
+            block = leftover + block
+            end = block.rfind(b"\n") + 1
+            if end == 0:
+                leftover = block
+                continue
+
+            leftover = block[end:]
+            yield parse_lines(block[:end], normalize)
+
+        if leftover:
+            yield parse_lines(leftover, normalize)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='log_reader.py',
+        description='Parses a can-utils `.log` capture into columns in parallel, and optionally saves it as a '
+                    '`.bblog` file (see boosted_binlog.py).')
+
+    parser.add_argument('log',
+                        help='can-utils `.log` file to read')
+    parser.add_argument('-j',
+                        '--workers',
+                        help='Number of worker processes. Defaults to the number of cores.',
+                        type=int,
+                        required=False)
+    parser.add_argument('-n',
+                        '--normalize',
+                        help='Set the Long Command and Rolling Code bits to 0 while parsing',
+                        required=False,
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--bblog',
+                        help='Write the parsed frames to this `.bblog` file',
+                        required=False)
+
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    columns = read_log(args.log, args.workers, args.normalize)
+    elapsed = time.perf_counter() - started
+
+    print(f"Parsed {len(columns.timestamps)} frames in {elapsed:.2f}s "
+          f"({len(columns.timestamps) / max(elapsed, 1e-9):.0f} frames/s)")
+
+    if args.bblog:
+        from boosted_binlog import write_columns
+        write_columns(args.bblog, columns.timestamps, columns.arbitration_ids, columns.dlcs, columns.data)
+
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
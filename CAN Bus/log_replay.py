@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+import argparse
+import errno
+import itertools
+import sys
+import time
+import can
+
+from boosted_ids import ROLLING_CODE_MASK, SR_ID_BASE, SR_ID_MASK
+from can_filters import open_bus
+from rolling_code import SENDER_KEYS, sender_of
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can
+
+# Replays recorded Boosted Board traffic onto a bus, to exercise the other tools offline, ex:
+#
+#  python3 log_replay.py boosted_log_1700000000_all.log -i socketcan -c vcan0
+#  python3 log_replay.py boosted_log_1700000000_all.log -i broker -c /tmp/boosted_can.sock --speed 4
+#
+# Reads can-utils .log files (the `_all` logs from `boosted_logger.py` -- the `_MOD` logs have lost their rolling
+# codes), `.bblog` files, and rotated captures by their `_manifest.json`.
+#
+# Timing modes:
+#  - original (the default) -- every frame is sent on an absolute deadline, `start + (timestamp - first timestamp)`,
+#    so time spent sending never accumulates as drift
+#  - scaled, `--speed N` -- the same deadlines, N times faster (or slower, below 1)
+#  - `--max` -- as fast as the interface takes them, for load testing
+#
+# Frames that fall behind are still sent (late), never skipped -- how late each was is reported at the end, along with
+# the achieved frames per second. A full transmit queue is retried for up to `--retry-time` seconds; any other send
+# error (ex: the interface going down) stops the replay.
+#
+# Rolling codes are sent as recorded by default. `--regenerate-rolling` replaces them with a fresh per-sender sequence
+# (keyed like `rolling_code.py`), so a filtered or looped capture still looks gapless to `--rolling-check`.
+
+ROLLING_MODES = ("preserve", "regenerate")
+
+# Transmit errors that mean the interface's queue is full (ex: SocketCAN's ENOBUFS), rather than that it's broken
+BACKPRESSURE_ERRORS = (errno.ENOBUFS, errno.EAGAIN)
+
+
+def is_backpressure(error: can.CanOperationError) -> bool:
+    if error.error_code is not None:
+        return error.error_code in BACKPRESSURE_ERRORS
+    # SocketCAN raises this, without an errno, when its queue is still full after the send timeout
+    return "Transmit buffer full" in str(error)
+
+
+def read_capture(path):
+    """
+    Frames from a .log, .bblog, or rotated capture manifest, streamed in file order.
+    """
+    path = str(path)
+
+    if path.endswith("_manifest.json"):
+        from log_segments import read_window
+        return read_window(path)
+
+    if path.endswith(".bblog"):
+        from boosted_binlog import BinaryLogReader
+        return iter(BinaryLogReader(path))
+
+    return iter(can.CanutilsLogReader(path))
+
+
+class ReplayStats:
+    __slots__ = ("frames", "send_errors", "started", "finished", "latenessTotal", "latenessMax",
+                 "latenessSquaredTotal")
+
+    def __init__(self):
+        self.frames = 0
+        self.send_errors = 0
+        self.started = 0.0
+        self.finished = 0.0
+
+        # How late each send was, compared to its deadline (timed modes only)
+        self.latenessTotal = 0.0
+        self.latenessMax = 0.0
+        self.latenessSquaredTotal = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        return self.finished - self.started
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def mean_lateness(self) -> float:
+        return self.latenessTotal / self.frames if self.frames else 0.0
+
+    @property
+    def jitter(self) -> float:
+        if not self.frames:
+            return 0.0
+        mean = self.mean_lateness
+        return max(self.latenessSquaredTotal / self.frames - mean * mean, 0) ** 0.5
+
+    def to_dict(self) -> dict:
+        return {
+            "frames": self.frames,
+            "send_errors": self.send_errors,
+            "elapsed": self.elapsed,
+            "frames_per_second": self.frames_per_second,
+            "mean_lateness": self.mean_lateness,
+            "max_lateness": self.latenessMax,
+            "jitter": self.jitter,
+        }
+
+
+class LogReplayer:
+    """
+    Sends frames on a bus, on their original timing (optionally scaled by `speed`), or as fast as possible if `speed`
+    is None.
+    """
+
+    def __init__(self, bus: can.BusABC, speed: float = 1.0, rolling: str = "preserve", sender_key: str = "src",
+                 retry_delay: float = 0.001, retry_time: float = 1.0):
+        if rolling not in ROLLING_MODES:
+            raise ValueError(f"rolling must be one of {ROLLING_MODES}")
+        if sender_key not in SENDER_KEYS:
+            raise ValueError(f"sender_key must be one of {SENDER_KEYS}")
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be positive")
+
+        self.bus = bus
+        self.speed = speed
+        self.rolling = rolling
+        self.sender_key = sender_key
+        self.retry_delay = retry_delay
+        self.retry_time = retry_time
+
+        # Next rolling code per sender, when regenerating
+        self.next_codes = {}
+
+        self.stats = ReplayStats()
+
+    def regenerate(self, msg: can.Message):
+        arbitration_id = msg.arbitration_id
+        if not msg.is_extended_id or arbitration_id & SR_ID_MASK == SR_ID_BASE:
+            return
+
+        sender = sender_of(arbitration_id, self.sender_key)
+        code = self.next_codes.get(sender, 0)
+        self.next_codes[sender] = (code + 1) & ROLLING_CODE_MASK
+        msg.arbitration_id = (arbitration_id & ~ROLLING_CODE_MASK) | code
+
+    def send(self, msg: can.Message):
+        # A full transmit queue is backpressure, not a reason to drop the frame -- but only for `retry_time`. Retries
+        # pass the time left as the send timeout, so an interface that can wait for room (SocketCAN) does
+        try:
+            self.bus.send(msg)
+            return
+        except can.CanOperationError as error:
+            if not is_backpressure(error):
+                raise
+
+        give_up = time.perf_counter() + self.retry_time
+        while True:
+            self.stats.send_errors = self.stats.send_errors + 1
+            time.sleep(self.retry_delay)
+
+            try:
+                self.bus.send(msg, timeout=max(give_up - time.perf_counter(), 0.0))
+                return
+            except can.CanOperationError as error:
+                if not is_backpressure(error) or time.perf_counter() >= give_up:
+                    raise
+
+    def run(self, messages, tick=None) -> ReplayStats:
+        stats = self.stats
+        regenerate = self.rolling == "regenerate"
+        speed = self.speed
+
+        start = time.perf_counter()
+        stats.started = start
+        first_timestamp = None
+
+        for msg in messages:
+            if regenerate:
+                self.regenerate(msg)
+
+            if speed is not None:
+                if first_timestamp is None:
+                    first_timestamp = msg.timestamp
+                deadline = start + (msg.timestamp - first_timestamp) / speed
+
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+                self.send(msg)
+
+                lateness = time.perf_counter() - deadline
+                stats.latenessTotal = stats.latenessTotal + lateness
+                stats.latenessMax = max(stats.latenessMax, lateness)
+                stats.latenessSquaredTotal = stats.latenessSquaredTotal + lateness * lateness
+            else:
+                self.send(msg)
+
+            stats.frames = stats.frames + 1
+
+            if tick is not None:
+                tick(msg)
+
+        stats.finished = time.perf_counter()
+        return stats
+
+    def print_summary(self):
+        stats = self.stats
+        print(f"Replayed {stats.frames} frames in {stats.elapsed:.3f}s ({stats.frames_per_second:.0f} frames/s), "
+              f"{stats.send_errors} send retries")
+
+        if self.speed is not None:
+            print(f"Timing error: mean {stats.mean_lateness * 1000:.3f}ms, max {stats.latenessMax * 1000:.3f}ms, "
+                  f"jitter (std) {stats.jitter * 1000:.3f}ms")
+
+
+def looped(path, loops: int):
+    """
+    Frames of a capture `loops` times over (forever if 0), each pass shifted to start where the last one ended.
+    """
+    offset = 0.0
+    passes = itertools.count() if loops == 0 else range(loops)
+
+    for _ in passes:
+        first = None
+        last = None
+
+        for msg in read_capture(path):
+            if first is None:
+                first = msg.timestamp
+            last = msg.timestamp
+            msg.timestamp = msg.timestamp + offset
+            yield msg
+
+        if first is None:
+            return
+        offset = offset + (last - first)
+
+
+if __name__ == "__main__":
+
+    print("Boosted Board CAN Bus Replay v1")
+    print("https://beambreak.org / https://github.com/rscullin/beambreak")
+    print("")
+
+    parser = argparse.ArgumentParser(
+        prog='log_replay.py',
+        description='Replays a recorded Boosted Board capture (.log, .bblog, or `_manifest.json`) onto a CAN bus.',
+        epilog='Prints a `.` every 250 sent CAN frames.')
+
+    parser.add_argument('capture',
+                        help='Capture to replay -- ex: a `boosted_log_*_all.log` file')
+    parser.add_argument('-i',
+                        '--interface',
+                        help='Name of the `python-can` interface to use, ex: `virtual`, `socketcan`. Defaults to '
+                             '`slcan`',
+                        default="slcan")
+    parser.add_argument('-c',
+                        '--channel',
+                        help='"Channel" of the `python-can` interface to use, ex: `vcan0`. If you are using `slcan`, '
+                             'this is the path to the serial adapter.',
+                        required=True)
+    parser.add_argument('-s',
+                        '--speed',
+                        help='Replay this many times faster than recorded (ex: `0.5` for half speed). Defaults to 1.',
+                        type=float,
+                        default=1.0)
+    parser.add_argument('--max',
+                        help='Replay as fast as the interface takes frames, ignoring the recorded timing.',
+                        default=False,
+                        action='store_true')
+    parser.add_argument('-r',
+                        '--regenerate-rolling',
+                        help='Replace the recorded rolling codes with a fresh sequence per sender.',
+                        default=False,
+                        action='store_true')
+    parser.add_argument('-l',
+                        '--loop',
+                        help='Replay the capture this many times back to back (0 loops forever). Defaults to 1.',
+                        type=int,
+                        default=1)
+    parser.add_argument('--retry-time',
+                        help='How long to keep retrying a frame while the interface\'s transmit queue is full, in '
+                             'seconds. Defaults to 1.',
+                        type=float,
+                        default=1.0)
+    parser.add_argument('--preload',
+                        help='Read the whole capture into memory before replaying, so parsing doesn\'t limit `--max`.',
+                        default=False,
+                        action='store_true')
+
+    args = parser.parse_args()
+
+    frames = looped(args.capture, args.loop)
+    if args.preload:
+        if args.loop == 0:
+            parser.error("--preload can't be used with --loop 0")
+        frames = list(frames)
+        print(f"Loaded {len(frames)} frames")
+
+    with open_bus(args.interface, args.channel) as bus:
+
+        print(f"CAN Adapter Initialized! {args.interface} at {args.channel}")
+
+        replayer = LogReplayer(bus, None if args.max else args.speed,
+                               "regenerate" if args.regenerate_rolling else "preserve", retry_time=args.retry_time)
+
+        def progress(msg):
+            # Print a '.' every 250 frames to show _something_ is happening
+            if replayer.stats.frames % 250 == 0:
+                print('.', end="", flush=True)
+
+        failed = False
+        try:
+            replayer.run(frames, progress)
+        except KeyboardInterrupt:
+            replayer.stats.finished = time.perf_counter()
+        except can.CanOperationError as error:
+            replayer.stats.finished = time.perf_counter()
+            failed = True
+            print()
+            print(f"Send failed, stopping: {error}")
+
+        print()
+        print()
+        replayer.print_summary()
+
+    sys.exit(1 if failed else 0)
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
\ No newline at end of file
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+import argparse
+import gzip
+import io
+import json
+import lzma
+import os
+import sys
+import can
+
+from boosted_binlog import HEADER, RECORD, unpack_message
+from boosted_ids import ID_NORMALIZE_MASK
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can (and zstandard, for `zstd` compression)
+
+# Rotated, compressed capture segments, and the manifest that describes them.
+#
+# With rotation or compression on, `boosted_logger.py` writes a capture as a series of segments rather than one
+# ever-growing file, ex:
+#
+#  boosted_log_1700000000_0000_all.log.gz
+#  boosted_log_1700000000_0000_MOD.log.gz
+#  boosted_log_1700000000_0001_all.log.gz
+#  ...
+#  boosted_log_1700000000_manifest.json
+#
+# Every segment is a complete file in its own right -- `zcat`, `xzcat` or `zstdcat` turn it back into a normal
+# can-utils log (or .bblog). A crash only loses the end of the segment being written.
+#
+# The manifest lists each segment's files, first and last frame timestamps, and frame count. It's rewritten
+# (atomically) every time a segment opens or closes, so it's always valid -- a segment is listed as soon as it opens,
+# with its time range and frame count left null until it's finished, so a crashed capture still lists the segment it
+# was writing. `read_window()` uses it to open only the segments that overlap a time window, rather than decompressing
+# the whole capture, and reads an unfinished segment up to wherever it was cut off.
+
+COMPRESSION_SUFFIXES = {
+    "none": "",
+    "gzip": ".gz",
+    "xz": ".xz",
+    "zstd": ".zst",
+}
+
+MANIFEST_VERSION = 1
+
+# What reading the end of a segment that was never closed can raise: a cut-off compressed stream, or a half-written
+# log line
+TRUNCATED_ERRORS = (EOFError, ValueError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class SegmentFile:
+    """
+    A segment file opened for writing, through a streaming compressor.
+
+    `stream` is what gets written to (text for .log files, binary for .bblog), and `size` is the number of bytes that
+    have reached the file so far -- compressed, so it's the figure that matters for filling a disk.
+    """
+
+    def __init__(self, path, compression: str = "none", text: bool = True):
+        self.path = path
+        self.raw = open(path, "wb")
+
+        if compression == "none":
+            compressed = self.raw
+        elif compression == "gzip":
+            compressed = gzip.GzipFile(fileobj=self.raw, mode="wb", compresslevel=6)
+        elif compression == "xz":
+            compressed = lzma.LZMAFile(self.raw, mode="wb", preset=3)
+        elif compression == "zstd":
+            if zstandard is None:
+                self.raw.close()
+                raise ImportError("zstd compression requires zstandard -- pip3 install zstandard")
+            compressed = zstandard.ZstdCompressor(level=3).stream_writer(self.raw, closefd=False)
+        else:
+            self.raw.close()
+            raise ValueError(f"Unknown compression `{compression}`")
+
+        self.compressed = compressed
+        self.stream = io.TextIOWrapper(compressed, encoding="ascii", newline="\n") if text else compressed
+
+    @property
+    def size(self) -> int:
+        return self.raw.tell()
+
+    def close(self):
+        # Each layer flushes into the one below it, so they have to be closed top down
+        self.stream.close()
+        if self.compressed is not self.raw and not self.compressed.closed:
+            self.compressed.close()
+        if not self.raw.closed:
+            self.raw.close()
+
+
+def open_segment(path, text: bool = True):
+    """
+    Opens a (possibly compressed) segment for reading, going by its suffix.
+    """
+    path = str(path)
+
+    if path.endswith(".gz"):
+        stream = gzip.open(path, "rb")
+    elif path.endswith(".xz"):
+        stream = lzma.open(path, "rb")
+    elif path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("Reading zstd segments requires zstandard -- pip3 install zstandard")
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    else:
+        stream = open(path, "rb")
+
+    if text:
+        return io.TextIOWrapper(stream, encoding="ascii", newline="\n")
+    return stream
+
+
+def is_binary_segment(path) -> bool:
+    name = str(path)
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if suffix and name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name.endswith(".bblog")
+
+
+class SegmentManifest:
+    """
+    The list of segments in a capture, saved as JSON next to them.
+    """
+
+    def __init__(self, path, start_time: float = 0.0, log_format: str = "log", compression: str = "none"):
+        self.path = path
+        self.start_time = start_time
+        self.format = log_format
+        self.compression = compression
+        self.segments = []
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            contents = json.load(file)
+
+        if contents.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version {contents.get('version')}")
+
+        manifest = cls(path, contents["start_time"], contents["format"], contents["compression"])
+        manifest.segments = contents["segments"]
+        return manifest
+
+    @property
+    def directory(self):
+        return os.path.dirname(os.path.abspath(self.path))
+
+    def add(self, index: int, files, first_timestamp=None, last_timestamp=None, frames: int = None):
+        """
+        Lists a segment. It's added with just its files when it opens, then added again (replacing that entry) with its
+        time range and frame count when it's finished.
+        """
+        segment = {
+            "index": index,
+            "files": [os.path.basename(file) for file in files],
+            "start": first_timestamp,
+            "end": last_timestamp,
+            "frames": frames,
+        }
+
+        if self.segments and self.segments[-1]["index"] == index:
+            self.segments[-1] = segment
+        else:
+            self.segments.append(segment)
+
+    def save(self):
+        contents = {
+            "version": MANIFEST_VERSION,
+            "start_time": self.start_time,
+            "format": self.format,
+            "compression": self.compression,
+            "segments": self.segments,
+        }
+
+        # Written aside and renamed over, so a crash mid-save never leaves a truncated manifest
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(contents, file, indent=2)
+        os.replace(temporary, self.path)
+
+    def covering(self, start: float = None, end: float = None) -> list:
+        """
+        Segments with frames between `start` and `end` (either can be None for an open range). Empty segments never
+        match, and unfinished ones (with no time range yet) always do.
+        """
+        return [segment for segment in self.segments
+                if segment["frames"] is None
+                or (segment["frames"]
+                    and (start is None or segment["end"] >= start)
+                    and (end is None or segment["start"] <= end))]
+
+    @property
+    def frames(self) -> int:
+        """
+        Frames in the finished segments.
+        """
+        return sum(segment["frames"] for segment in self.segments if segment["frames"] is not None)
+
+
+def read_segment(path):
+    """
+    Yields every frame in one (possibly compressed) segment.
+    """
+    if is_binary_segment(path):
+        with open_segment(path, text=False) as stream:
+            stream.read(HEADER.size)
+            while True:
+                record = stream.read(RECORD.size)
+                if len(record) < RECORD.size:
+                    return
+                yield unpack_message(record)
+    else:
+        with open_segment(path) as stream:
+            yield from can.CanutilsLogReader(stream)
+
+
+def read_window(manifest_file, start: float = None, end: float = None, normalized: bool = False):
+    """
+    Yields the frames between `start` and `end` (epoch seconds, inclusive), only opening the segments that cover them.
+    `normalized` gives IDs like a `_MOD` log (for a text capture, by reading the `_MOD` files instead).
+    """
+    manifest = SegmentManifest.load(manifest_file)
+
+    for segment in manifest.covering(start, end):
+        files = segment["files"]
+        file = files[1] if normalized and len(files) > 1 else files[0]
+
+        try:
+            for msg in read_segment(os.path.join(manifest.directory, file)):
+                # .bblog segments only store raw IDs
+                if normalized and len(files) == 1:
+                    msg.arbitration_id = msg.arbitration_id & ID_NORMALIZE_MASK
+
+                if start is not None and msg.timestamp < start:
+                    continue
+                if end is not None and msg.timestamp > end:
+                    # Segments are in time order, so nothing later can match either
+                    return
+                yield msg
+        except TRUNCATED_ERRORS:
+            # A segment the capture crashed while writing just ends early
+            if segment["frames"] is not None:
+                raise
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='log_segments.py',
+        description='Lists the segments of a rotated `boosted_logger.py` capture, or extracts a time window from them '
+                    'as a can-utils .log file.')
+
+    parser.add_argument('manifest',
+                        help='The capture\'s `_manifest.json` file')
+    parser.add_argument('-s',
+                        '--start',
+                        help='Start of the window, in epoch seconds',
+                        type=float)
+    parser.add_argument('-e',
+                        '--end',
+                        help='End of the window, in epoch seconds',
+                        type=float)
+    parser.add_argument('-n',
+                        '--normalized',
+                        help='Read the `_MOD` files instead of the `_all` files',
+                        default=False,
+                        action='store_true')
+    parser.add_argument('-o',
+                        '--output',
+                        help='Write the frames in the window to this .log file. Without it, the segments covering the '
+                             'window are listed.')
+
+    args = parser.parse_args()
+
+    if args.output is None:
+        manifest = SegmentManifest.load(args.manifest)
+        segments = manifest.covering(args.start, args.end)
+
+        print(f"{len(segments)} of {len(manifest.segments)} segments, {manifest.frames} frames in the capture "
+              f"({manifest.format}, {manifest.compression})")
+        for segment in segments:
+            if segment["frames"] is None:
+                print(f"  {segment['index']:4d}  unfinished{' ' * 42}{', '.join(segment['files'])}")
+                continue
+            print(f"  {segment['index']:4d}  {segment['start']:.6f} - {segment['end']:.6f}  "
+                  f"{segment['frames']:9d} frames  {', '.join(segment['files'])}")
+        sys.exit()
+
+    writer = can.CanutilsLogWriter(args.output)
+    extracted = 0
+    for frame in read_window(args.manifest, args.start, args.end, args.normalized):
+        writer.on_message_received(frame)
+        extracted = extracted + 1
+    writer.stop()
+
+    print(f"Extracted {extracted} frames.")
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
\ No newline at end of file
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+import argparse
+import collections
+import sys
+import typing
+import can
+
+from boosted_ids import LONG_COMMAND_SINGLE, channel, is_sr_id, long_command, message_key
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can
+
+# Streaming reassembler for Boosted Board "Long Command" multi-frame messages.
+#
+# The 0x00F00000 nibble of a CAN ID is the "Long Command" ID. A message that fits in a single frame uses 3, and a
+# message that spans multiple frames counts down from 2, one step per 8 byte fragment (see `send_cli_command()` in
+# `xr_battery_util.py`). The logger and utility mask this away, which loses the message boundaries.
+#
+# Fragments are grouped by `boosted_ids.message_key()` (everything but the Long Command and Rolling Code bits -- so by
+# src/dest/channel). Frames that can't be fragments -- SR Battery IDs (0x0B57EDxx), which don't follow the layout, and
+# Long Command IDs above 3 -- are passed through as single frame messages.
+#
+# There's no explicit "last fragment" marker when a message ends above 0, so a message is considered complete when:
+#  - the Long Command ID reaches 0, or
+#  - a fragment is shorter than 8 bytes, or
+#  - the next message starts on the same src/dest/channel (Long Command doesn't count down), or
+#  - no fragment has arrived for `timeout` seconds.
+# The last two are reported with `complete=False`, as the message may have been cut short.
+#
+# Each frame costs O(1), and memory is bounded -- at most `max_pending` partial messages (the least recently
+# updated is flushed when a new one would go past that), each at most `max_payload` bytes.
+
+
+class LongMessage(typing.NamedTuple):
+    arbitration_id: int  # `message_key()` of the ID the message was sent on (src/dest/channel for Boosted IDs)
+    timestamp: float  # Timestamp of the first fragment
+    end_timestamp: float  # Timestamp of the last fragment
+    payload: bytes
+    frame_count: int
+    complete: bool
+
+
+class _PartialMessage:
+    __slots__ = ("timestamp", "last_timestamp", "last_long_command", "payload", "frame_count")
+
+    def __init__(self, msg: can.Message, long_command_id: int):
+        self.timestamp = msg.timestamp
+        self.last_timestamp = msg.timestamp
+        self.last_long_command = long_command_id
+        self.payload = bytearray(msg.data)
+        self.frame_count = 1
+
+
+class LongCommandReassembler:
+
+    def __init__(self, timeout: float = 0.5, max_pending: int = 64, max_payload: int = 4096):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.max_payload = max_payload
+
+        # Ordered by last update, so the oldest partial message is always first
+        self.pending = collections.OrderedDict()
+
+        self.messages_complete = 0
+        self.messages_incomplete = 0
+
+    def _finish(self, key: int, partial: _PartialMessage, complete: bool) -> LongMessage:
+        if complete:
+            self.messages_complete = self.messages_complete + 1
+        else:
+            self.messages_incomplete = self.messages_incomplete + 1
+
+        return LongMessage(key, partial.timestamp, partial.last_timestamp, bytes(partial.payload),
+                           partial.frame_count, complete)
+
+    def feed(self, msg: can.Message) -> list:
+        """
+        Adds a frame, and returns any messages it completed (usually none or one).
+        """
+        done = self.expire(msg.timestamp)
+
+        key = message_key(msg.arbitration_id)
+        long_command_id = long_command(msg.arbitration_id)
+
+        # Only 2 -> 0 are fragments of a multi-frame message
+        single = long_command_id >= LONG_COMMAND_SINGLE or is_sr_id(msg.arbitration_id)
+
+        partial = self.pending.get(key)
+
+        # A message that's not counting down from the previous fragment can't be part of it
+        if partial is not None and (single or long_command_id >= partial.last_long_command):
+            del self.pending[key]
+            done.append(self._finish(key, partial, False))
+            partial = None
+
+        if single:
+            done.append(LongMessage(key, msg.timestamp, msg.timestamp, bytes(msg.data), 1, True))
+            self.messages_complete = self.messages_complete + 1
+            return done
+
+        if partial is None:
+            partial = _PartialMessage(msg, long_command_id)
+
+            if len(self.pending) >= self.max_pending:
+                oldest_key, oldest = self.pending.popitem(last=False)
+                done.append(self._finish(oldest_key, oldest, False))
+
+            self.pending[key] = partial
+        else:
+            partial.payload.extend(msg.data)
+            partial.last_timestamp = msg.timestamp
+            partial.last_long_command = long_command_id
+            partial.frame_count = partial.frame_count + 1
+            self.pending.move_to_end(key)
+
+        if long_command_id == 0 or msg.dlc < 8:
+            del self.pending[key]
+            done.append(self._finish(key, partial, True))
+        elif len(partial.payload) >= self.max_payload:
+            del self.pending[key]
+            done.append(self._finish(key, partial, False))
+
+        return done
+
+    def expire(self, now: float) -> list:
+        """
+        Flushes partial messages that haven't seen a fragment for `timeout` seconds.
+        """
+        done = []
+
+        while self.pending:
+            key, partial = next(iter(self.pending.items()))
+            if now - partial.last_timestamp < self.timeout:
+                break
+
+            del self.pending[key]
+            done.append(self._finish(key, partial, False))
+
+        return done
+
+    def flush(self) -> list:
+        """
+        Flushes all partial messages, ex: at the end of a log file.
+        """
+        done = [self._finish(key, partial, False) for key, partial in self.pending.items()]
+        self.pending.clear()
+        return done
+
+
+def reassemble(messages, timeout: float = 0.5):
+    """
+    Generator over the reassembled messages of an iterable of frames, ex: a `can.CanutilsLogReader`.
+    """
+    reassembler = LongCommandReassembler(timeout)
+
+    for msg in messages:
+        if msg.is_error_frame or not msg.is_extended_id:
+            continue
+        yield from reassembler.feed(msg)
+
+    yield from reassembler.flush()
+
+
+def format_payload(payload: bytes) -> str:
+    try:
+        text = payload.decode("ascii")
+        if text.isprintable() or text.strip("\r\n").isprintable():
+            return repr(text)
+    except UnicodeDecodeError:
+        pass
+
+    return payload.hex(" ").upper()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='long_command.py',
+        description='Reassembles Boosted Board multi-frame ("Long Command") messages from a can-utils `.log` '
+                    'capture. Use an `_all` log, as `_MOD` logs have the Long Command ID masked away.')
+
+    parser.add_argument('log',
+                        help='can-utils `.log` file to read')
+    parser.add_argument('-c',
+                        '--channel',
+                        help='Only show messages on this channel (ex: 0x11 for the battery CLI)',
+                        type=lambda value: int(value, 0),
+                        required=False)
+    parser.add_argument('-m',
+                        '--multi-frame',
+                        help='Only show messages that spanned more than one frame',
+                        required=False,
+                        default=False,
+                        action='store_true')
+
+    args = parser.parse_args()
+
+    for message in reassemble(can.CanutilsLogReader(args.log)):
+        if args.channel is not None and channel(message.arbitration_id) != args.channel:
+            continue
+        if args.multi_frame and message.frame_count == 1:
+            continue
+
+        status = "" if message.complete else " (incomplete)"
+        print(f"({message.timestamp:f}) {message.arbitration_id:08X} [{message.frame_count}]{status} "
+              f"{format_payload(message.payload)}")
+
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
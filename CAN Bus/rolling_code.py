@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+import argparse
+import collections
+import sys
+import can
+
+from boosted_ids import ROLLING_CODE_MASK, SR_ID_BASE, SR_ID_MASK
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can numpy
+
+# Dropped-frame detection from the rolling code.
+#
+# Every Boosted device increments the trailing 0-F rolling code of the ID on each frame it sends, so it's a free
+# 4-bit sequence number. Tracking the next expected code per sender shows frames that never made it into a capture --
+# if the board sent them, the adapter or host dropped them.
+#
+# Senders are keyed by the Src nibble of the ID by default. `key="id"` tracks each normalized ID separately, and
+# `key="global"` treats the whole bus as one sequence. SR Battery IDs (0x0B57EDxx) don't have a rolling code, and
+# standard ID and error frames aren't Boosted frames, so all three are ignored -- live and offline alike.
+#
+# Limits of a 4-bit counter: a gap of exactly 16 frames (or a multiple) is invisible, and a gap of 15 looks the same
+# as a repeated frame. Both need a lot of consecutive loss from one sender to happen.
+#
+# `RollingCodeMonitor` is a python-can Listener for live use (a dict lookup and a subtraction per frame).
+# `detect_gaps()` does the same over whole columns of an offline capture with NumPy (only needed for that).
+
+SENDER_KEYS = ("src", "id", "global")
+
+
+def sender_of(arbitration_id: int, key: str = "src") -> int:
+    if key == "src":
+        return (arbitration_id >> 16) & 0xF
+    if key == "id":
+        return arbitration_id & 0xFF0FFFF0
+    return 0
+
+
+class SenderStats:
+    __slots__ = ("last_code", "frames", "missing", "gaps", "recent_gaps")
+
+    def __init__(self, code: int, max_recent_gaps: int):
+        self.last_code = code
+        self.frames = 0
+        self.missing = 0
+        self.gaps = 0
+        # (timestamp, frames missing) of the most recent gaps
+        self.recent_gaps = collections.deque(maxlen=max_recent_gaps)
+
+    @property
+    def loss_rate(self) -> float:
+        total = self.frames + self.missing
+        return self.missing / total if total else 0.0
+
+
+class RollingCodeMonitor(can.Listener):
+
+    def __init__(self, key: str = "src", max_recent_gaps: int = 100):
+        if key not in SENDER_KEYS:
+            raise ValueError(f"key must be one of {SENDER_KEYS}")
+
+        self.key = key
+        self.max_recent_gaps = max_recent_gaps
+        self.senders = {}
+
+    def on_message_received(self, msg: can.Message) -> None:
+        arbitration_id = msg.arbitration_id
+        if not msg.is_extended_id or msg.is_error_frame or arbitration_id & SR_ID_MASK == SR_ID_BASE:
+            return
+
+        code = arbitration_id & ROLLING_CODE_MASK
+        sender = sender_of(arbitration_id, self.key)
+
+        stats = self.senders.get(sender)
+        if stats is None:
+            stats = SenderStats(code, self.max_recent_gaps)
+            self.senders[sender] = stats
+        else:
+            missing = (code - stats.last_code - 1) & ROLLING_CODE_MASK
+            if missing:
+                stats.missing = stats.missing + missing
+                stats.gaps = stats.gaps + 1
+                stats.recent_gaps.append((msg.timestamp, missing))
+            stats.last_code = code
+
+        stats.frames = stats.frames + 1
+
+    def print_summary(self):
+        print("Sender      Frames    Missing   Gaps    Loss")
+        for sender in sorted(self.senders):
+            stats = self.senders[sender]
+            print(f"{format_sender(sender, self.key):<10}  {stats.frames:<8}  {stats.missing:<8}  {stats.gaps:<6}  "
+                  f"{stats.loss_rate * 100:.3f}%")
+
+            for timestamp, missing in stats.recent_gaps:
+                print(f"    ({timestamp:f}) {missing} missing")
+
+
+def format_sender(sender: int, key: str) -> str:
+    if key == "src":
+        return f"Src {sender:X}"
+    if key == "id":
+        return f"0x{sender:08X}"
+    return "Bus"
+
+
+def detect_gaps(timestamps, arbitration_ids, key: str = "src", counted=None) -> dict:
+    """
+    Offline, vectorized version of `RollingCodeMonitor` over columns of a capture.
+
+    `counted` is a boolean column marking the extended, non-error frames (see `load_columns()`), so the same frames
+    are skipped as live. Without it, every frame is assumed to be an extended data frame.
+
+    Returns {sender: {"frames", "missing", "gaps", "loss_rate", "gap_timestamps", "gap_sizes"}}.
+    """
+    ids = np.asarray(arbitration_ids, dtype=np.uint32)
+    timestamps = np.asarray(timestamps)
+
+    keep = (ids & np.uint32(SR_ID_MASK)) != SR_ID_BASE
+    if counted is not None:
+        keep = keep & np.asarray(counted, dtype=bool)
+    ids = ids[keep]
+    timestamps = timestamps[keep]
+
+    if key == "src":
+        senders = (ids >> np.uint32(16)) & np.uint32(0xF)
+    elif key == "id":
+        senders = ids & np.uint32(0xFF0FFFF0)
+    else:
+        senders = np.zeros_like(ids)
+
+    codes = (ids & np.uint32(ROLLING_CODE_MASK)).astype(np.int16)
+
+    # Group each sender's frames together, keeping them in capture order
+    order = np.argsort(senders, kind="stable")
+    senders = senders[order]
+    codes = codes[order]
+    timestamps = timestamps[order]
+
+    results = {}
+    boundaries = np.flatnonzero(np.diff(senders)) + 1
+    for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(senders)]))):
+        if start == end:
+            continue
+
+        missing = (codes[start + 1:end] - codes[start:end - 1] - 1) & ROLLING_CODE_MASK
+        gap_rows = np.flatnonzero(missing)
+
+        frames = int(end - start)
+        total_missing = int(missing.sum())
+        results[int(senders[start])] = {
+            "frames": frames,
+            "missing": total_missing,
+            "gaps": len(gap_rows),
+            "loss_rate": total_missing / (frames + total_missing),
+            "gap_timestamps": timestamps[start + 1 + gap_rows],
+            "gap_sizes": missing[gap_rows],
+        }
+
+    return results
+
+
+def load_columns(path):
+    """
+    Returns (timestamps, arbitration_ids, counted) columns for a .bblog or can-utils .log capture, where `counted`
+    marks the extended, non-error frames `RollingCodeMonitor` would count.
+    """
+    if str(path).endswith(".bblog"):
+        from boosted_binlog import FLAG_ERROR_FRAME, FLAG_EXTENDED_ID, BinaryLogReader
+        reader = BinaryLogReader(path)
+        flags = reader.flags & (FLAG_EXTENDED_ID | FLAG_ERROR_FRAME)
+        return reader.timestamps, reader.arbitration_ids, flags == FLAG_EXTENDED_ID
+
+    timestamps = []
+    ids = []
+    counted = []
+    for msg in can.CanutilsLogReader(path):
+        timestamps.append(msg.timestamp)
+        ids.append(msg.arbitration_id)
+        counted.append(msg.is_extended_id and not msg.is_error_frame)
+
+    return (np.array(timestamps, dtype=np.float64),
+            np.array(ids, dtype=np.uint32),
+            np.array(counted, dtype=bool))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='rolling_code.py',
+        description='Finds frames missing from a Boosted Board capture (.log or .bblog), using the rolling code '
+                    'at the end of each ID. Use an `_all` log, as `_MOD` logs have the rolling code masked away.')
+
+    parser.add_argument('capture',
+                        help='Capture to check')
+    parser.add_argument('-k',
+                        '--key',
+                        help='Track rolling codes per `src` (default), per normalized `id`, or across the whole bus '
+                             '(`global`).',
+                        choices=SENDER_KEYS,
+                        default="src")
+    parser.add_argument('-v',
+                        '--verbose',
+                        help='List the timestamp of every gap',
+                        required=False,
+                        default=False,
+                        action='store_true')
+
+    args = parser.parse_args()
+
+    capture_timestamps, capture_ids, capture_counted = load_columns(args.capture)
+    gaps_by_sender = detect_gaps(capture_timestamps, capture_ids, args.key, capture_counted)
+
+    print("Sender      Frames    Missing   Gaps    Loss")
+    for sender_key, result in sorted(gaps_by_sender.items()):
+        print(f"{format_sender(sender_key, args.key):<10}  {result['frames']:<8}  {result['missing']:<8}  "
+              f"{result['gaps']:<6}  {result['loss_rate'] * 100:.3f}%")
+
+        if args.verbose:
+            for gap_timestamp, gap_size in zip(result["gap_timestamps"], result["gap_sizes"]):
+                print(f"    ({gap_timestamp:f}) {gap_size} missing")
+
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
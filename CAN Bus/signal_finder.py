@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+import numpy as np
+
+from dbc_decoder import DBC_EXTENDED_ID_FLAG, DbcSignal, load_columns, load_dbc
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install numpy
+
+# Bit-level change analysis, for working out the `SR_Battery_Unknown_*` messages in SR_Battery.dbc.
+#
+# For every message without signals in the DBC (or any ID passed with `--id`), over one or more captures:
+#
+#  1. Per bit (DBC Intel numbering, byte * 8 + bit): constant or not, and how often it flips between frames. This is
+#     done on the packed bytes -- XOR of consecutive frames, then one shift / sum per bit position -- so it's 8 NumPy
+#     operations per message, whatever the capture size.
+#  2. Candidate fields: runs of non-constant bits, split where a higher bit flips noticeably more often than the bit
+#     below it (in a little endian number, flip rate falls from the LSB up, so a rise means a new field starts).
+#     Byte-aligned 8 / 16 bit fields (both byte orders) are always added, as that's how every known signal is laid out.
+#  3. Per field: range, and whether it behaves like a counter (almost every change is the same step).
+#  4. Per field: Pearson correlation with every known signal in the DBC (ex: PackVoltage, Battery_Charge), resampled
+#     onto the field's timestamps, all as one matrix product. A strong correlation also gives a least-squares
+#     factor / offset, so the candidate comes out already scaled.
+#
+# Candidates are printed as DBC `SG_` lines (with `CM_` comments giving the evidence), ready to paste into
+# SR_Battery.dbc and check with `dbc_decoder.py`.
+#
+# Captures can be .log or .bblog (see `dbc_decoder.load_columns()`); `.bblog` is much faster to load. Use `_all`
+# captures -- this works on raw IDs.
+
+# A field must correlate at least this well with a known signal to be named after it
+CORRELATION_THRESHOLD = 0.9
+
+# A field is a counter if at least this fraction of its changes are the same step
+COUNTER_THRESHOLD = 0.9
+
+# How much more often a bit has to flip than the bit below it to start a new field
+FIELD_SPLIT_FLIP_STEP = 0.05
+
+MAX_FIELD_LENGTH = 32
+
+# Correlation is done on at most this many (evenly spaced) frames per message -- plenty for slow signals
+MAX_CORRELATION_FRAMES = 200000
+
+
+class BitProfile:
+    """
+    Per-bit statistics for one message. Index `i` is DBC Intel bit `i` (byte i // 8, bit i % 8).
+    """
+
+    def __init__(self, data):
+        self.frames = len(data)
+
+        flip_counts = np.zeros(64, dtype=np.int64)
+        if self.frames > 1:
+            changes = data[1:] ^ data[:-1]
+            for bit in range(8):
+                flip_counts[bit::8] = ((changes >> bit) & 1).sum(axis=0, dtype=np.int64)
+
+        self.flip_rate = flip_counts / max(self.frames - 1, 1)
+        self.constant = flip_counts == 0
+        # Only meaningful for constant bits
+        self.first_value = np.unpackbits(data[0], bitorder="little") if self.frames else np.zeros(64, dtype=np.uint8)
+
+    def byte_summary(self, byte: int) -> str:
+        """
+        The bits of one byte, MSB first -- `0`/`1` for constant bits, otherwise the flip rate.
+        """
+        cells = []
+        for bit in range(byte * 8 + 7, byte * 8 - 1, -1):
+            if self.constant[bit]:
+                cells.append(f"{self.first_value[bit]:>4}")
+            else:
+                cells.append(f"{self.flip_rate[bit]:4.2f}".lstrip("0").rjust(4))
+        return " ".join(cells)
+
+
+class FieldCandidate:
+    def __init__(self, signal: DbcSignal, values, natural: bool):
+        self.signal = signal
+        # Found from the flip rates, rather than just being byte-aligned
+        self.natural = natural
+        self.minimum = values.min()
+        self.maximum = values.max()
+
+        steps = values[1:] - values[:-1]
+        if not signal.signed:
+            steps = steps & np.uint64(signal.mask)
+        steps = steps[steps != 0]
+
+        self.changes = len(steps)
+        self.counter_step = None
+        if self.changes >= 8 and signal.length >= 4 and not signal.signed:
+            # Take the most common step from the start of the capture, then check it over the whole capture
+            sample_steps, sample_counts = np.unique(steps[:1000], return_counts=True)
+            step = sample_steps[sample_counts.argmax()]
+            if np.count_nonzero(steps == step) >= COUNTER_THRESHOLD * self.changes:
+                self.counter_step = int(step)
+
+        self.correlation = 0.0
+        self.reference = None
+        self.factor = 1.0
+        self.offset = 0.0
+
+    @property
+    def start_bit(self) -> int:
+        return self.signal.start_bit
+
+    @property
+    def length(self) -> int:
+        return self.signal.length
+
+    @property
+    def is_correlated(self) -> bool:
+        return abs(self.correlation) >= CORRELATION_THRESHOLD
+
+    def rank(self):
+        """
+        Sort key, best first: correlated, then counters, then the plainest layout (byte-aligned, unsigned, Intel,
+        shortest).
+        """
+        return (not self.is_correlated, -round(abs(self.correlation), 3) if self.is_correlated else 0,
+                self.counter_step is None, self.length % 8 != 0, self.signal.signed, not self.signal.little_endian,
+                self.length)
+
+
+def field_layouts(profile: BitProfile):
+    """
+    {(start bit, length, little endian): natural} for every candidate field.
+    """
+    layouts = {}
+
+    bit = 0
+    while bit < 64:
+        if profile.constant[bit]:
+            bit = bit + 1
+            continue
+
+        start = bit
+        while bit + 1 < 64 and not profile.constant[bit + 1] and bit + 1 - start < MAX_FIELD_LENGTH \
+                and profile.flip_rate[bit + 1] <= profile.flip_rate[bit] + FIELD_SPLIT_FLIP_STEP:
+            bit = bit + 1
+
+        layouts[(start, bit - start + 1, True)] = True
+        bit = bit + 1
+
+    for byte in range(8):
+        if profile.constant[byte * 8:byte * 8 + 8].all():
+            continue
+
+        aligned = [(byte * 8, 8, True)]
+        if byte > 0:
+            # Motorola start bits are the MSB -- bit 7 of the first byte
+            aligned = aligned + [((byte - 1) * 8, 16, True), ((byte - 1) * 8 + 7, 16, False)]
+        if byte < 7:
+            aligned = aligned + [(byte * 8, 16, True), (byte * 8 + 7, 16, False)]
+
+        for layout in aligned:
+            layouts.setdefault(layout, False)
+
+    return layouts
+
+
+def reference_signals(decoded, exclude_name: str):
+    """
+    {"Message.Signal": (timestamps, values)} for every known, non-constant signal.
+    """
+    references = {}
+    for message_name, series in decoded.items():
+        if message_name == exclude_name:
+            continue
+        for signal_name, values in series.items():
+            if signal_name == "timestamp" or len(values) < 2 or values.min() == values.max():
+                continue
+            references[f"{message_name}.{signal_name}"] = (series["timestamp"], values.astype(np.float64))
+    return references
+
+
+def correlate(candidates, field_values, timestamps, references):
+    """
+    Fills in the best matching known signal, correlation and linear fit of every candidate.
+    """
+    if not references or len(timestamps) < 3:
+        return
+
+    rows = np.arange(len(timestamps))
+    if len(rows) > MAX_CORRELATION_FRAMES:
+        rows = np.linspace(0, len(timestamps) - 1, MAX_CORRELATION_FRAMES).astype(np.int64)
+
+    fields = np.column_stack([values[rows].astype(np.float64) for values in field_values])
+    names = list(references)
+    known = np.column_stack([np.interp(timestamps[rows], *references[name]) for name in names])
+
+    field_mean = fields.mean(axis=0)
+    field_std = fields.std(axis=0)
+    known_mean = known.mean(axis=0)
+    known_std = known.std(axis=0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = ((fields - field_mean) / field_std).T @ ((known - known_mean) / known_std) / len(rows)
+    correlation = np.nan_to_num(correlation)
+
+    for index, candidate in enumerate(candidates):
+        best = int(np.abs(correlation[index]).argmax())
+        candidate.correlation = float(correlation[index, best])
+        candidate.reference = names[best]
+
+        if candidate.is_correlated:
+            # Least squares fit of the known signal against the raw field
+            candidate.factor = candidate.correlation * known_std[best] / field_std[index]
+            candidate.offset = known_mean[best] - candidate.factor * field_mean[index]
+
+
+def analyse_message(timestamps, data, references):
+    """
+    Returns (BitProfile, [FieldCandidate]) for the frames of one message.
+    """
+    profile = BitProfile(data)
+    raw_le = np.ascontiguousarray(data).view("<u8")[:, 0]
+    raw_be = raw_le.byteswap()
+
+    candidates = []
+    field_values = []
+    for (start_bit, length, little_endian), natural in sorted(field_layouts(profile).items()):
+        for signed in (False, True):
+            if signed and length < 8:
+                continue
+
+            signal = DbcSignal("", start_bit, length, little_endian, signed, 1, 0)
+            values = signal.extract(raw_le, raw_be)
+            candidates.append(FieldCandidate(signal, values, natural))
+            field_values.append(values)
+
+    correlate(candidates, field_values, timestamps, references)
+    return profile, candidates
+
+
+def best_candidates(candidates):
+    """
+    Picks non-overlapping candidates to write to the DBC, best first (see `FieldCandidate.rank()`). Fields that are
+    neither correlated nor counters are only kept if they were found from the flip rates.
+    """
+    chosen = []
+    covered = np.zeros(64, dtype=bool)
+
+    for candidate in sorted(candidates, key=FieldCandidate.rank):
+        if not (candidate.is_correlated or candidate.counter_step or candidate.natural):
+            continue
+
+        bits = signal_bits(candidate.signal)
+        if covered[bits].any():
+            continue
+
+        chosen.append(candidate)
+        covered[bits] = True
+
+    return sorted(chosen, key=lambda candidate: candidate.start_bit)
+
+
+def signal_bits(signal: DbcSignal):
+    """
+    The Intel bit numbers a signal covers.
+    """
+    if signal.little_endian:
+        return list(range(signal.start_bit, signal.start_bit + signal.length))
+
+    # Motorola: bit `shift` of the big endian 64-bit view, mapped back to byte / bit
+    bits = []
+    for position in range(signal.shift, signal.shift + signal.length):
+        bits.append((7 - position // 8) * 8 + position % 8)
+    return bits
+
+
+def signal_name(message_name: str, candidate: FieldCandidate) -> str:
+    name = f"{message_name.replace('SR_Battery_', '')}_{candidate.start_bit}_{candidate.length}"
+    if candidate.is_correlated:
+        return f"{name}_{candidate.reference.split('.')[-1]}"
+    if candidate.counter_step:
+        return f"{name}_Counter"
+    return name
+
+
+def format_number(value: float) -> str:
+    return f"{value:.6g}"
+
+
+def dbc_lines(frame_id: int, message_name: str, dlc: int, sender: str, candidates):
+    """
+    BO_ / SG_ / CM_ lines for the candidate signals of one message.
+    """
+    dbc_id = frame_id | DBC_EXTENDED_ID_FLAG
+    lines = [f"BO_ {dbc_id} {message_name}: {dlc} {sender}"]
+    comments = []
+
+    for candidate in candidates:
+        signal = candidate.signal
+        name = signal_name(message_name, candidate)
+        factor = candidate.factor if candidate.is_correlated else 1
+        offset = candidate.offset if candidate.is_correlated else 0
+        low = candidate.minimum * factor + offset
+        high = candidate.maximum * factor + offset
+        if factor < 0:
+            low, high = high, low
+
+        lines.append(f" SG_ {name} : {signal.start_bit}|{signal.length}@{1 if signal.little_endian else 0}"
+                     f"{'-' if signal.signed else '+'} ({format_number(factor)},{format_number(offset)}) "
+                     f"[{format_number(low)}|{format_number(high)}] \"\"  Vector__XXX")
+
+        evidence = [f"raw {candidate.minimum}-{candidate.maximum}", f"{candidate.changes} changes"]
+        if candidate.counter_step:
+            evidence.append(f"counter, step {candidate.counter_step}")
+        if candidate.is_correlated:
+            evidence.append(f"r={candidate.correlation:+.3f} with {candidate.reference}")
+        comments.append(f"CM_ SG_ {dbc_id} {name} \"Candidate: {', '.join(evidence)}\";")
+
+    return lines, comments
+
+
+def load_captures(paths):
+    """
+    (timestamps, arbitration_ids, data) of several captures, merged in time order.
+    """
+    columns = [load_columns(path) for path in paths]
+
+    timestamps = np.concatenate([np.asarray(column[0]) for column in columns])
+    arbitration_ids = np.concatenate([np.asarray(column[1]) for column in columns])
+    data = np.concatenate([np.asarray(column[2]) for column in columns])
+
+    if len(timestamps) > 1 and (np.diff(timestamps) < 0).any():
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        arbitration_ids = arbitration_ids[order]
+        data = data[order]
+
+    return timestamps, arbitration_ids, data
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        prog='signal_finder.py',
+        description='Finds candidate signals in unknown messages, from bit flip rates, counters, and correlation '
+                    'with the known signals in a DBC file. Prints them as DBC SG_ lines.')
+
+    parser.add_argument('dbc',
+                        help='DBC file with the known signals, ex: SR_Battery.dbc')
+    parser.add_argument('captures',
+                        help='Captures to analyse (.log or .bblog)',
+                        nargs='+')
+    parser.add_argument('-i',
+                        '--id',
+                        help='Analyse this ID (hex) as well as the messages without signals in the DBC. Can be used '
+                             'multiple times.',
+                        action='append',
+                        default=[])
+    parser.add_argument('-o',
+                        '--output',
+                        help='Also write the candidate DBC lines to this file',
+                        required=False)
+
+    args = parser.parse_args()
+
+    database = load_dbc(args.dbc)
+    capture_timestamps, capture_ids, capture_data = load_captures(args.captures)
+    decoded_series = database.decode(capture_timestamps, capture_ids, capture_data)
+
+    targets = {frame_id: message for frame_id, message in database.messages.items() if not message.signals}
+    for extra_id in args.id:
+        extra_id = int(extra_id, 16)
+        if extra_id not in targets:
+            targets[extra_id] = database.messages.get(extra_id)
+
+    dbc_output = []
+    dbc_comments = []
+
+    for target_id, target_message in sorted(targets.items()):
+        target_rows = np.flatnonzero(capture_ids == target_id)
+        if len(target_rows) == 0:
+            continue
+
+        target_name = target_message.name if target_message is not None else f"Unknown_{target_id:08X}"
+        target_references = reference_signals(decoded_series, target_name)
+
+        bit_profile, field_candidates = analyse_message(capture_timestamps[target_rows],
+                                                        np.ascontiguousarray(capture_data[target_rows]),
+                                                        target_references)
+        chosen_candidates = best_candidates(field_candidates)
+
+        print(f"== 0x{target_id:08X} {target_name} ({len(target_rows)} frames) ==")
+        print("Byte   b7   b6   b5   b4   b3   b2   b1   b0")
+        for data_byte in range(8):
+            print(f"{data_byte:<4}  {bit_profile.byte_summary(data_byte)}")
+
+        for field in chosen_candidates:
+            description = f"- {signal_name(target_name, field)}: raw {field.minimum}-{field.maximum}"
+            if field.counter_step:
+                description = description + f", counter (step {field.counter_step})"
+            if field.is_correlated:
+                description = description + f", r={field.correlation:+.3f} with {field.reference}"
+            print(description)
+        print()
+
+        message_lines, message_comments = dbc_lines(
+            target_id, target_name, target_message.dlc if target_message is not None else 8,
+            target_message.sender if target_message is not None else "Vector__XXX", chosen_candidates)
+        dbc_output.extend(message_lines + [""])
+        dbc_comments.extend(message_comments)
+
+    dbc_text = "\n".join(dbc_output + dbc_comments)
+    print(dbc_text)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(dbc_text + "\n")
+
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
@@ -37,10 +37,28 @@
 # For more info on the CAN Ids and what they mean, please see the DBC
 # file in the Beambreak repository.
 
+# Each repeating message is sent at the rate listed in `SR Battery CAN Bus.md`,
+# on absolute deadlines so the timing doesn't drift. When you stop it with
+# Ctrl-C, it prints how late (on average / worst case) each ID was sent.
+# `--cyclic` hands the timing to python-can's cyclic tasks instead, which some
+# interfaces (ex: SocketCAN) run in the kernel or the adapter itself.
+
+# `-b interface:channel` (once per battery) emulates a fleet of SR batteries
+# from one process, each on its own bus (ex: SocketCAN vcan interfaces) with
+# its own serial number, and each following its own ESC's power control pings.
+
+# `-i broker -c <socket path>` shares a `can_broker.py` adapter, ex: so a
+# logger can capture while the emulator runs.
+
+import argparse
+import asyncio
+import operator
 import time
 
 import can
-from can.bus import BusState
+
+from boosted_ids import SR_MESSAGE_PERIODS
+from can_filters import open_bus, parse_bus
 
 
 # SR Variables
@@ -53,49 +71,110 @@ PackTotalMilliVolts = 39867 # 39867mV -> 39.867V
 BatterySoCLevel = 42        # Max of 100
 
 
-# Array conversions for later
-MinCellMVArray = MinCellMilliVolts.to_bytes(2, 'big')
-MaxCellMVArray = MaxCellMilliVolts.to_bytes(2, 'big')
-PackTotalMVArray = PackTotalMilliVolts.to_bytes(2, 'big')
+# Periods of the repeating messages this emulator sends, from the table in `SR Battery CAN Bus.md`
+PeriodicMessagePeriods = {arbitrationId: SR_MESSAGE_PERIODS[arbitrationId]
+                          for arbitrationId in (0x0B57ED02, 0x0B57ED10, 0x0B57ED14, 0x0B57ED15)}
 
 
-print("Boosted SR Battery Emulator, v1")
-print("https://github.com/rscullin/beambreak")
-print()
-print("Starting up...")
+class ScheduledMessage:
+    __slots__ = ("msg", "period", "deadline", "sends", "latenessTotal", "latenessMax", "latenessSquaredTotal")
 
-def tx():
+    def __init__(self, msg):
+        self.msg = msg
+        self.period = PeriodicMessagePeriods[msg.arbitration_id]
+        self.deadline = 0.0
 
-    # You'll need to change this to whatever interface you're using
-    # See https://python-can.readthedocs.io/en/master/interfaces.html for help
-    with can.interface.Bus(
-        bustype="slcan", channel="/dev/tty.usbmodem14101", bitrate=250000
-    ) as bus:
-        
-        print("CAN Bus initialized!")
-        print("Waiting on a message from the ESC to continue")
+        # Jitter stats -- how late each send was, compared to its deadline
+        self.sends = 0
+        self.latenessTotal = 0.0
+        self.latenessMax = 0.0
+        self.latenessSquaredTotal = 0.0
 
-        waitForInitialMsg = True
+    def record_send(self, lateness):
+        """
+        Records a send that was `lateness` seconds after its deadline, and moves the deadline on a period.
+        """
+        self.sends = self.sends + 1
+        self.latenessTotal = self.latenessTotal + lateness
+        self.latenessMax = max(self.latenessMax, lateness)
+        self.latenessSquaredTotal = self.latenessSquaredTotal + lateness * lateness
 
-        while waitForInitialMsg:
+        # If we fell more than a whole period behind, skip the missed sends instead of bursting them
+        self.deadline = self.deadline + self.period * (1 + int(lateness // self.period))
 
-            msg = bus.recv(1)
-            if msg is not None:
-                waitForInitialMsg = False
-                time.sleep(0.25)
-        
-        print("Got a CAN message; starting simulation!")
 
-        # One Shot
+# Picks the next message to send, without building a key function per send
+byDeadline = operator.attrgetter("deadline")
+
+
+class PeriodicScheduler:
+    """
+    Sends a fixed set of preallocated messages, each on its own period.
+
+    Every send is scheduled against an absolute deadline (start + n * period) rather than sleeping a fixed amount
+    after the previous one, so the time spent sending and printing doesn't accumulate as drift. The lateness of
+    every send is recorded per ID, to report the jitter.
+    """
+
+    def __init__(self, bus, messages):
+        self.bus = bus
+        self.entries = [ScheduledMessage(msg) for msg in messages]
+
+    def run(self, tick=None):
+        start = time.perf_counter()
+        for entry in self.entries:
+            entry.deadline = start
 
+        while 1 == 1:
+            entry = min(self.entries, key=byDeadline)
+
+            delay = entry.deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            self.bus.send(entry.msg)
+            entry.record_send(time.perf_counter() - entry.deadline)
+
+            if tick is not None:
+                tick(entry)
+
+    def print_jitter(self):
+        print("ID          Period  Sent    Mean late  Max late   Jitter (std)")
+        for entry in self.entries:
+            if entry.sends == 0:
+                continue
+            mean = entry.latenessTotal / entry.sends
+            std = max(entry.latenessSquaredTotal / entry.sends - mean * mean, 0) ** 0.5
+            print(f"0x{entry.msg.arbitration_id:08X}  {entry.period:<6}  {entry.sends:<6}  {mean * 1000:7.3f}ms  "
+                  f"{entry.latenessMax * 1000:7.3f}ms  {std * 1000:7.3f}ms")
+
+
+class SRBattery:
+    """
+    The state of one emulated SR battery, and the messages it sends. Defaults to the values at the top of the file.
+    """
+
+    def __init__(self, serial=BatterySerial, firmware=(0x01, 0x04, 0x01, 0x33, 0x66, 0x34, 0x35, 0x31),
+                 minCellMilliVolts=MinCellMilliVolts, maxCellMilliVolts=MaxCellMilliVolts,
+                 packTotalMilliVolts=PackTotalMilliVolts, socLevel=BatterySoCLevel):
+        self.serial = list(serial)
+        self.firmware = list(firmware)
+        self.minCellMilliVolts = minCellMilliVolts
+        self.maxCellMilliVolts = maxCellMilliVolts
+        self.packTotalMilliVolts = packTotalMilliVolts
+        self.socLevel = socLevel
+
+    def one_shot_messages(self):
         ## Major, Minor, Revision, Unknown ->
         ID_00_batt_fw = can.Message(
-            arbitration_id=0x0B57ED00, data=[0x01, 0x04, 0x01, 0x33, 0x66, 0x34, 0x35, 0x31], is_extended_id=True
+            arbitration_id=0x0B57ED00, data=self.firmware, is_extended_id=True
         )
 
         # Battery Serial, Unknown ->
         ID_01_batt_sn = can.Message(
-            arbitration_id=0x0B57ED01, data=[BatterySerial[3], BatterySerial[2], BatterySerial[1], BatterySerial[0], 0xf7, 0x8a, 0x01, 0x01], is_extended_id=True
+            arbitration_id=0x0B57ED01,
+            data=[self.serial[3], self.serial[2], self.serial[1], self.serial[0], 0xf7, 0x8a, 0x01, 0x01],
+            is_extended_id=True
         )
 
         ## Unknown ->
@@ -103,47 +182,245 @@ def tx():
                 arbitration_id=0x0B57ED03, data=[0xD2, 0x0F, 0xCA, 0x08, 0x0C, 0x00, 0x00, 0x00], is_extended_id=True
         )
 
-        bus.send(ID_00_batt_fw)
-        bus.send(ID_01_batt_sn)
-        bus.send(ID_03)
+        return [ID_00_batt_fw, ID_01_batt_sn, ID_03]
+
+    def periodic_messages(self):
+        minCellMVArray = self.minCellMilliVolts.to_bytes(2, 'big')
+        maxCellMVArray = self.maxCellMilliVolts.to_bytes(2, 'big')
+        packTotalMVArray = self.packTotalMilliVolts.to_bytes(2, 'big')
+
+        ## Unknown ->
+        ID_02_motor_a = can.Message(
+            arbitration_id=0x0B57ED02, data=[0x00, 0x00, 0xC4, 0x09, 0x00, 0x00, 0x00, 0x00], is_extended_id=True
+        )
+
+        ## Lowest Cell millivolts, Highest Cell millivolts, Total Pack millivolts, Zero->
+        ID_10_batt_info = can.Message(
+            arbitration_id=0x0B57ED10,
+            data=[minCellMVArray[1], minCellMVArray[0], maxCellMVArray[1], maxCellMVArray[0],
+                  packTotalMVArray[1], packTotalMVArray[0], 0x00, 0x00],
+            is_extended_id=True
+        )
+
+        #Unknowns, SoC level, Unknowns
+        ID_14_batt_lvl = can.Message(
+            arbitration_id=0x0B57ED14, data=[0x9B, 0x07, 0xC4, 0x09, self.socLevel, 0x00, 0x05, 0x00],
+            is_extended_id=True
+        )
+
+        # Battery charging state, Unknown->
+        ID_15_batt_chrg = can.Message(
+            arbitration_id=0x0B57ED15, data=[0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x7F, 0x00], is_extended_id=True
+        )
+
+        return [ID_02_motor_a, ID_10_batt_info, ID_14_batt_lvl, ID_15_batt_chrg]
+
+
+class AsyncSRBattery:
+    """
+    One emulated SR battery on its own bus, run as a task on a shared asyncio event loop so a single process can
+    emulate a whole fleet of packs.
+
+    It waits for the ESC like `tx()` does, then sends the one-shots and the periodic messages on absolute deadlines.
+    It follows its own `0x0B57ED1F` ESC Power Control / Ping frames -- `02` (Power Off) and `07` (Idle Power Off)
+    stop it, and without a ping it idles off after 10 minutes, like a real pack.
+    """
+
+    IdleShutdownSeconds = 10 * 60
+
+    def __init__(self, bus, battery: SRBattery, name=""):
+        self.bus = bus
+        self.battery = battery
+        self.name = name
+
+        self.escSeen = asyncio.Event()
+        self.poweredOff = asyncio.Event()
+        self.lastPing = None
+        self.pings = 0
+        self.powerOffReason = None
+
+        self.scheduled = [ScheduledMessage(msg) for msg in battery.periodic_messages()]
+
+    def on_frame(self, msg):
+        self.escSeen.set()
+
+        if msg.arbitration_id == 0x0B57ED1F and len(msg.data) > 0:
+            self.lastPing = time.monotonic()
+            self.pings = self.pings + 1
+
+            if msg.data[0] in (0x02, 0x07) and not self.poweredOff.is_set():
+                self.powerOffReason = "Power Off" if msg.data[0] == 0x02 else "Idle Power Off"
+                self.poweredOff.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        notifier = can.Notifier(self.bus, [self.on_frame], timeout=0.1, loop=loop)
 
         try:
-            print("Sending messages every 250ms forever...")
-            while 1 == 1:
-                
-                print(".", end='')
-                ## Unknown ->
-                ID_02_motor_a = can.Message(
-                    arbitration_id=0x0B57ED02, data=[0x00, 0x00, 0xC4, 0x09, 0x00, 0x00, 0x00, 0x00], is_extended_id=True
-                )
-
-                ## Lowest Cell millivolts, Highest Cell millivolts, Total Pack millivolts, Zero->
-                ID_10_batt_info = can.Message(
-                    arbitration_id=0x0B57ED10, data=[MinCellMVArray[1], MinCellMVArray[0], MaxCellMVArray[1], MaxCellMVArray[0], PackTotalMVArray[1], PackTotalMVArray[0], 0x00, 0x00], is_extended_id=True
-                )
-
-                #Unknowns, SoC level, Unknowns
-                ID_14_batt_lvl = can.Message(
-                    arbitration_id=0x0B57ED14, data=[0x9B, 0x07, 0xC4, 0x09, BatterySoCLevel, 0x00, 0x05, 0x00], is_extended_id=True
-                )
-
-                # Battery charging state, Unknown->
-                ID_15_batt_chrg = can.Message(
-                    arbitration_id=0x0B57ED15, data=[0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x7F, 0x00], is_extended_id=True
-                )
-
-                bus.send(ID_02_motor_a)
-                bus.send(ID_10_batt_info)
-                bus.send(ID_14_batt_lvl)
-                bus.send(ID_15_batt_chrg)
+            await self.escSeen.wait()
+            await asyncio.sleep(0.25)
+
+            for msg in self.battery.one_shot_messages():
+                self.bus.send(msg)
+
+            self.lastPing = time.monotonic()
+            start = loop.time()
+            for entry in self.scheduled:
+                entry.deadline = start
+
+            while not self.poweredOff.is_set():
+                entry = min(self.scheduled, key=byDeadline)
+
+                delay = entry.deadline - loop.time()
+                if delay > 0:
+                    # Wake early if the ESC tells us to power off
+                    try:
+                        await asyncio.wait_for(self.poweredOff.wait(), delay)
+                        break
+                    except asyncio.TimeoutError:
+                        pass
+
+                self.bus.send(entry.msg)
+                entry.record_send(loop.time() - entry.deadline)
+
+                if time.monotonic() - self.lastPing > self.IdleShutdownSeconds:
+                    self.powerOffReason = "No ESC ping"
+                    self.poweredOff.set()
+        finally:
+            notifier.stop()
+
+        return self
+
+
+async def run_fleet(buses, serialBase=0x00C0FFEE):
+    """
+    Emulates one SR battery per (interface, channel) bus, all from one event loop. Each gets its own serial number,
+    counting up from `serialBase`.
+    """
+    openBuses = []
+    tasks = []
+
+    try:
+        for index, (interface, channel) in enumerate(buses):
+            bus = open_bus(interface, channel)
+            openBuses.append(bus)
+
+            serial = list((serialBase + index).to_bytes(4, 'big'))
+            emulator = AsyncSRBattery(bus, SRBattery(serial=serial), channel)
+            tasks.append(asyncio.ensure_future(emulator.run()))
+
+        print(f"Emulating {len(tasks)} SR batteries, waiting on the ESCs...")
+        for emulator in asyncio.as_completed(tasks):
+            emulator = await emulator
+            print(f"[{emulator.name}] Powered off ({emulator.powerOffReason}) after {emulator.pings} ESC pings")
+    finally:
+        for task in tasks:
+            task.cancel()
+        for bus in openBuses:
+            bus.shutdown()
+
+
+def tx(interface="slcan", channel="/dev/tty.usbmodem14101", cyclic=False):
 
+    # You'll need to change this to whatever interface you're using
+    # See https://python-can.readthedocs.io/en/master/interfaces.html for help
+    # `broker` shares a `can_broker.py` adapter with other tools
+    with open_bus(interface, channel) as bus:
+        
+        print("CAN Bus initialized!")
+        print("Waiting on a message from the ESC to continue")
+
+        waitForInitialMsg = True
 
+        while waitForInitialMsg:
+
+            msg = bus.recv(1)
+            if msg is not None:
+                waitForInitialMsg = False
                 time.sleep(0.25)
+        
+        print("Got a CAN message; starting simulation!")
+
+        battery = SRBattery()
+        oneShotMessages = battery.one_shot_messages()
+        periodicMessages = battery.periodic_messages()
+
+        for msg in oneShotMessages:
+            bus.send(msg)
+
+        if cyclic:
+            # Let python-can (or the interface's hardware, where it supports cyclic sends) handle the timing
+            tasks = [bus.send_periodic(msg, PeriodicMessagePeriods[msg.arbitration_id]) for msg in periodicMessages]
+
+            try:
+                print("Sending messages with python-can cyclic tasks forever...")
+                while 1 == 1:
+                    time.sleep(1)
+                    print(".", end='', flush=True)
+            except KeyboardInterrupt:
+                for task in tasks:
+                    task.stop()
+                print()
+                print('Done.')
+            return
+
+        scheduler = PeriodicScheduler(bus, periodicMessages)
+
+        # Print a '.' once a second, to show _something_ is happening
+        def tick(entry):
+            if entry.msg.arbitration_id == 0x0B57ED10 and entry.sends % 4 == 0:
+                print(".", end='', flush=True)
+
+        try:
+            print("Sending messages at their documented rates forever...")
+            scheduler.run(tick)
         except KeyboardInterrupt:
             print()
+            scheduler.print_jitter()
             print('Done.')
 
 
 
 if __name__ == "__main__":
-    tx()
+    print("Boosted SR Battery Emulator, v1")
+    print("https://github.com/rscullin/beambreak")
+    print()
+
+    parser = argparse.ArgumentParser(
+        prog='sr_battery_emulator.py',
+        description='Emulates enough of a Boosted SR Battery for the ESC to let the motors engage.')
+
+    parser.add_argument('-i',
+                        '--interface',
+                        help='Name of the `python-can` interface to use. Defaults to `slcan`',
+                        default="slcan")
+    parser.add_argument('-c',
+                        '--channel',
+                        help='"Channel" of the `python-can` interface to use. If you are using `slcan`, this is the '
+                             'path to the serial adapter.',
+                        default="/dev/tty.usbmodem14101")
+    parser.add_argument('-b',
+                        '--bus',
+                        help='Emulate one SR battery per bus, all from this process. Give `interface:channel` (or '
+                             'just `channel` to use `--interface`) once per battery, ex: `-b socketcan:vcan0 -b '
+                             'socketcan:vcan1`. Overrides `--channel`.',
+                        action='append')
+    parser.add_argument('--cyclic',
+                        help='Use python-can cyclic send tasks (hardware cyclic sends, where the interface supports '
+                             'them) instead of the built-in scheduler. No jitter report in this mode.',
+                        default=False,
+                        action='store_true')
+
+    args = parser.parse_args()
+
+    print("Starting up...")
+
+    if args.bus:
+        fleet = [parse_bus(value, args.interface) for value in args.bus]
+        try:
+            asyncio.run(run_fleet(fleet))
+        except KeyboardInterrupt:
+            print()
+            print('Done.')
+    else:
+        tx(args.interface, args.channel, args.cyclic)
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+import argparse
+import collections
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import can
+import numpy as np
+
+from can_filters import open_bus
+from dbc_decoder import DbcDatabase, DbcMessage, DbcSignal, load_dbc
+from log_index import message_keys
+
+# Released under the MIT License. Copyright (c) 2023 Robert Scullin.
+# https://beambreak.org / https://github.com/rscullin/beambreak
+
+# pip3 install python_can numpy
+
+# Live pack telemetry with bounded memory, for long bench sessions.
+#
+# Decodes, as they arrive:
+#  - 0x10034450, the XR cell summary (lowest / highest cell and pack voltage -- see `xr_battery_util.py`)
+#  - SR_Battery_Info_10, the SR cell summary, and SR_Battery_Info_14, the SR State of Charge (see SR_Battery.dbc)
+#
+# Every signal is kept at three resolutions, each in a preallocated ring that overwrites its oldest entries:
+#  - raw samples (the last hour or so, at the SR's 4 per second)
+#  - 1 second buckets (6 hours), and 1 minute buckets (a month) -- each with the min, max, mean and sample count
+# So memory use is fixed when the pipeline starts, however long it runs.
+#
+# `TelemetryPipeline` is a python-can Listener. Its `on_message_received()` only checks the ID (a mask compare and a
+# set lookup), and copies the frames it wants into a bounded queue -- when the queue is full, the oldest frame is
+# evicted, since the newest readings matter most. Decoding (with `dbc_decoder`, a batch at a time) and downsampling
+# happen on its own thread, so a capture loop never waits on them.
+#
+# The current values and history can be saved as JSON (`export_json()`), or served to a local viewer over HTTP
+# (`serve()`) as JSON:
+#  /current                                      latest value of every signal
+#  /series?name=SR_Battery_Info_10.PackVoltage&resolution=1s&since=<epoch seconds>
+#  /signals                                      signal names, with units
+#
+# `boosted_logger.py --telemetry` runs the pipeline alongside a capture, or run this script on its own.
+
+XR_CELL_SUMMARY = DbcMessage(0x10034450, "XR_Cell_Summary", 8, "XR_Battery")
+XR_CELL_SUMMARY.signals = [
+    DbcSignal("LowestCellVoltage", 0, 16, True, False, 0.001, 0.0, "V"),
+    DbcSignal("HighestCellVoltage", 16, 16, True, False, 0.001, 0.0, "V"),
+    DbcSignal("PackVoltage", 32, 16, True, False, 0.001, 0.0, "V"),
+]
+
+SR_MESSAGES = ("SR_Battery_Info_10", "SR_Battery_Info_14")
+
+DEFAULT_DBC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SR_Battery.dbc")
+
+RESOLUTIONS = {
+    # name: (bucket seconds, ring capacity)
+    "raw": (None, 16384),
+    "1s": (1, 21600),
+    "1m": (60, 43200),
+}
+
+SAMPLE_DTYPE = np.dtype([("timestamp", "<f8"), ("value", "<f8")])
+BUCKET_DTYPE = np.dtype([("timestamp", "<f8"), ("min", "<f8"), ("max", "<f8"), ("mean", "<f8"), ("count", "<u4")])
+
+
+class Ring:
+    """
+    Fixed-capacity ring of records, preallocated.
+    """
+
+    def __init__(self, capacity: int, dtype):
+        self.records = np.zeros(capacity, dtype=dtype)
+        self.head = 0
+        self.count = 0
+
+    def append(self, record):
+        self.records[self.head] = record
+        self.head = (self.head + 1) % len(self.records)
+        self.count = min(self.count + 1, len(self.records))
+
+    def to_array(self, since: float = None):
+        """
+        A copy of the contents, oldest first, optionally only from `since` on.
+        """
+        if self.count < len(self.records):
+            ordered = self.records[:self.count].copy()
+        else:
+            ordered = np.concatenate([self.records[self.head:], self.records[:self.head]])
+
+        if since is not None:
+            ordered = ordered[ordered["timestamp"] >= since]
+        return ordered
+
+
+class Bucket:
+    __slots__ = ("start", "minimum", "maximum", "total", "count")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value: float):
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        self.total = self.total + value
+        self.count = self.count + 1
+
+    def record(self):
+        return self.start, self.minimum, self.maximum, self.total / self.count, self.count
+
+
+class SignalHistory:
+    """
+    One signal, at every resolution in `RESOLUTIONS`.
+    """
+
+    def __init__(self, unit: str = ""):
+        self.unit = unit
+        self.last = None
+
+        self.raw = Ring(RESOLUTIONS["raw"][1], SAMPLE_DTYPE)
+        self.rings = {name: Ring(capacity, BUCKET_DTYPE) for name, (seconds, capacity) in RESOLUTIONS.items()
+                      if seconds is not None}
+        self.buckets = {name: None for name in self.rings}
+
+    def add(self, timestamp: float, value: float):
+        self.last = (timestamp, value)
+        self.raw.append((timestamp, value))
+
+        for name, ring in self.rings.items():
+            seconds = RESOLUTIONS[name][0]
+            start = timestamp - timestamp % seconds
+
+            bucket = self.buckets[name]
+            if bucket is None or start != bucket.start:
+                if bucket is not None:
+                    ring.append(bucket.record())
+                bucket = Bucket(start)
+                self.buckets[name] = bucket
+            bucket.add(value)
+
+    def history(self, resolution: str = "raw", since: float = None):
+        if resolution == "raw":
+            return self.raw.to_array(since)
+
+        history = self.rings[resolution].to_array(since)
+        # Include the bucket that's still filling
+        bucket = self.buckets[resolution]
+        if bucket is not None and (since is None or bucket.start >= since):
+            history = np.append(history, np.array([bucket.record()], dtype=BUCKET_DTYPE))
+        return history
+
+
+class TelemetryPipeline(can.Listener):
+
+    def __init__(self, dbc_path=DEFAULT_DBC, max_queued: int = 65536):
+        sr_database = load_dbc(dbc_path)
+
+        self.database = DbcDatabase()
+        self.database.messages[XR_CELL_SUMMARY.frame_id] = XR_CELL_SUMMARY
+        for name in SR_MESSAGES:
+            message = sr_database.message_by_name(name)
+            self.database.messages[message.frame_id] = message
+
+        # SR IDs match exactly, the XR summary by its normalized ID
+        self.wanted_sr = frozenset(message.frame_id for message in self.database.messages.values()
+                                   if message is not XR_CELL_SUMMARY)
+
+        self.signals = {}
+        for message in self.database.messages.values():
+            for signal in message.signals:
+                self.signals[f"{message.name}.{signal.name}"] = SignalHistory(signal.unit)
+
+        # Frames waiting to be decoded -- bounded, so a stalled decoder can't grow memory either
+        self.queue = collections.deque(maxlen=max_queued)
+        self.frames_queued = 0
+        self.frames_evicted = 0
+        self.frames_decoded = 0
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self.decode_loop, name="telemetry_decoder", daemon=True)
+        self.worker.start()
+
+        self.server = None
+
+    def on_message_received(self, msg: can.Message) -> None:
+        arbitration_id = msg.arbitration_id
+        if arbitration_id & 0xFF0FFFF0 != 0x10034450 and arbitration_id not in self.wanted_sr:
+            return
+
+        # A full deque evicts its oldest frame to make room for this one
+        if len(self.queue) == self.queue.maxlen:
+            self.frames_evicted = self.frames_evicted + 1
+        # The frame may be modified after this returns (ex: `LogSink` normalizes IDs), so copy what's needed
+        self.queue.append((msg.timestamp, arbitration_id, bytes(msg.data).ljust(8, b"\0")[:8]))
+        self.frames_queued = self.frames_queued + 1
+
+    def decode_loop(self):
+        while not self.stop_event.is_set():
+            self.stop_event.wait(0.1)
+            self.decode_pending()
+
+    def decode_pending(self):
+        frames = []
+        while self.queue:
+            frames.append(self.queue.popleft())
+        if not frames:
+            return
+
+        timestamps = np.fromiter((frame[0] for frame in frames), dtype=np.float64, count=len(frames))
+        ids = np.fromiter((frame[1] for frame in frames), dtype=np.uint32, count=len(frames))
+        data = np.frombuffer(b"".join(frame[2] for frame in frames), dtype=np.uint8).reshape(-1, 8)
+
+        decoded = self.database.decode(timestamps, message_keys(ids), data)
+
+        with self.lock:
+            for message_name, columns in decoded.items():
+                message_timestamps = columns["timestamp"].tolist()
+                for signal_name, values in columns.items():
+                    if signal_name == "timestamp":
+                        continue
+                    history = self.signals[f"{message_name}.{signal_name}"]
+                    for timestamp, value in zip(message_timestamps, values.tolist()):
+                        history.add(timestamp, float(value))
+
+            self.frames_decoded = self.frames_decoded + len(frames)
+
+    def current(self) -> dict:
+        with self.lock:
+            return {name: {"timestamp": history.last[0], "value": history.last[1], "unit": history.unit}
+                    for name, history in self.signals.items() if history.last is not None}
+
+    def history(self, name: str, resolution: str = "raw", since: float = None):
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {tuple(RESOLUTIONS)}")
+        with self.lock:
+            return self.signals[name].history(resolution, since)
+
+    def to_dict(self, resolutions=("1s", "1m")) -> dict:
+        return {
+            "frames_decoded": self.frames_decoded,
+            "frames_evicted": self.frames_evicted,
+            "current": self.current(),
+            "series": {name: {resolution: {field: self.history(name, resolution)[field].tolist()
+                                           for field in BUCKET_DTYPE.names}
+                              for resolution in resolutions}
+                       for name in self.signals},
+        }
+
+    def export_json(self, path, resolutions=("1s", "1m")):
+        with open(path, "w") as output:
+            json.dump(self.to_dict(resolutions), output)
+
+    def print_summary(self):
+        current = self.current()
+        for name in sorted(current):
+            print(f"{name:<40} {current[name]['value']:10.3f} {current[name]['unit']}")
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """
+        Serves the telemetry as JSON on http://host:port/ from a background thread.
+        """
+        pipeline = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                query = urllib.parse.parse_qs(url.query)
+
+                try:
+                    if url.path == "/current":
+                        body = pipeline.current()
+                    elif url.path == "/signals":
+                        body = {name: history.unit for name, history in pipeline.signals.items()}
+                    elif url.path == "/series":
+                        since = float(query["since"][0]) if "since" in query else None
+                        history = pipeline.history(query["name"][0], query.get("resolution", ["raw"])[0], since)
+                        body = {field: history[field].tolist() for field in history.dtype.names}
+                    else:
+                        self.send_error(404)
+                        return
+                except (KeyError, ValueError) as error:
+                    self.send_error(400, str(error))
+                    return
+
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="telemetry_server", daemon=True).start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.worker.join()
+        self.decode_pending()
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+if __name__ == "__main__":
+
+    print("Boosted Board Pack Telemetry v1")
+    print("https://beambreak.org / https://github.com/rscullin/beambreak")
+    print("")
+
+    parser = argparse.ArgumentParser(
+        prog='telemetry.py',
+        description='Decodes cell voltages and State of Charge from a live bus, keeps their history in fixed memory, '
+                    'and serves it as JSON.')
+
+    parser.add_argument('-i',
+                        '--interface',
+                        help='Name of the `python-can` interface to use. Defaults to `slcan`',
+                        default="slcan")
+    parser.add_argument('-c',
+                        '--channel',
+                        help='"Channel" of the `python-can` interface to use. If you are using `slcan`, this is the '
+                             'path to the serial adapter.',
+                        required=True)
+    parser.add_argument('-p',
+                        '--port',
+                        help='Serve the telemetry as JSON on this localhost port (ex: 8050)',
+                        type=int)
+    parser.add_argument('-e',
+                        '--export',
+                        help='Save the telemetry as JSON to this file when stopped')
+    parser.add_argument('--interval',
+                        help='Seconds between printed summaries. Defaults to 10.',
+                        type=float,
+                        default=10.0)
+
+    args = parser.parse_args()
+
+    telemetry = TelemetryPipeline()
+    if args.port:
+        telemetry.serve(args.port)
+        print(f"Serving telemetry on http://127.0.0.1:{args.port}/current")
+
+    with open_bus(args.interface, args.channel) as bus:
+        print(f"CAN Adapter Initialized! {args.interface} at {args.channel}")
+
+        notifier = can.Notifier(bus, [telemetry])
+        try:
+            while True:
+                time.sleep(args.interval)
+                print()
+                telemetry.print_summary()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            notifier.stop()
+            telemetry.stop()
+
+    if args.export:
+        telemetry.export_json(args.export)
+        print(f"Telemetry saved as [{args.export}]")
+
+    sys.exit()
+
+
+# MIT License
+#
+# Copyright (c) 2023 Robert Scullin
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
\ No newline at end of file
@@ -0,0 +1,108 @@
+import pytest
+
+from battery_cli import AfeCellsResult, CliResponseParser, CommandResult, is_cli_frame, parse_cell_line
+
+
+def cell_output(count: int, line_format: str = "Cell {cell}: {mv}mV") -> bytes:
+    return "".join(line_format.format(cell=cell, mv=3700 + cell) + "\r\n" for cell in range(1, count + 1)).encode()
+
+
+def test_is_cli_frame():
+    assert is_cli_frame(0x10034110)
+    assert not is_cli_frame(0x10034450)
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("Cell 3: 3712mV", (3, 3712)),
+    ("C03 3712", (3, 3712)),
+    ("cell #12 = 3.712V", (12, 3712)),
+    ("Cell 1: 3.7", (1, 3700)),
+    ("Cell 4: 12mV", None),
+    ("Pack 45012mV", None),
+    ("", None),
+])
+def test_parse_cell_line(line, expected):
+    assert parse_cell_line(line) == expected
+
+
+def test_afe_cells_completes_on_the_last_cell():
+    parser = CliResponseParser(cell_count=13)
+    parser.expect("getafecells")
+
+    output = b"GETAFECELLS\r\n" + cell_output(13)
+    # Split across frames, mid line
+    for start in range(0, len(output), 8):
+        parser.feed(output[start:start + 8])
+
+    assert parser.complete
+    assert isinstance(parser.result, AfeCellsResult)
+    assert parser.result.cells_mv == [3700 + cell for cell in range(1, 14)]
+    assert (parser.result.min_mv, parser.result.max_mv, parser.result.delta_mv) == (3701, 3713, 12)
+    assert parser.result.total_mv == sum(3700 + cell for cell in range(1, 14))
+
+
+def test_afe_cells_incomplete_until_every_cell():
+    parser = CliResponseParser(cell_count=13)
+    parser.expect("GETAFECELLS")
+    parser.feed(cell_output(12))
+
+    assert not parser.complete
+
+    result = parser.finish()
+    assert isinstance(result, AfeCellsResult)
+    assert len(result.cells_mv) == 12
+
+
+def test_afe_cells_completes_on_a_prompt():
+    parser = CliResponseParser(cell_count=13)
+    parser.expect("GETAFECELLS")
+    parser.feed(cell_output(2, "C{cell:02d} {mv}") + b"> ")
+
+    assert parser.complete
+    assert parser.result.cells_mv == [3701, 3702]
+
+
+def test_afe_cells_without_cells():
+    parser = CliResponseParser()
+    parser.expect("GETAFECELLS")
+    parser.feed(b"Unknown command\r\n> ")
+
+    assert parser.result == CommandResult("GETAFECELLS", ["Unknown command"])
+
+
+def test_other_command_completes_on_first_line():
+    parser = CliResponseParser()
+    parser.expect("PFAILRESET")
+
+    assert parser.feed(b"PFAILRESET\r\n") == ["PFAILRESET"]
+    assert not parser.complete
+
+    parser.feed(b"PFAIL cleared\r\nignored\r\n")
+    assert parser.result == CommandResult("PFAILRESET", ["PFAIL cleared"])
+
+
+def test_output_before_expect_is_ignored():
+    parser = CliResponseParser()
+    parser.feed(b"Cell 1: 3700mV\r\n")
+    parser.expect("REBOOT")
+
+    assert not parser.complete
+    assert parser.finish() == CommandResult("REBOOT", [])
+
+
+def test_expect_discards_the_unfinished_response():
+    parser = CliResponseParser(cell_count=13)
+    parser.expect("GETAFECELLS")
+    parser.feed(cell_output(5))
+    parser.expect("GETAFECELLS")
+
+    assert parser.cells == {}
+    assert not parser.complete
+
+
+def test_runaway_line_is_bounded():
+    parser = CliResponseParser()
+    lines = parser.feed(b"x" * 300)
+
+    assert len(lines) == 1
+    assert len(parser.buffer) == 0
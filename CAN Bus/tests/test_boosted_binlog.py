@@ -0,0 +1,127 @@
+import can
+import pytest
+
+from boosted_binlog import (HEADER, RECORD, BinaryLogReader, BinaryLogWriter, binary_to_log, log_to_binary,
+                            pack_message, unpack_message)
+
+FRAMES = [
+    can.Message(timestamp=1700000000.25, arbitration_id=0x10374203, data=[1, 2, 3, 4, 5, 6, 7, 8]),
+    can.Message(timestamp=1700000000.5, arbitration_id=0x0B57ED10, data=[0xAA, 0xBB], is_rx=False),
+    can.Message(timestamp=1700000000.75, arbitration_id=0x123, is_extended_id=False, data=[]),
+    can.Message(timestamp=1700000001.0, arbitration_id=0x10046091, is_remote_frame=True, dlc=4),
+    can.Message(timestamp=1700000001.25, arbitration_id=0x20000004, is_error_frame=True, data=[0] * 8),
+]
+
+
+def assert_same_frame(actual: can.Message, expected: can.Message):
+    assert actual.timestamp == expected.timestamp
+    assert actual.arbitration_id == expected.arbitration_id
+    assert actual.is_extended_id == expected.is_extended_id
+    assert actual.is_remote_frame == expected.is_remote_frame
+    assert actual.is_error_frame == expected.is_error_frame
+    assert actual.is_rx == expected.is_rx
+    assert actual.dlc == expected.dlc
+    if not expected.is_remote_frame:
+        assert bytes(actual.data) == bytes(expected.data)
+
+
+def write_frames(path, frames=FRAMES):
+    writer = BinaryLogWriter(str(path), frames[0].timestamp)
+    for msg in frames:
+        writer.on_message_received(msg)
+    writer.stop()
+
+
+def test_record_round_trip():
+    for msg in FRAMES:
+        record = pack_message(msg)
+        assert len(record) == RECORD.size
+        assert_same_frame(unpack_message(record), msg)
+
+
+def test_file_round_trip(tmp_path):
+    path = tmp_path / "capture.bblog"
+    write_frames(path)
+
+    assert path.stat().st_size == HEADER.size + len(FRAMES) * RECORD.size
+
+    with BinaryLogReader(str(path)) as reader:
+        assert reader.start_time == FRAMES[0].timestamp
+        assert len(reader) == len(FRAMES)
+        for actual, expected in zip(reader, FRAMES):
+            assert_same_frame(actual, expected)
+
+
+def test_columns(tmp_path):
+    path = tmp_path / "capture.bblog"
+    write_frames(path)
+
+    with BinaryLogReader(str(path)) as reader:
+        assert reader.timestamps.tolist() == [msg.timestamp for msg in FRAMES]
+        assert reader.arbitration_ids.tolist() == [msg.arbitration_id for msg in FRAMES]
+        assert reader.dlcs.tolist() == [msg.dlc for msg in FRAMES]
+        assert reader.data[0].tolist() == [1, 2, 3, 4, 5, 6, 7, 8]
+        # Zero padded past the DLC
+        assert reader.data[1].tolist() == [0xAA, 0xBB, 0, 0, 0, 0, 0, 0]
+        assert reader.normalized_ids[0] == 0x10374203 & 0xFF0FFFF0
+
+
+def test_truncated_record_ignored(tmp_path):
+    path = tmp_path / "capture.bblog"
+    write_frames(path)
+    with open(path, "ab") as file:
+        file.write(pack_message(FRAMES[0])[:10])
+
+    with BinaryLogReader(str(path)) as reader:
+        assert len(reader) == len(FRAMES)
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.bblog"
+    path.write_bytes(b"")
+
+    with pytest.raises(ValueError, match="empty or truncated"):
+        BinaryLogReader(str(path))
+
+
+def test_not_a_bblog(tmp_path):
+    path = tmp_path / "capture.bblog"
+    path.write_bytes(b"(1700000000.000000) can0 10374200#00\n")
+
+    with pytest.raises(ValueError, match="not a .bblog"):
+        BinaryLogReader(str(path))
+
+
+def test_close_with_a_view_held(tmp_path):
+    path = tmp_path / "capture.bblog"
+    write_frames(path)
+
+    reader = BinaryLogReader(str(path))
+    timestamps = reader.timestamps
+    reader.close()
+
+    assert timestamps.tolist() == [msg.timestamp for msg in FRAMES]
+
+
+def test_log_conversion_round_trip(tmp_path):
+    frames = [msg for msg in FRAMES if not msg.is_remote_frame and not msg.is_error_frame]
+    for msg in frames:
+        msg.channel = "can0"
+
+    log_file = tmp_path / "capture.log"
+    writer = can.CanutilsLogWriter(str(log_file))
+    for msg in frames:
+        writer.on_message_received(msg)
+    writer.stop()
+
+    assert log_to_binary(str(log_file), str(tmp_path / "capture.bblog")) == len(frames)
+    assert binary_to_log(str(tmp_path / "capture.bblog"), str(tmp_path / "back.log")) == len(frames)
+
+    original = list(can.CanutilsLogReader(str(log_file)))
+    converted = list(can.CanutilsLogReader(str(tmp_path / "back.log")))
+    assert len(converted) == len(original)
+    for actual, expected in zip(converted, original):
+        assert actual.timestamp == pytest.approx(expected.timestamp)
+        assert actual.arbitration_id == expected.arbitration_id
+        assert actual.is_extended_id == expected.is_extended_id
+        assert bytes(actual.data) == bytes(expected.data)
@@ -0,0 +1,116 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+from dbc_decoder import DbcDatabase, DbcMessage, DbcSignal, load_dbc, parse_dbc
+
+SR_DBC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "SR_Battery.dbc")
+
+
+def reference_value(data: bytes, start_bit: int, length: int, little_endian: bool, signed: bool) -> int:
+    """
+    Bit by bit decode of one signal, straight from the DBC bit numbering.
+    """
+    value = 0
+    if little_endian:
+        for bit in range(length):
+            position = start_bit + bit
+            value = value | (((data[position // 8] >> (position % 8)) & 1) << bit)
+    else:
+        # Motorola: MSB first, walking down each byte and on to the top of the next
+        position = start_bit
+        for _ in range(length):
+            value = (value << 1) | ((data[position // 8] >> (position % 8)) & 1)
+            position = position + 15 if position % 8 == 0 else position - 1
+
+    if signed and value & (1 << (length - 1)):
+        value = value - (1 << length)
+    return value
+
+
+def decode_one(signal: DbcSignal, frames):
+    data = np.array([list(frame) for frame in frames], dtype=np.uint8)
+    raw_le = np.ascontiguousarray(data).view("<u8")[:, 0]
+    return signal.extract(raw_le, raw_le.byteswap())
+
+
+def random_frames(count: int, seed: int = 1):
+    generator = random.Random(seed)
+    return [bytes(generator.randrange(256) for _ in range(8)) for _ in range(count)]
+
+
+@pytest.mark.parametrize("signed", [False, True])
+def test_intel_matches_reference(signed):
+    frames = random_frames(64)
+    for start_bit, length in [(0, 8), (0, 16), (4, 12), (13, 7), (32, 32), (0, 64), (63, 1)]:
+        signal = DbcSignal("Signal", start_bit, length, True, signed, 1, 0)
+        expected = [reference_value(frame, start_bit, length, True, signed) for frame in frames]
+        assert decode_one(signal, frames).tolist() == expected, (start_bit, length)
+
+
+@pytest.mark.parametrize("signed", [False, True])
+def test_motorola_matches_reference(signed):
+    frames = random_frames(64)
+    # (MSB start bit, length) -- byte aligned, crossing bytes, and ending mid-byte
+    for start_bit, length in [(7, 8), (7, 16), (23, 16), (3, 4), (12, 10), (39, 24), (7, 64), (0, 1)]:
+        signal = DbcSignal("Signal", start_bit, length, False, signed, 1, 0)
+        expected = [reference_value(frame, start_bit, length, False, signed) for frame in frames]
+        assert decode_one(signal, frames).tolist() == expected, (start_bit, length)
+
+
+def test_motorola_big_endian_word():
+    # A 16 bit Motorola signal starting at bit 7 is bytes 0 and 1, most significant first
+    signal = DbcSignal("Word", 7, 16, False, False, 1, 0)
+    assert decode_one(signal, [bytes([0x12, 0x34, 0, 0, 0, 0, 0, 0])]).tolist() == [0x1234]
+
+
+def test_scaling():
+    signal = DbcSignal("Voltage", 0, 16, True, True, 0.001, -1.5, "V")
+    values = decode_one(signal, [bytes([0xE8, 0x03, 0, 0, 0, 0, 0, 0]), bytes([0x18, 0xFC, 0, 0, 0, 0, 0, 0])])
+    assert values.tolist() == pytest.approx([-0.5, -2.5])
+
+
+def test_database_matches_ids_and_pads_short_frames():
+    database = DbcDatabase()
+    message = DbcMessage(0x10034450, "Summary", 8, "XR_Battery")
+    message.signals = [DbcSignal("Low", 0, 16, True, False, 1, 0)]
+    database.messages[message.frame_id] = message
+
+    timestamps = np.array([1.0, 2.0, 3.0])
+    ids = np.array([0x10034450, 0x10034451, 0x10034450], dtype=np.uint32)
+    data = np.array([[0x01, 0x02, 0, 0], [0xFF, 0xFF, 0, 0], [0x03, 0x04, 0, 0]], dtype=np.uint8)
+
+    # IDs match exactly by default
+    assert database.decode(timestamps, ids, data)["Summary"]["Low"].tolist() == [0x0201, 0x0403]
+
+    decoded = database.decode(timestamps, ids, data, id_mask=0xFF0FFFF0)["Summary"]
+    assert decoded["timestamp"].tolist() == [1.0, 2.0, 3.0]
+    assert decoded["Low"].tolist() == [0x0201, 0xFFFF, 0x0403]
+
+
+def test_parse_dbc():
+    database = parse_dbc('BO_ 2147483921 Test: 8 ESC\n'
+                         ' SG_ Counter : 7|8@0- (1,0) [0|0] ""  BMS\n'
+                         ' SG_ Level : 8|16@1+ (0.5,10) [0|0] "%"  BMS\n')
+
+    message = database.messages[0x111]
+    assert message.name == "Test"
+    counter, level = message.signals
+    assert (counter.start_bit, counter.length, counter.little_endian, counter.signed) == (7, 8, False, True)
+    assert (level.factor, level.offset, level.unit) == (0.5, 10.0, "%")
+
+
+def test_sr_battery_info_10():
+    database = load_dbc(SR_DBC)
+    message = database.message_by_name("SR_Battery_Info_10")
+    assert message.frame_id == 0x0B57ED10
+
+    # 3.500V lowest cell, 4.100V highest, 45.000V pack
+    data = np.array([[0xAC, 0x0D, 0x04, 0x10, 0xC8, 0xAF, 0, 0]], dtype=np.uint8)
+    decoded = database.decode(np.array([1.0]), np.array([0x0B57ED10], dtype=np.uint32), data)["SR_Battery_Info_10"]
+
+    assert decoded["LowestCellVoltage"].tolist() == pytest.approx([3.5])
+    assert decoded["HigestCellVoltage"].tolist() == pytest.approx([4.1])
+    assert decoded["PackVoltage"].tolist() == pytest.approx([45.0])
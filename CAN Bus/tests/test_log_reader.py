@@ -0,0 +1,99 @@
+import random
+
+import can
+import numpy as np
+import pytest
+
+from log_reader import iter_log, parse_lines, read_log
+
+
+def random_frames(count: int, seed: int = 1):
+    generator = random.Random(seed)
+    frames = []
+    for index in range(count):
+        extended = generator.random() < 0.9
+        frames.append(can.Message(timestamp=1700000000.0 + index * 0.000731,
+                                  arbitration_id=generator.randrange(0x20000000 if extended else 0x800),
+                                  is_extended_id=extended,
+                                  is_rx=generator.random() < 0.8,
+                                  channel="can0",
+                                  data=bytes(generator.randrange(256) for _ in range(generator.randrange(9)))))
+    return frames
+
+
+def write_log(path, frames):
+    writer = can.CanutilsLogWriter(str(path))
+    for msg in frames:
+        writer.on_message_received(msg)
+    writer.stop()
+
+
+def reference_columns(path):
+    frames = list(can.CanutilsLogReader(str(path)))
+    data = np.zeros((len(frames), 8), dtype=np.uint8)
+    for row, msg in enumerate(frames):
+        data[row, :msg.dlc] = list(msg.data)
+    return ([msg.timestamp for msg in frames], [msg.arbitration_id for msg in frames], [msg.dlc for msg in frames],
+            data)
+
+
+def assert_matches_reference(columns, path, normalize: bool = False):
+    timestamps, ids, dlcs, data = reference_columns(path)
+    if normalize:
+        ids = [arbitration_id & 0xFF0FFFF0 for arbitration_id in ids]
+
+    assert columns.timestamps.tolist() == pytest.approx(timestamps, abs=1e-6)
+    assert columns.arbitration_ids.tolist() == ids
+    assert columns.dlcs.tolist() == dlcs
+    assert np.array_equal(columns.data, data)
+
+
+@pytest.fixture
+def capture(tmp_path):
+    path = tmp_path / "capture.log"
+    write_log(path, random_frames(2000))
+    return path
+
+
+def test_read_log_matches_canutils_reader(capture):
+    assert_matches_reference(read_log(str(capture), workers=1), capture)
+
+
+def test_parallel_chunks_keep_file_order(capture):
+    columns = read_log(str(capture), workers=2, chunk_size=4096)
+    assert_matches_reference(columns, capture)
+
+
+def test_normalize(capture):
+    assert_matches_reference(read_log(str(capture), workers=1, normalize=True), capture, normalize=True)
+
+
+def test_iter_log(capture):
+    chunks = list(iter_log(str(capture), chunk_size=1000))
+    assert len(chunks) > 1
+
+    columns = [np.concatenate([getattr(chunk, field) for chunk in chunks]) for field in chunks[0]._fields]
+    assert_matches_reference(type(chunks[0])(*columns), capture)
+
+
+def test_fallback_for_unusual_lines(tmp_path):
+    # No R/T suffix on the second line, so the four-field fast path can't be used
+    text = (b"(1700000000.000000) can0 10374200#0102 R\n"
+            b"(1700000000.100000) can0 123#AA\n"
+            b"(1700000000.200000) can0 0B57ED10#0102030405060708 T\n")
+    path = tmp_path / "unusual.log"
+    path.write_bytes(text)
+
+    columns = parse_lines(text)
+    assert columns.arbitration_ids.tolist() == [0x10374200, 0x123, 0x0B57ED10]
+    assert columns.dlcs.tolist() == [2, 1, 8]
+    assert_matches_reference(columns, path)
+
+
+def test_empty(tmp_path):
+    path = tmp_path / "empty.log"
+    path.write_bytes(b"")
+
+    columns = read_log(str(path))
+    assert len(columns.timestamps) == 0
+    assert columns.data.shape == (0, 8)
@@ -0,0 +1,128 @@
+import can
+
+from long_command import LongCommandReassembler, reassemble
+
+# XR CLI channel, Src 3 -> Dest 4
+BASE_ID = 0x10034110
+
+
+def fragment(long_command_id: int, data, timestamp: float, rolling_code: int = 0) -> can.Message:
+    return can.Message(timestamp=timestamp, arbitration_id=BASE_ID | (long_command_id << 20) | rolling_code,
+                       data=data)
+
+
+def feed_all(reassembler, frames):
+    done = []
+    for msg in frames:
+        done.extend(reassembler.feed(msg))
+    return done
+
+
+def test_single_frame():
+    reassembler = LongCommandReassembler()
+    done = reassembler.feed(fragment(3, b"hi", 1.0))
+
+    assert len(done) == 1
+    assert done[0].payload == b"hi"
+    assert done[0].frame_count == 1
+    assert done[0].complete
+    assert not reassembler.pending
+
+
+def test_counts_down_to_zero():
+    reassembler = LongCommandReassembler()
+    done = feed_all(reassembler, [fragment(2, b"ABCDEFGH", 1.0, 0),
+                                  fragment(1, b"IJKLMNOP", 1.01, 1),
+                                  fragment(0, b"QRSTUVWX", 1.02, 2)])
+
+    assert len(done) == 1
+    message = done[0]
+    assert message.payload == b"ABCDEFGHIJKLMNOPQRSTUVWX"
+    assert message.frame_count == 3
+    assert message.complete
+    assert (message.timestamp, message.end_timestamp) == (1.0, 1.02)
+    # Keyed without the Long Command and Rolling Code bits
+    assert message.arbitration_id == BASE_ID
+
+
+def test_short_fragment_ends_the_message():
+    reassembler = LongCommandReassembler()
+    done = feed_all(reassembler, [fragment(2, b"ABCDEFGH", 1.0), fragment(1, b"IJ", 1.01)])
+
+    assert [(message.payload, message.complete) for message in done] == [(b"ABCDEFGHIJ", True)]
+    assert reassembler.messages_complete == 1
+
+
+def test_next_message_flushes_incomplete():
+    reassembler = LongCommandReassembler()
+    # The second message starts at 2 again, rather than counting down
+    done = feed_all(reassembler, [fragment(2, b"ABCDEFGH", 1.0),
+                                  fragment(1, b"IJKLMNOP", 1.01),
+                                  fragment(2, b"abcdefgh", 1.02),
+                                  fragment(1, b"ij", 1.03)])
+
+    assert [(message.payload, message.complete) for message in done] == [
+        (b"ABCDEFGHIJKLMNOP", False),
+        (b"abcdefghij", True),
+    ]
+    assert reassembler.messages_incomplete == 1
+
+
+def test_single_frame_flushes_incomplete():
+    reassembler = LongCommandReassembler()
+    done = feed_all(reassembler, [fragment(2, b"ABCDEFGH", 1.0), fragment(3, b"ok", 1.01)])
+
+    assert [(message.payload, message.complete) for message in done] == [(b"ABCDEFGH", False), (b"ok", True)]
+
+
+def test_timeout():
+    reassembler = LongCommandReassembler(timeout=0.5)
+    assert reassembler.feed(fragment(2, b"ABCDEFGH", 1.0)) == []
+
+    # Another channel's frame moves time on past the timeout
+    other = can.Message(timestamp=1.6, arbitration_id=0x10374200, data=b"x")
+    done = reassembler.feed(other)
+
+    assert [(message.payload, message.complete) for message in done] == [(b"ABCDEFGH", False), (b"x", True)]
+    assert reassembler.expire(10.0) == []
+
+
+def test_max_pending_flushes_oldest():
+    reassembler = LongCommandReassembler(max_pending=2)
+    frames = [can.Message(timestamp=1.0 + index * 0.01, arbitration_id=0x10200000 | (index << 4), data=b"ABCDEFGH")
+              for index in range(3)]
+    done = feed_all(reassembler, frames)
+
+    assert len(done) == 1
+    assert done[0].arbitration_id == 0x10000000
+    assert not done[0].complete
+    assert len(reassembler.pending) == 2
+
+
+def test_max_payload():
+    reassembler = LongCommandReassembler(max_payload=16)
+    done = feed_all(reassembler, [fragment(2, b"ABCDEFGH", 1.0), fragment(1, b"IJKLMNOP", 1.01)])
+
+    assert [(message.payload, message.complete) for message in done] == [(b"ABCDEFGHIJKLMNOP", False)]
+
+
+def test_sr_ids_pass_through():
+    reassembler = LongCommandReassembler()
+    # 0x0B57ED10 has 0x7 in the Long Command nibble, but isn't a Boosted ID at all
+    done = feed_all(reassembler, [can.Message(timestamp=1.0, arbitration_id=0x0B57ED10, data=b"ABCDEFGH"),
+                                  can.Message(timestamp=1.01, arbitration_id=0x0B57ED14, data=b"IJKLMNOP")])
+
+    assert [(message.arbitration_id, message.payload, message.complete) for message in done] == [
+        (0x0B57ED10, b"ABCDEFGH", True),
+        (0x0B57ED14, b"IJKLMNOP", True),
+    ]
+
+
+def test_reassemble_flushes_at_the_end():
+    frames = [fragment(2, b"ABCDEFGH", 1.0),
+              can.Message(timestamp=1.005, arbitration_id=0x123, is_extended_id=False, data=b"std"),
+              fragment(1, b"IJKLMNOP", 1.01)]
+
+    messages = list(reassemble(frames))
+
+    assert [(message.payload, message.complete) for message in messages] == [(b"ABCDEFGHIJKLMNOP", False)]
@@ -0,0 +1,111 @@
+import random
+
+import can
+import pytest
+
+from boosted_binlog import BinaryLogWriter
+from rolling_code import SENDER_KEYS, RollingCodeMonitor, detect_gaps, load_columns
+
+# Src 3, 4 and 7
+SENDER_IDS = (0x10034450, 0x10042110, 0x10374200)
+
+
+def capture(count: int = 3000, seed: int = 1):
+    """
+    Frames from a few senders with their rolling codes, some dropped, mixed with frames that aren't counted.
+    """
+    generator = random.Random(seed)
+    codes = {arbitration_id: 0 for arbitration_id in SENDER_IDS}
+    frames = []
+
+    for index in range(count):
+        timestamp = 1700000000.0 + index * 0.001
+        roll = generator.random()
+        if roll < 0.05:
+            frames.append(can.Message(timestamp=timestamp, arbitration_id=0x123, is_extended_id=False, data=[1]))
+        elif roll < 0.08:
+            frames.append(can.Message(timestamp=timestamp, arbitration_id=0x10374205, is_error_frame=True,
+                                      data=[0] * 8))
+        elif roll < 0.15:
+            frames.append(can.Message(timestamp=timestamp, arbitration_id=0x0B57ED10 + generator.randrange(5),
+                                      data=[0] * 8))
+        else:
+            arbitration_id = generator.choice(SENDER_IDS)
+            code = codes[arbitration_id]
+            codes[arbitration_id] = (code + 1) & 0xF
+            # Dropped by the adapter, so never makes it into the capture
+            if generator.random() < 0.02:
+                continue
+            frames.append(can.Message(timestamp=timestamp, arbitration_id=arbitration_id | code, data=[code]))
+
+    return frames
+
+
+def monitor_counts(frames, key: str) -> dict:
+    monitor = RollingCodeMonitor(key)
+    for msg in frames:
+        monitor.on_message_received(msg)
+    return {sender: (stats.frames, stats.missing, stats.gaps) for sender, stats in monitor.senders.items()}
+
+
+def gap_counts(results: dict) -> dict:
+    return {sender: (result["frames"], result["missing"], result["gaps"]) for sender, result in results.items()}
+
+
+def test_monitor_counts_drops():
+    frames = [can.Message(timestamp=float(code), arbitration_id=0x10374200 | code) for code in (0, 1, 2, 5, 6)]
+    monitor = RollingCodeMonitor()
+    for msg in frames:
+        monitor.on_message_received(msg)
+
+    stats = monitor.senders[7]
+    assert (stats.frames, stats.missing, stats.gaps) == (5, 2, 1)
+    assert list(stats.recent_gaps) == [(5.0, 2)]
+    assert stats.loss_rate == pytest.approx(2 / 7)
+
+
+def test_wraps_around():
+    frames = [can.Message(timestamp=0.0, arbitration_id=0x10374200 | code) for code in (14, 15, 0, 1)]
+    assert monitor_counts(frames, "src") == {7: (4, 0, 0)}
+
+
+@pytest.mark.parametrize("key", SENDER_KEYS)
+def test_offline_matches_live(tmp_path, key):
+    frames = capture()
+
+    path = tmp_path / "capture.bblog"
+    writer = BinaryLogWriter(str(path))
+    for msg in frames:
+        writer.on_message_received(msg)
+    writer.stop()
+
+    timestamps, arbitration_ids, counted = load_columns(str(path))
+    results = detect_gaps(timestamps, arbitration_ids, key, counted)
+
+    expected = monitor_counts(frames, key)
+    assert gap_counts(results) == expected
+    assert sum(missing for _, missing, _ in expected.values()) > 0
+
+
+def test_offline_from_a_log(tmp_path):
+    frames = [msg for msg in capture() if not msg.is_error_frame]
+    for msg in frames:
+        msg.channel = "can0"
+
+    path = tmp_path / "capture.log"
+    writer = can.CanutilsLogWriter(str(path))
+    for msg in frames:
+        writer.on_message_received(msg)
+    writer.stop()
+
+    timestamps, arbitration_ids, counted = load_columns(str(path))
+    assert gap_counts(detect_gaps(timestamps, arbitration_ids, "src", counted)) == monitor_counts(frames, "src")
+
+
+def test_gap_timestamps():
+    timestamps = [1.0, 2.0, 3.0, 4.0]
+    ids = [0x10374200, 0x10374201, 0x10374204, 0x10374205]
+
+    result = detect_gaps(timestamps, ids)[7]
+    assert result["gap_timestamps"].tolist() == [3.0]
+    assert result["gap_sizes"].tolist() == [2]
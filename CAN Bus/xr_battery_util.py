@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
 import sys
+import time
 import can
 from print_color import print
 from struct import *
 
+from battery_cli import AfeCellsResult, CliResponseParser, is_cli_frame
+from can_filters import apply_filters, exact, group, open_bus, parse_bus
+
 # Released under the MIT License. Copyright (c) 2023 Robert Scullin.
 # https://beambreak.org / https://github.com/rscullin/beambreak
 
@@ -14,10 +19,18 @@ from struct import *
 # It also shows the voltages of all cells, as reported by the TI Battery Monitor ("AFE").
 #
 # If the cell delta is >500mV, the script doesn't bother trying to clear the error.
-# NOTE that the pre-check has the potential to give a false positive -- if a cell is very out of spec (ex: 1.5v),
-# the CAN Bus messages might not include that value in the lowest cell voltage.
+# The pre-check uses the per-cell voltages from the AFE (via `GETAFECELLS`) when they can be parsed. If they can't,
+# it falls back to the CAN Bus summary, which has the potential to give a false positive -- if a cell is very out of
+# spec (ex: 1.5v), the CAN Bus messages might not include that value in the lowest cell voltage.
 # Nothing bad happens if you reset in this state, as the power cycle causes the battery to go back to RLOD.
 #
+# The reset runs as a small state machine (see `XrBatteryService`) -- each step waits for the battery to actually
+# respond (valid cell data after boot, each CLI response, the reboot) with a deadline, rather than for a fixed number
+# of CAN frames, so it takes as long as the battery does. The time spent in each phase is printed as it goes.
+#
+# Several packs can be serviced at once with one CAN adapter per pack -- pass `-b interface:channel` once for each
+# adapter. Each pack runs its own flow concurrently, and a table of results is printed at the end.
+#
 # Technically this clears _all_ faults, but theoretically if they're catastrophic they'll
 # get thrown again.
 #
@@ -27,6 +40,8 @@ from struct import *
 # for more information for your particular adapter.
 #
 # If you're using a `slcan`-based device, the "channel" is the path to the serial port.
+#
+# `-i broker -c <socket path>` attaches to a `can_broker.py` instead, ex: while a logger keeps running.
 
 
 def send_cli_command(can_interface: can.Bus, message: str):
@@ -64,126 +79,357 @@ def send_cli_command(can_interface: can.Bus, message: str):
         can_interface.send(serial_cmd)
 
 
-def util(arguments):
-    with can.interface.Bus(bustype=arguments.interface, channel=arguments.channel, bitrate=250000) as bus:
+# Summary of the lowest/highest/total cell voltages, sent periodically by the battery
+CELL_SUMMARY_ID = 0x10034450
 
-        print(f"CAN Adapter Initialized! {arguments.interface} at {arguments.channel}")
-        print()
-        print("Waiting on CAN msg...")
+# Keep-alive, so that the Battery thinks there's an ESC connected. 0x02 in the first byte powers the battery off.
+KEEP_ALIVE_ID = 0x103434B0
 
-        wait_for_initial_msg = True
+# Enables Message Routing from the Battery to the CAN Bus. Routing doesn't survive a reboot, so it's re-sent every
+# `ROUTING_PERIOD` seconds while waiting for the battery to come back -- otherwise its summaries never would.
+ROUTING_ENABLE_ID = 0x10346090
+ROUTING_PERIOD = 1
 
-        while wait_for_initial_msg:
+# The only frames the flow needs once routing is enabled -- everything else is filtered out in the driver where the
+# backend supports it. The wait for the first frame is unfiltered, as the battery may not route these until then.
+XR_FILTERS = [exact(CELL_SUMMARY_ID), group(channel=0x11)]
 
-            msg = bus.recv(1)
-            if msg is not None:
-                wait_for_initial_msg = False
+# Phase deadlines, in seconds. These are upper bounds -- every phase moves on as soon as its event happens.
+FIRST_FRAME_TIMEOUT = 30
+BOOT_TIMEOUT = 30
+CLI_TIMEOUT = 5
+REBOOT_TIMEOUT = 30
+
+# After `REBOOT`, the battery has rebooted once its cell summaries stop (go quiet for the longer of `REBOOT_SILENCE`
+# and `REBOOT_SILENCE_PERIODS` summary periods) or go invalid, and then valid summaries come back. A gap only counts
+# against the measured summary period, so a slow battery isn't mistaken for a rebooting one.
+REBOOT_SILENCE = 0.5
+REBOOT_SILENCE_PERIODS = 3
 
-        print("Got a message!")
-        print()
-        print("Waiting ~10 seconds for the battery to boot and start sending valid data.")
+
+def routing_message() -> can.Message:
+    return can.Message(arbitration_id=ROUTING_ENABLE_ID, data=[0x01], is_extended_id=True)
+
+
+def summary_is_valid(cell_lowest_mv: int, cell_highest_mv: int, cell_total_mv: int) -> bool:
+    """
+    The battery sends zeroed / nonsense summaries while it's booting.
+    """
+    return 0 < cell_lowest_mv <= cell_highest_mv < 5000 and cell_total_mv >= cell_highest_mv
+
+
+class XrBatteryService:
+    """
+    The RLOD reset flow as an explicit state machine, driven by events on the bus rather than frame counts:
+
+    WAIT_FIRST_FRAME -> WAIT_BOOT ("valid 0x10034450 seen, period measured") -> CHECK_CELLS (`GETAFECELLS` response
+    complete) -> RESET (`PFAILRESET` response complete) -> REBOOT ("summaries stopped or went invalid, then came back")
+    -> DONE
+
+    Each phase has a monotonic deadline, so a quiet bus can't stall it forever and a busy bus can't rush it.
+    """
+
+    def __init__(self, bus: can.BusABC, power_off: bool = False, name: str = "", filter_set=XR_FILTERS,
+                 reboot_timeout: float = REBOOT_TIMEOUT):
+        self.bus = bus
+        self.power_off = power_off
+        self.name = name
+        self.reboot_timeout = reboot_timeout
+
+        # Applied once routing is enabled. `software_filter` is only set if the backend can't filter IDs itself.
+        self.filter_set = filter_set
+        self.software_filter = None
+
+        self.state = "WAIT_FIRST_FRAME"
+        self.phase_started = None
+        self.phase_latencies = {}
+
+        self.cli = CliResponseParser()
+        self.cli_complete = asyncio.Event()
+
+        self.first_frame = asyncio.Event()
+        self.valid_summary = asyncio.Event()
+        self.cell_summary = None
+
+        # Average time between cell summaries, measured before the reboot
+        self.summary_period = None
+        self.last_summary_time = None
+
+        self.rebooting = False
+        self.summaries_stopped = False
+        self.rebooted = asyncio.Event()
+
+    def log(self, text: str, color: str = None):
+        prefix = f"[{self.name}] " if self.name else ""
+        if color is None:
+            print(f"{prefix}{text}")
+        else:
+            print(f"{prefix}{text}", color=color)
+
+    def transition(self, state: str):
+        now = time.monotonic()
+        self.phase_latencies[self.state] = now - self.phase_started
+        self.log(f"{self.state} took {self.phase_latencies[self.state]:.3f}s")
+        self.state = state
+        self.phase_started = now
+
+    def on_frame(self, msg: can.Message):
+        if self.software_filter is not None and not self.software_filter.matches(msg.arbitration_id):
+            return
+
+        self.first_frame.set()
+
+        # Set the Long Command bits and the Rolling Code bits to 0 to make code saner
+        arbitration_id = msg.arbitration_id & 0xFF0FFFF0
+
+        if arbitration_id == CELL_SUMMARY_ID:
+            self.on_summary(unpack('<HHHxx', msg.data))
+
+        # CLI Print handling
+        if is_cli_frame(arbitration_id):
+            for line in self.cli.feed(msg.data):
+                self.log(line, color='blue')
+            if self.cli.complete:
+                self.cli_complete.set()
+
+    def summaries_paused(self, now: float) -> bool:
+        """
+        True if the summaries stopped for long enough to count as a reboot -- slow summaries aren't a reboot.
+        """
+        if self.summary_period is None or self.last_summary_time is None:
+            return False
+        return now - self.last_summary_time >= max(REBOOT_SILENCE, REBOOT_SILENCE_PERIODS * self.summary_period)
+
+    def on_summary(self, summary):
+        now = time.monotonic()
+        valid = summary_is_valid(*summary)
+
+        if self.rebooting:
+            if not valid:
+                self.summaries_stopped = True
+            elif self.summaries_stopped or self.summaries_paused(now):
+                self.rebooted.set()
+        else:
+            if self.last_summary_time is not None:
+                interval = now - self.last_summary_time
+                self.summary_period = interval if self.summary_period is None else \
+                    self.summary_period * 0.75 + interval * 0.25
+
+            # Wait for a second summary, so the period is known before the reboot
+            if valid and self.summary_period is not None and not self.valid_summary.is_set():
+                self.cell_summary = summary
+                self.valid_summary.set()
+
+        self.last_summary_time = now
+
+    async def cli_command(self, command: str):
+        """
+        Sends a CLI command, and waits for its response to complete (or the CLI deadline to pass).
+        """
+        self.cli.expect(command)
+        self.cli_complete.clear()
+        send_cli_command(self.bus, command)
+
+        try:
+            await asyncio.wait_for(self.cli_complete.wait(), CLI_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.log(f"No complete response to `{command}` after {CLI_TIMEOUT}s, continuing.")
+
+        return self.cli.finish()
+
+    async def run(self) -> dict:
+        result = {"name": self.name, "status": "incomplete", "cell_delta_mv": None, "cells_mv": None}
+        started = time.monotonic()
+        self.phase_started = started
+
+        try:
+            await self._run(result)
+        except asyncio.TimeoutError:
+            result["status"] = f"timed out in {self.state}"
+            self.log(f"Timed out in {self.state}, giving up.", color="red")
+
+        result["phase_latencies"] = self.phase_latencies
+        result["total_time"] = time.monotonic() - started
+        return result
+
+    async def _run(self, result: dict):
+        self.log("Waiting on CAN msg...")
+        await asyncio.wait_for(self.first_frame.wait(), FIRST_FRAME_TIMEOUT)
+        self.log("Got a message! Waiting for the battery to boot and start sending valid data.")
+        self.transition("WAIT_BOOT")
 
         # Enable Message Routing from the Battery to the CAN Bus
-        bus.send(can.Message(arbitration_id=0x10346090, data=[0x01], is_extended_id=True))
+        self.bus.send(routing_message())
+
+        self.software_filter = apply_filters(self.bus, self.filter_set)
 
         # Enable periodic keep-alive messages so that the Battery thinks there's an ESC connected
-        bus.send_periodic(can.Message(arbitration_id=0x103434B0,
-                                      data=[0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
-                                      is_extended_id=True
-                                      ), 1)
+        keep_alive = self.bus.send_periodic(can.Message(arbitration_id=KEEP_ALIVE_ID,
+                                                        data=[0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
+                                                        is_extended_id=True
+                                                        ), 1)
 
-        # State management...
-        enable_commands = False
-        checked_voltage = False
-        sent_reset = False
-        should_exit = False
+        try:
+            await self._service(result)
+        finally:
+            keep_alive.stop()
+
+            # Send the command to power off the battery if the user wants -- whether or not the reset went ahead
+            if self.power_off:
+                self.send_power_off()
+
+    def send_power_off(self):
+        # Message routing doesn't survive the reboot
+        self.bus.send(routing_message())
+        self.bus.send(can.Message(
+            arbitration_id=KEEP_ALIVE_ID,
+            data=[0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
+            is_extended_id=True
+        ))
+        self.log("Sent power off.")
+
+    async def _service(self, result: dict):
+        await asyncio.wait_for(self.valid_summary.wait(), BOOT_TIMEOUT)
+        self.transition("CHECK_CELLS")
+
+        cell_lowest_mv, cell_highest_mv, cell_total_mv = self.cell_summary
+        cell_delta = cell_highest_mv - cell_lowest_mv
+
+        self.log(f"== Cell Voltages (CAN summary) ==\n"
+                 f"- Lowest: {cell_lowest_mv}mV\n"
+                 f"- Highest: {cell_highest_mv}mV\n"
+                 f"- Total: {cell_total_mv}mV\n"
+                 f"\n"
+                 f"- Delta: {cell_delta}mV\n")
+
+        afe_cells = await self.cli_command("GETAFECELLS")
+
+        # The CAN summary doesn't always include extremely out of spec cells, so prefer the
+        # AFE's individual cell voltages when they could be read
+        if isinstance(afe_cells, AfeCellsResult):
+            cell_delta = afe_cells.delta_mv
+            result["cells_mv"] = afe_cells.cells_mv
+            self.log(f"\n== Cell Voltages (AFE, {len(afe_cells.cells_mv)} cells) ==\n"
+                     f"- Lowest: {afe_cells.min_mv}mV\n"
+                     f"- Highest: {afe_cells.max_mv}mV\n"
+                     f"- Total: {afe_cells.total_mv}mV\n"
+                     f"\n"
+                     f"- Delta: {cell_delta}mV\n")
+        else:
+            self.log("\n\nNOTE! Couldn't read the individual cell voltages, falling back to the CAN summary.\n"
+                     "For some reason the battery doesn't correctly report extremely out of spec cell voltages via "
+                     "CAN messages.\n")
+
+        result["cell_delta_mv"] = cell_delta
+
+        # The battery uses a 500mV delta as the RLOD condition
+        # If the battery actually has a > 500mV delta but doesn't correctly report it,
+        # resetting the error state will result in the error again on next power cycle
+        if cell_delta >= 500:
+            self.log(f"The cell delta is too high! - {cell_delta}mV "
+                     f"- Resetting can't fix this, so not going to attempt.", color="red")
+            result["status"] = "delta too high"
+            self.transition("DONE")
+            return
+
+        self.log(f"Delta looks good ({cell_delta}mV)!\n", color="green")
+        self.log(f"Sending `PFAILRESET` and restarting the battery.", color="green")
+        self.transition("RESET")
+        await self.cli_command("PFAILRESET")
+
+        self.transition("REBOOT")
+        self.rebooting = True
+        self.summaries_stopped = False
+        self.rebooted.clear()
+        await self.cli_command("REBOOT")
+
+        # The rebooted battery only sends its summaries again once routing is re-enabled
+        routing = self.bus.send_periodic(routing_message(), ROUTING_PERIOD)
+
+        try:
+            await asyncio.wait_for(self.rebooted.wait(), self.reboot_timeout)
+            result["status"] = "reset"
+            self.log(f"Done!", color="green")
+        except asyncio.TimeoutError:
+            result["status"] = "reset, reboot not seen"
+            self.log(f"Reset sent, but didn't see the battery reboot within {self.reboot_timeout}s.", color="red")
+        finally:
+            routing.stop()
+
+        self.transition("DONE")
+
+
+async def service_bus(interface: str, channel: str, power_off: bool, name: str = "",
+                      reboot_timeout: float = REBOOT_TIMEOUT) -> dict:
+    """
+    Opens a bus and runs the RLOD reset flow on it.
+    """
+    bus = open_bus(interface, channel)
 
-        # This is used as a makeshift "timer" throughout the code.
-        # It's not ideal, but it is easy.
-        can_frames_seen = 0
+    with bus:
+        service = XrBatteryService(bus, power_off, name, reboot_timeout=reboot_timeout)
 
+        # Frames are received on python-can's Notifier thread and handed to the event loop
+        notifier = can.Notifier(bus, [service.on_frame], timeout=0.1, loop=asyncio.get_running_loop())
         try:
-            while True:
-                msg = bus.recv(1)
-                if msg is not None:
-
-                    can_frames_seen = can_frames_seen + 1
-
-                    # Set the Long Command bits and the Rolling Code bits to 0 to make code saner
-                    msg.arbitration_id = msg.arbitration_id & 0xFF0FFFF0
-
-                    # Wait for the Battery to boot
-                    if can_frames_seen > 10 * 250:
-                        enable_commands = True
-
-                    if enable_commands and not checked_voltage:
-                        if msg.arbitration_id == 0x10034450:
-                            checked_voltage = True
-                            sent_reset = True
-
-                            send_cli_command(bus, "GETAFECELLS")
-
-                            cell_lowest_mv, cell_highest_mv, cell_total_mv = unpack('<HHHxx', msg.data)
-                            cell_delta = cell_highest_mv - cell_lowest_mv
-
-                            print("\n\nNOTE! For some reason the battery doesn't correctly report extremely out of spec"
-                                  " cell voltages via CAN messages.\n"
-                                  "Check the results of the individual cell voltages for more info.\n")
-
-                            print(f"== Cell Voltages ==\n"
-                                  f"- Lowest: {cell_lowest_mv}mV\n"
-                                  f"- Highest: {cell_highest_mv}mV\n"
-                                  f"- Total: {cell_total_mv}mV\n"
-                                  f"\n"
-                                  f"- Delta: {cell_delta}mV\n")
-
-                            # The battery uses a 500mV delta as the RLOD condition
-                            # If the battery actually has a > 500mV delta but doesn't correctly report it,
-                            # resetting the error state will result in the error again on next power cycle
-                            if cell_delta < 500:
-                                print(f"Delta looks good ({cell_highest_mv - cell_lowest_mv}mV)!\n", color="green")
-                                print(f"Sending `PFAILRESET` and restarting the battery.", color="green")
-                                send_cli_command(bus, "PFAILRESET")
-                                wait_until_frame = can_frames_seen + 1000
-                            else:
-                                print(f"The cell delta is too high! - {cell_highest_mv - cell_lowest_mv}mV "
-                                      f"- Resetting can't fix this, so not going to attempt.\nExiting.", color="red")
-                                # Set a delayed exit so that the CLI output of GETAFECELLS can be presented
-                                wait_until_frame = can_frames_seen + 1000
-                                should_exit = True
-
-                    if sent_reset and not should_exit and can_frames_seen > wait_until_frame:
-                        send_cli_command(bus, "REBOOT")
-                        print(f"Done!", color="green")
-                        wait_until_frame = can_frames_seen + 1000
-                        should_exit = True
-
-                    if should_exit and can_frames_seen > wait_until_frame:
-                        # Send the command to power off the battery if the user wants
-                        if arguments.power_off:
-                            bus.send(can.Message(
-                                arbitration_id=0x103434B0,
-                                data=[0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00],
-                                is_extended_id=True
-                            ))
-                        sys.exit()
-
-                    # CLI Print handling
-                    if msg.arbitration_id & 0x00000FF0 == 0x00000110:
-                        try:
-                            dec = msg.data.decode("ascii")
-                            print(dec, end='', color='blue')
-                        except UnicodeDecodeError:
-                            # This is here to consume any weirdness of non-ascii characters
-                            # This might not even be necessary anymore.
-                            continue
-
-        # Handle ctrl-c
-        except KeyboardInterrupt:
-            print()
-            print("Program interrupted, exiting.")
-            sys.exit()
-            pass  # exit normally
+            return await service.run()
+        finally:
+            notifier.stop()
+
+
+async def service_many(buses: list, power_off: bool) -> list:
+    """
+    Runs the RLOD reset flow on several (interface, channel) buses at once. A bus that fails to open is reported in
+    its result rather than stopping the others.
+    """
+    results = await asyncio.gather(*[service_bus(interface, channel, power_off, channel)
+                                     for interface, channel in buses],
+                                   return_exceptions=True)
+
+    for index, ((interface, channel), result) in enumerate(zip(buses, results)):
+        if isinstance(result, Exception):
+            results[index] = {"name": channel, "status": f"error: {result}", "cell_delta_mv": None,
+                                              "cells_mv": None, "phase_latencies": {}, "total_time": 0.0}
+
+    return results
+
+
+def print_results(results: list):
+    rows = [("Pack", "Status", "Delta", "Lowest", "Highest", "Time")]
+    for result in results:
+        cells = result["cells_mv"]
+        rows.append((result["name"],
+                     result["status"],
+                     f"{result['cell_delta_mv']}mV" if result["cell_delta_mv"] is not None else "-",
+                     f"{min(cells)}mV" if cells else "-",
+                     f"{max(cells)}mV" if cells else "-",
+                     f"{result['total_time']:.2f}s"))
+
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+def util(arguments):
+    if arguments.bus:
+        buses = [parse_bus(value, arguments.interface) for value in arguments.bus]
+
+        print(f"Servicing {len(buses)} packs: {', '.join(channel for _, channel in buses)}")
+        print()
+
+        results = asyncio.run(service_many(buses, arguments.power_off))
+
+        print()
+        print_results(results)
+        return
+
+    print(f"Using {arguments.interface} at {arguments.channel}")
+    print()
+
+    result = asyncio.run(service_bus(arguments.interface, arguments.channel, arguments.power_off))
+
+    print()
+    print(f"Finished ({result['status']}) in {result['total_time']:.2f}s")
 
 
 if __name__ == "__main__":
@@ -213,6 +459,13 @@ if __name__ == "__main__":
                         required=False,
                         default=False,
                         action='store_true')
+    parser.add_argument('-b',
+                        '--bus',
+                        help='Service several packs at once, one per CAN adapter. Give `interface:channel` (or just '
+                             '`channel` to use `--interface`) once per adapter, ex: `-b slcan:/dev/ttyACM0 -b '
+                             'slcan:/dev/ttyACM1`. Overrides `--channel`.',
+                        required=False,
+                        action='append')
 
     args = parser.parse_args()
 